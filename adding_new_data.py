@@ -6,6 +6,8 @@ from tkinter import filedialog, messagebox, ttk
 import re
 import threading
 import time
+from sheet_reader import SheetReader, read_sheet, combine_year_extracts
+from sheet_writer import replace_sheets
 
 class ExcelProcessorApp:
     def __init__(self, root):
@@ -924,29 +926,8 @@ class ExcelProcessorApp:
         # Load new data from the specified sheet
         new_data_df = pd.read_excel(new_data_file, sheet_name=new_data_sheet)
 
-        # Use openpyxl for efficient sheet manipulation
-        wb = load_workbook(workbook)
-        
-        # Remove existing sheet if present
-        if new_data_sheet in wb.sheetnames:
-            wb.remove(wb[new_data_sheet])
-        
-        # Create new sheet
-        ws = wb.create_sheet(new_data_sheet)
-        
-        # Write data efficiently using bulk operations
-        for col_num, column_title in enumerate(new_data_df.columns, 1):
-            ws.cell(row=1, column=col_num, value=column_title)
-        
-        for row_num, row_data in enumerate(new_data_df.values, 2):
-            for col_num, cell_value in enumerate(row_data, 1):
-                ws.cell(row=row_num, column=col_num, value=cell_value)
-        
-        # Move sheet to first position
-        wb._sheets.remove(ws)
-        wb._sheets.insert(0, ws)
-        
-        wb.save(workbook)
+        # Write the rows in bulk as the first sheet; the other sheets are copied over unchanged
+        replace_sheets(workbook, {new_data_sheet: new_data_df}, front=[new_data_sheet])
 
     def update_chuushutsu_sheet(self, workbook, columns_to_extract, new_data_sheet):
         """Update 抽出列 sheet - check for existing year first"""
@@ -1090,7 +1071,7 @@ class ExcelProcessorApp:
         if not columns_to_extract:
             # If no specific columns found, use all columns as fallback
             if sheet_names:
-                sample_df = pd.read_excel(workbook, sheet_name=sheet_names[0])
+                sample_df = read_sheet(workbook, sheet_names[0])
                 columns_to_extract = [col for col in sample_df.columns if col != '調査番号']
 
         if columns_to_extract:
@@ -1137,39 +1118,51 @@ class ExcelProcessorApp:
 
     def create_ketsugou_sheet(self, workbook, sheet_names, columns_to_extract):
         """Create combined sheet efficiently - O(k*m*n) optimized with pandas operations"""
-        ketsugou_df = pd.DataFrame()
-        
-        for sheet in sheet_names:
-            try:
-                # Read sheet data efficiently
-                df = pd.read_excel(workbook, sheet_name=sheet)
-                
-                # Ensure 調査番号 exists for merging
-                if '調査番号' not in df.columns and df.columns.size > 0:
-                    df.insert(0, '調査番号', range(1, len(df) + 1))
-                
-                # Filter columns efficiently using list comprehension
-                available_columns = [col for col in columns_to_extract if col in df.columns]
-                base_columns = ['調査番号'] if '調査番号' in df.columns else []
-                
-                # Select only needed columns
-                selected_cols = base_columns + available_columns
-                df_selected = df[selected_cols].copy()
-                
-                # Rename columns with year prefix (except 調査番号)
-                new_columns = base_columns + [f"{sheet} {col}" for col in available_columns]
-                df_selected.columns = new_columns
-                
-                # Merge efficiently
+        year_extracts = []
+        
+        with SheetReader(workbook) as reader:
+            for sheet in sheet_names:
+                try:
+                    # Stream only 調査番号 and the extract columns out of the year sheet
+                    df = reader.read(sheet, ['調査番号'] + columns_to_extract)
+                    if '調査番号' not in df.columns:
+                        # Row numbers stand in for 調査番号 below, so the whole sheet is needed
+                        df = reader.read(sheet)
+                    
+                    # Ensure 調査番号 exists for merging
+                    if '調査番号' not in df.columns and df.columns.size > 0:
+                        df.insert(0, '調査番号', range(1, len(df) + 1))
+                    
+                    # Filter columns efficiently using list comprehension
+                    available_columns = [col for col in columns_to_extract if col in df.columns]
+                    base_columns = ['調査番号'] if '調査番号' in df.columns else []
+                    
+                    # Select only needed columns
+                    selected_cols = base_columns + available_columns
+                    df_selected = df[selected_cols].copy()
+                    
+                    # Rename columns with year prefix (except 調査番号)
+                    new_columns = base_columns + [f"{sheet} {col}" for col in available_columns]
+                    df_selected.columns = new_columns
+                    
+                    # A sheet without any columns has nothing to join
+                    if base_columns:
+                        year_extracts.append(df_selected)
+                        
+                except Exception as e:
+                    print(f"Error processing sheet {sheet}: {e}")
+                    continue
+        
+        # Join every year on 調査番号 in one step
+        ketsugou_df = combine_year_extracts(year_extracts)
+        if ketsugou_df is None:
+            # Repeated or blank 調査番号: keep the chained merge and its row products
+            ketsugou_df = pd.DataFrame()
+            for df_selected in year_extracts:
                 if ketsugou_df.empty:
                     ketsugou_df = df_selected
                 else:
-                    merge_on = base_columns if base_columns else [ketsugou_df.columns[0]]
-                    ketsugou_df = pd.merge(ketsugou_df, df_selected, on=merge_on, how='outer')
-                    
-            except Exception as e:
-                print(f"Error processing sheet {sheet}: {e}")
-                continue
+                    ketsugou_df = pd.merge(ketsugou_df, df_selected, on='調査番号', how='outer')
         
         return ketsugou_df
 
@@ -1179,7 +1172,7 @@ class ExcelProcessorApp:
         
         for sheet in sheet_names:
             try:
-                df = pd.read_excel(workbook, sheet_name=sheet)
+                df = read_sheet(workbook, sheet)
                 df['Year'] = sheet
                 dfs.append(df)
             except Exception as e:
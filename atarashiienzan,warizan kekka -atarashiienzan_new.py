@@ -4,7 +4,10 @@ from openpyxl import load_workbook
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-import re
+from structure_index import get_structure_index, load_structure_master, build_raw_ekikan_keys
+from year_matrix import (year_result_columns, year_column_mapping, year_value_matrix, weighted_year_matrix,
+                         multiply_by_weights, divide_by_lengths, write_year_matrix, load_year_sheets)
+from sheet_writer import replace_sheets
 
 class EnhancedNewCalculationSheetsApp:
     def __init__(self):
@@ -50,42 +53,16 @@ class EnhancedNewCalculationSheetsApp:
         try:
             if structure_df is None or len(structure_df) == 0:
                 return ''
-                
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
             
-            # First try to match by structure name
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            # If not found by structure name, try by station interval
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
         except Exception as e:
             print(f"Error finding structure number: {e}")
             return ''
     
-    def add_enhanced_columns(self, df, structure_df=None):
+    def add_enhanced_columns(self, df, structure_df=None, structure_numbers=None):
         """Add enhanced columns: 路線名略称 and 構造物番号"""
         enhanced_df = df.copy()
         
@@ -98,19 +75,14 @@ class EnhancedNewCalculationSheetsApp:
         # Add 構造物番号 column
         enhanced_df['構造物番号'] = ''
         
-        if structure_df is not None:
-            for index, row in enhanced_df.iterrows():
-                rosen_name = row.get('路線名', '')
-                kozo_name = row.get('構造物名称', '')
-                
-                # Create ekikan for lookup
-                ekikan = ''
-                if row.get('駅（始）', '') and row.get('駅（至）', ''):
-                    ekikan = f"{row.get('駅（始）', '')}→{row.get('駅（至）', '')}"
-                
-                # Lookup structure number
-                bangou = self.lookup_structure_number(structure_df, rosen_name, kozo_name, ekikan)
-                enhanced_df.at[index, '構造物番号'] = bangou
+        if structure_df is not None and structure_numbers is not None:
+            # 構造物番号 already resolved together with the weights and length
+            enhanced_df['構造物番号'] = list(structure_numbers)
+        elif structure_df is not None and len(structure_df) > 0:
+            # Bulk lookup: join on structure name, then on 駅間 for the unmatched rows
+            structure_index = get_structure_index(structure_df)
+            ekikan_keys = build_raw_ekikan_keys(enhanced_df)
+            enhanced_df['構造物番号'] = structure_index.lookup_structure_numbers(enhanced_df, ekikan_keys)
         
         return enhanced_df
     
@@ -249,7 +221,7 @@ class EnhancedNewCalculationSheetsApp:
             
             # Try to load structure data for enhancements
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+                self.structure_df = load_structure_master(self.workbook_path)
                 print("Found 構造物番号 sheet - enhanced features enabled")
             except:
                 self.structure_df = None
@@ -300,10 +272,14 @@ class EnhancedNewCalculationSheetsApp:
     def execute_calculation_process(self, progress_window):
         """Execute the enhanced calculation process"""
         try:
-            # Load required sheets
-            max_df = pd.read_excel(self.workbook_path, sheet_name='補修無視')
-            hoshuu_df = pd.read_excel(self.workbook_path, sheet_name='補修考慮')
-            structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+            # Load required sheets, converting their year columns to float64 once
+            source_sheets = load_year_sheets(self.workbook_path, ['補修無視', '補修考慮'])
+            max_df = source_sheets['補修無視']
+            hoshuu_df = source_sheets['補修考慮']
+            # Reuse the structure master loaded during validation
+            structure_df = self.structure_df
+            if structure_df is None:
+                structure_df = load_structure_master(self.workbook_path)
             
             # Create enhanced calculation results
             # Sheet 1: 新しい演算(補修無視) - X*A*B*C
@@ -337,34 +313,20 @@ class EnhancedNewCalculationSheetsApp:
         result_df = source_df.copy()
         
         # Find year result columns
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
+        year_columns = year_result_columns(result_df)
         
         print(f"Processing enhanced new calculation {sheet_type} with {len(result_df)} rows")
         
-        # Apply X*A*B*C calculation for each row
-        for index, row in result_df.iterrows():
-            # Get weight values from structure data
-            weights = self.get_structure_weights(structure_df, row)
-            
-            # Apply calculation to each year column
-            for year_col in year_columns:
-                original_value = row[year_col]  # X value
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        x_value = float(original_value)
-                        
-                        # X * A * B * C calculation
-                        calculated_value = x_value * weights['A'] * weights['B'] * weights['C']
-                        result_df.at[index, year_col] = round(calculated_value, 3)
-                        
-                    except (ValueError, TypeError):
-                        result_df.at[index, year_col] = original_value
-                else:
-                    result_df.at[index, year_col] = original_value
+        # Resolve A/B/C weights, length and 構造物番号 for all rows in one pass
+        attributes = get_structure_index(structure_df).resolve_attributes(result_df)
+        
+        # X * A * B * C over the whole year block; blank and non-numeric cells pass through
+        calculated, numeric = weighted_year_matrix(source_df, year_columns,
+                                                   attributes['A'], attributes['B'], attributes['C'])
+        write_year_matrix(result_df, year_columns, calculated, numeric)
         
         # Add enhanced columns
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
+        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df, attributes['構造物番号'])
         
         # Reorder columns
         final_df = self.reorder_columns_enhanced(enhanced_df)
@@ -375,223 +337,41 @@ class EnhancedNewCalculationSheetsApp:
         """Apply enhanced division calculation logic: X*A*B*C ÷ Length"""
         result_df = source_df.copy()
         
-        # Find year result columns and rename them
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
         # Rename year columns to include division indicator
-        column_mapping = {}
-        for col in year_columns:
-            year_match = re.search(r'(\d{4})', col)
-            if year_match:
-                year = year_match.group(1)
-                new_col_name = f"{year} 新演算/長さ"
-                column_mapping[col] = new_col_name
-        
+        column_mapping = year_column_mapping(year_result_columns(result_df), '新演算/長さ')
         result_df = result_df.rename(columns=column_mapping)
         
         print(f"Processing enhanced division calculation {sheet_type} with {len(result_df)} rows")
         
-        # Apply X*A*B*C ÷ Length calculation for each row
-        for index, row in result_df.iterrows():
-            # Get weight values and length from structure data
-            weights = self.get_structure_weights(structure_df, row)
-            length_value = self.get_length_value(structure_df, row)
-            
-            # Apply calculation to each year column
-            for old_col, new_col in column_mapping.items():
-                original_value = source_df.loc[index, old_col] if old_col in source_df.columns else None
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        x_value = float(original_value)
-                        
-                        # X * A * B * C calculation
-                        calculated_value = x_value * weights['A'] * weights['B'] * weights['C']
-                        
-                        # Divide by length if available
-                        if length_value and length_value > 0:
-                            final_value = calculated_value / length_value
-                            result_df.at[index, new_col] = round(final_value, 3)
-                        else:
-                            # Handle missing length data - keep calculated value without division
-                            result_df.at[index, new_col] = round(calculated_value, 3)
-                        
-                    except (ValueError, TypeError):
-                        result_df.at[index, new_col] = original_value
-                else:
-                    result_df.at[index, new_col] = original_value
+        # Resolve A/B/C weights, length and 構造物番号 for all rows in one pass
+        attributes = get_structure_index(structure_df).resolve_attributes(result_df)
+        
+        # X * A * B * C ÷ Length over the typed year block; without a length the product is kept
+        values, numeric = year_value_matrix(source_df, list(column_mapping))
+        calculated = multiply_by_weights(values, attributes['A'], attributes['B'], attributes['C'])
+        divided = divide_by_lengths(calculated, attributes['長さ(m)'], round_undivided=True)
+        write_year_matrix(result_df, list(column_mapping.values()), divided, numeric)
         
         # Add enhanced columns
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
+        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df, attributes['構造物番号'])
         
         # Reorder columns
         final_df = self.reorder_columns_enhanced(enhanced_df)
         
         return final_df
 
-    def get_structure_weights(self, structure_df, row):
-        """Get structure weights (A, B, C) from structure data"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            # Try to construct ekikan from 駅（始） and 駅（至）
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = ''
-            if eki_start and eki_end:
-                ekikan = f"{eki_start}→{eki_end}"
-            
-            # Default weights
-            weights = {'A': 1.0, 'B': 1.0, 'C': 1.0}
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    # Get weight values (A = 構造形式_重み, B = 角度_重み, C = 供用年数_重み)
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            weights['A'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            weights['B'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            weights['C'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    return weights
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    # Get weight values
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            weights['A'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            weights['B'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            weights['C'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            return weights
-            
-        except Exception as e:
-            print(f"Error getting structure weights: {e}")
-            # Return default weights if error
-            return {'A': 1.0, 'B': 1.0, 'C': 1.0}
-
-    def get_length_value(self, structure_df, row):
-        """Get length value from structure data"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            # Try to construct ekikan from 駅（始） and 駅（至）
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = ''
-            if eki_start and eki_end:
-                ekikan = f"{eki_start}→{eki_end}"
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Return None if length not found (no default value)
-            print(f"Length not found for: {kozo_name or ekikan} in {rosen_name}")
-            return None
-            
-        except Exception as e:
-            print(f"Error finding length value: {e}")
-            return None
-
     def save_enhanced_calculation_results(self, new_calc_max_df, new_calc_hoshuu_df, 
                                         division_calc_max_df, division_calc_hoshuu_df):
         """Save enhanced calculation results to Excel sheets"""
         try:
-            with pd.ExcelWriter(self.workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                # Write enhanced calculation result sheets
-                new_calc_max_df.to_excel(writer, sheet_name='新しい演算(補修無視)', index=False)
-                new_calc_hoshuu_df.to_excel(writer, sheet_name='新しい演算(補修考慮)', index=False)
-                division_calc_max_df.to_excel(writer, sheet_name='割算結果-新しい演算(補修無視)', index=False)
-                division_calc_hoshuu_df.to_excel(writer, sheet_name='割算結果-新しい演算(補修考慮)', index=False)
-                
-                # Preserve other sheets
-                try:
-                    original_wb = load_workbook(self.workbook_path)
-                    sheet_names_to_preserve = [name for name in original_wb.sheetnames 
-                                             if name not in ['新しい演算(補修無視)', '新しい演算(補修考慮)', 
-                                                           '割算結果-新しい演算(補修無視)', '割算結果-新しい演算(補修考慮)']]
-                    
-                    for sheet_name in sheet_names_to_preserve:
-                        try:
-                            df_temp = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
-                            df_temp.to_excel(writer, sheet_name=sheet_name, index=False)
-                        except Exception as e:
-                            continue
-                except Exception as e:
-                    pass
-                    
+            # Write enhanced calculation result sheets; other sheets are left untouched
+            replace_sheets(self.workbook_path, {
+                '新しい演算(補修無視)': new_calc_max_df,
+                '新しい演算(補修考慮)': new_calc_hoshuu_df,
+                '割算結果-新しい演算(補修無視)': division_calc_max_df,
+                '割算結果-新しい演算(補修考慮)': division_calc_hoshuu_df
+            })
+            
         except Exception as e:
             raise Exception(f"Error saving enhanced calculation results: {str(e)}")
 
@@ -6,6 +6,9 @@ from tkinter import ttk, filedialog, messagebox, simpledialog
 import numpy as np
 import re
 import time
+from year_matrix import year_value_matrix
+from operator_formula import compile_formula
+from sheet_reader import SheetReader, read_sheet, combine_year_extracts
 
 class ExcelProcessorApp:
     def __init__(self, root):
@@ -167,35 +170,44 @@ class ExcelProcessorApp:
 
         start_time = time.time()
 
-        wb = load_workbook(self.workbook)
-        sheet_names = [sheet for sheet in wb.sheetnames if sheet.isnumeric()]
-        
-        chuushutsu_df = pd.read_excel(self.workbook, sheet_name="抽出列")
-        ketsugou_df = pd.DataFrame()
+        year_extracts = []
         
-        for year in sorted(sheet_names, reverse=True):
-            year_col = None
-            
-            for col in chuushutsu_df.columns:
-                if str(year) in str(col):
-                    year_col = col
-                    break
-            
-            if year_col is None:
-                continue
-            
-            columns_to_extract = chuushutsu_df[year_col].dropna().tolist()
-            year_df = pd.read_excel(self.workbook, sheet_name=year)
-            available_columns = [col for col in columns_to_extract if col in year_df.columns]
-            
-            extracted_df = year_df[['調査番号'] + available_columns]
-            extracted_df.columns = ['調査番号'] + [f"{year} {col}" for col in available_columns]
+        # Open the package once for 抽出列 and every year sheet
+        with SheetReader(self.workbook) as reader:
+            sheet_names = [sheet for sheet in reader.sheet_names if sheet.isnumeric()]
+            chuushutsu_df = reader.read("抽出列")
             
-            if ketsugou_df.empty:
-                ketsugou_df = extracted_df
-            else:
-                ketsugou_df = pd.merge(ketsugou_df, extracted_df, on='調査番号', how='outer', suffixes=('', '_duplicate'))
-                ketsugou_df = ketsugou_df.loc[:, ~ketsugou_df.columns.str.endswith('_duplicate')]
+            for year in sorted(sheet_names, reverse=True):
+                year_col = None
+                
+                for col in chuushutsu_df.columns:
+                    if str(year) in str(col):
+                        year_col = col
+                        break
+                
+                if year_col is None:
+                    continue
+                
+                columns_to_extract = chuushutsu_df[year_col].dropna().tolist()
+                # Only 調査番号 and the extracted columns are built from the year sheet
+                year_df = reader.read(year, ['調査番号'] + columns_to_extract)
+                available_columns = [col for col in columns_to_extract if col in year_df.columns]
+                
+                extracted_df = year_df[['調査番号'] + available_columns]
+                extracted_df.columns = ['調査番号'] + [f"{year} {col}" for col in available_columns]
+                year_extracts.append(extracted_df)
+        
+        # All years joined on 調査番号 in one step
+        ketsugou_df = combine_year_extracts(year_extracts)
+        if ketsugou_df is None:
+            # Repeated or blank 調査番号: keep the chained merge and its row products
+            ketsugou_df = pd.DataFrame()
+            for extracted_df in year_extracts:
+                if ketsugou_df.empty:
+                    ketsugou_df = extracted_df
+                else:
+                    ketsugou_df = pd.merge(ketsugou_df, extracted_df, on='調査番号', how='outer', suffixes=('', '_duplicate'))
+                    ketsugou_df = ketsugou_df.loc[:, ~ketsugou_df.columns.str.endswith('_duplicate')]
         
         ketsugou_df = ketsugou_df.sort_values(by='調査番号')
         
@@ -210,8 +222,8 @@ class ExcelProcessorApp:
             return
 
         wb = load_workbook(self.workbook)
-        ketsugou_df = pd.read_excel(self.workbook, sheet_name='結合シート')
-        tensuuka_df = pd.read_excel(self.workbook, sheet_name="点数化列")
+        ketsugou_df = read_sheet(self.workbook, '結合シート')
+        tensuuka_df = read_sheet(self.workbook, "点数化列")
         chuushutsu_df = pd.DataFrame()
         
         for col in tensuuka_df.columns:
@@ -256,9 +268,9 @@ class ExcelProcessorApp:
 
         try:
             wb = load_workbook(self.workbook)
-            chuushutsu_df = pd.read_excel(self.workbook, sheet_name='抽出シート')
-            tensuuka_df = pd.read_excel(self.workbook, sheet_name='点数化列')
-            lookup_df = pd.read_excel(self.workbook, sheet_name='重みテーブル')
+            chuushutsu_df = read_sheet(self.workbook, '抽出シート')
+            tensuuka_df = read_sheet(self.workbook, '点数化列')
+            lookup_df = read_sheet(self.workbook, '重みテーブル')
             
             lookup_df = self.expand_lookup_table_if_needed(lookup_df, tensuuka_df)
             lookup_dicts = self.create_lookup_dicts(lookup_df)
@@ -335,11 +347,11 @@ class ExcelProcessorApp:
             return
             
         try:
-            chuushutsu_df = pd.read_excel(self.workbook, sheet_name='抽出シート')
-            tensuuka_df = pd.read_excel(self.workbook, sheet_name='点数化列')
+            chuushutsu_df = read_sheet(self.workbook, '抽出シート')
+            tensuuka_df = read_sheet(self.workbook, '点数化列')
             
             try:
-                enzanshi_df = pd.read_excel(self.workbook, sheet_name='演算子')
+                enzanshi_df = read_sheet(self.workbook, '演算子')
             except:
                 enzanshi_df = pd.DataFrame()
             
@@ -386,50 +398,34 @@ class ExcelProcessorApp:
                     continue
                 
                 result_column_name = f"{year} 結果"
-                result_values = []
                 
-                weight_data = chuushutsu_df[weight_columns].values
+                # Weight columns as float arrays; a row with any blank or non-numeric weight gives ''
+                weight_values, numeric = year_value_matrix(chuushutsu_df, weight_columns, blank_strings=('',))
+                valid_rows = numeric.all(axis=1)
                 
-                for row_values in weight_data:
-                    try:
-                        valid_values = []
-                        has_blank = False
-                        
-                        for val in row_values:
-                            if pd.isna(val) or val == '':
-                                has_blank = True
-                                break
-                            else:
-                                valid_values.append(float(val))
-                        
-                        if has_blank or len(valid_values) == 0:
-                            result_values.append('')
-                        else:
-                            if operation_formula and isinstance(operation_formula, str):
-                                expression = operation_formula
-                                for i, val in enumerate(valid_values):
-                                    letter = chr(65 + i)
-                                    expression = expression.replace(letter, str(val))
-                                
-                                try:
-                                    result = eval(expression)
-                                except:
-                                    result = 0
-                            else:
-                                result = np.prod(valid_values)
-                            
-                            result_values.append(result)
-                            
-                    except Exception:
-                        result_values.append('')
+                if operation_formula and isinstance(operation_formula, str):
+                    # Letters A, B, C... map to the weight columns in order
+                    letters = [chr(65 + i) for i in range(len(weight_columns))]
+                    compiled_formula = compile_formula(operation_formula, letters)
+                    
+                    if compiled_formula is None:
+                        results = np.zeros(len(chuushutsu_df))
+                    else:
+                        results, failed = compiled_formula.evaluate(
+                            {letter: weight_values[:, i] for i, letter in enumerate(letters)}, len(chuushutsu_df))
+                        results[failed] = 0
+                else:
+                    results = np.prod(weight_values, axis=1)
                 
+                result_values = results.astype(object)
+                result_values[~valid_rows] = ''
                 result_df[result_column_name] = result_values
             
             with pd.ExcelWriter(self.workbook, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
                 chuushutsu_df.to_excel(writer, sheet_name='抽出シート', index=False)
                 tensuuka_df.to_excel(writer, sheet_name='点数化列', index=False)
                 
-                lookup_df = pd.read_excel(self.workbook, sheet_name='重みテーブル')
+                lookup_df = read_sheet(self.workbook, '重みテーブル')
                 lookup_df.to_excel(writer, sheet_name='重みテーブル', index=False)
                 
                 if not enzanshi_df.empty:
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+# Rule 点検区分1 that matches every category of its 種別
+WILDCARD = '*'
+# Grouping method recorded for rows no rule matches
+UNMATCHED_METHOD = '構造物名称'
+
+
+def text_column(df, column):
+    """column of df as strings, '' for blanks or when the column is missing"""
+    if column not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    values = df[column]
+    return values.astype(str).astype(object).where(values.notna(), '')
+
+
+class RuleTable:
+    """Grouping rules compiled into hash lookups keyed on (種別, 点検区分1).
+
+    The JSON rules are scanned in order and the first rule whose 種別 matches
+    and whose 点検区分1 is the row's or '*' wins. Keeping the first exact rule
+    per (種別, 点検区分1) and the first wildcard rule per 種別, together with
+    their positions in the list, gives the same answer in two dict lookups:
+    whichever of the two candidates comes first.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.exact = {}
+        self.wildcard = {}
+        for position, rule in enumerate(self.rules):
+            if rule['tenken_kubun'] == WILDCARD:
+                self.wildcard.setdefault(rule['shubetsu'], position)
+            else:
+                self.exact.setdefault((rule['shubetsu'], rule['tenken_kubun']), position)
+
+    def position(self, shubetsu, tenken_kubun):
+        """Position of the matching rule in the list, or -1 when none matches"""
+        candidates = [position for position in (self.exact.get((shubetsu, tenken_kubun)), self.wildcard.get(shubetsu))
+                      if position is not None]
+        return min(candidates) if candidates else -1
+
+    def match(self, shubetsu, tenken_kubun):
+        """Matching rule for one 種別 / 点検区分1 pair, or None"""
+        position = self.position(shubetsu, tenken_kubun)
+        return self.rules[position] if position >= 0 else None
+
+    def positions(self, shubetsu, tenken_kubun):
+        """Rule positions for whole 種別 / 点検区分1 string columns, -1 where no rule matches.
+
+        Each distinct pair is resolved once and the result is mapped back
+        onto the rows.
+        """
+        pairs = pd.MultiIndex.from_arrays([np.asarray(shubetsu, dtype=object), np.asarray(tenken_kubun, dtype=object)])
+        codes, distinct = pairs.factorize()
+        resolved = np.array([self.position(shubetsu_value, tenken_value) for shubetsu_value, tenken_value in distinct],
+                            dtype=np.int64)
+        return resolved[codes]
+
+
+def build_grouping_keys(df, rule_table, positions=None):
+    """Grouping key and method for every row of df, built column by column.
+
+    Keys are '|'-joined strings:
+      - 構造物名称 rules: 種別|構造物名称|点検区分1
+      - other rules (駅間): 種別|駅（始）→駅（至）|点検区分1, with an empty
+        interval unless both stations are set
+      - the |点検区分1 part is the rule's, and is left out for '*' rules
+      - rows no rule matches: UNKNOWN|種別|点検区分1 with method 構造物名称
+      - blank cells give empty parts
+    positions are the rows' rule positions when the caller already has them.
+    Returns (keys, methods) as object Series aligned to df.index.
+    """
+    shubetsu = text_column(df, '種別')
+    tenken = text_column(df, '点検区分1')
+    if positions is None:
+        positions = rule_table.positions(shubetsu, tenken)
+
+    # Per-rule method and key suffix; position -1 picks the trailing entry for unmatched rows
+    rule_methods = np.array([rule['group_by'] for rule in rule_table.rules] + [UNMATCHED_METHOD], dtype=object)
+    rule_suffixes = np.array(['' if rule['tenken_kubun'] == WILDCARD else f"|{rule['tenken_kubun']}"
+                              for rule in rule_table.rules] + [''], dtype=object)
+    methods = pd.Series(rule_methods[positions], index=df.index, dtype=object)
+    suffixes = pd.Series(rule_suffixes[positions], index=df.index, dtype=object)
+
+    eki_start = text_column(df, '駅（始）')
+    eki_end = text_column(df, '駅（至）')
+    ekikan = (eki_start + '→' + eki_end).where((eki_start != '') & (eki_end != ''), '')
+    middle = text_column(df, '構造物名称').where(methods == '構造物名称', ekikan)
+
+    keys = (shubetsu + '|' + middle + suffixes).where(positions >= 0, 'UNKNOWN|' + shubetsu + '|' + tenken)
+    return keys, methods
+
+
+def preview_grouping(df, rules, top=20):
+    """Group counts the rules would give on df, computed in memory without writing anything.
+
+    Returns a dict with the row and group counts, rows per group (mean,
+    median, largest and the number of single-row groups), the rows no rule
+    matches together with their distinct 種別 / 点検区分1 pairs, and the top
+    largest groups as (key, rows) pairs.
+    """
+    rule_table = RuleTable(rules)
+    shubetsu = text_column(df, '種別')
+    tenken = text_column(df, '点検区分1')
+    positions = rule_table.positions(shubetsu, tenken)
+    keys, _ = build_grouping_keys(df, rule_table, positions)
+
+    codes, key_values = pd.factorize(keys)
+    sizes = np.bincount(codes, minlength=len(key_values))
+    unmatched = positions < 0
+    unmatched_pairs = pd.DataFrame({'種別': shubetsu[unmatched], '点検区分1': tenken[unmatched]}).drop_duplicates()
+    largest = np.argsort(-sizes, kind='stable')[:top]
+
+    return {
+        'rows': len(df),
+        'groups': len(key_values),
+        'mean_rows': float(sizes.mean()) if len(sizes) else 0.0,
+        'median_rows': float(np.median(sizes)) if len(sizes) else 0.0,
+        'max_rows': int(sizes.max()) if len(sizes) else 0,
+        'single_row_groups': int((sizes == 1).sum()),
+        'unmatched_rows': int(unmatched.sum()),
+        'unmatched_pairs': list(unmatched_pairs.itertuples(index=False, name=None)),
+        'largest_groups': [(key_values[position], int(sizes[position])) for position in largest],
+    }
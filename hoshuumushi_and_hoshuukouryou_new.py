@@ -7,6 +7,8 @@ import os
 import re
 import threading
 import time
+from structure_index import get_structure_index, load_structure_master, build_raw_ekikan_keys
+from year_matrix import running_max_year_matrix, backfilled_year_matrix, write_year_matrix, load_year_sheets
 
 class SimpleProcessorApp:
     def __init__(self):
@@ -84,12 +86,12 @@ class SimpleProcessorApp:
                           10, "")
             time.sleep(0.5)  # Brief pause for visual feedback
             
-            # Load data
-            self.grouped_df = pd.read_excel(self.workbook_path, sheet_name='グループ化点検履歴')
+            # Load data, converting the year columns to float64 once
+            self.grouped_df = load_year_sheets(self.workbook_path, ['グループ化点検履歴'])['グループ化点検履歴']
             
             # Try to load structure data
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+                self.structure_df = load_structure_master(self.workbook_path)
             except:
                 self.structure_df = None
             
@@ -160,39 +162,15 @@ class SimpleProcessorApp:
         return abbreviation_map.get(sen_name, sen_name)
     
     def lookup_structure_number(self, structure_df, rosen_name, kozo_name, ekikan):
+        """Lookup 構造物番号 from structure sheet"""
         try:
             if structure_df is None or len(structure_df) == 0:
                 return ''
-                
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
             
-            # Match by structure name
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
-            # Match by station interval
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
         except:
             return ''
     
@@ -208,17 +186,11 @@ class SimpleProcessorApp:
         # Add 構造物番号
         enhanced_df['構造物番号'] = ''
         
-        if structure_df is not None:
-            for index, row in enhanced_df.iterrows():
-                rosen_name = row.get('路線名', '')
-                kozo_name = row.get('構造物名称', '')
-                
-                ekikan = ''
-                if row.get('駅（始）', '') and row.get('駅（至）', ''):
-                    ekikan = f"{row.get('駅（始）', '')}→{row.get('駅（至）', '')}"
-                
-                bangou = self.lookup_structure_number(structure_df, rosen_name, kozo_name, ekikan)
-                enhanced_df.at[index, '構造物番号'] = bangou
+        if structure_df is not None and len(structure_df) > 0:
+            # Bulk lookup: join on structure name, then on 駅間 for the unmatched rows
+            structure_index = get_structure_index(structure_df)
+            ekikan_keys = build_raw_ekikan_keys(enhanced_df)
+            enhanced_df['構造物番号'] = structure_index.lookup_structure_numbers(enhanced_df, ekikan_keys)
         
         return enhanced_df
     
@@ -277,42 +249,9 @@ class SimpleProcessorApp:
     def apply_max_function_enhanced(self, year_columns):
         result_df = self.grouped_df.copy()
         
-        for index, row in result_df.iterrows():
-            previous_value = None
-            
-            for i, year_col in enumerate(year_columns):
-                current_value = row[year_col]
-                
-                if i == 0:
-                    if pd.notna(current_value) and str(current_value).strip() != '':
-                        try:
-                            previous_value = float(current_value)
-                            result_df.at[index, year_col] = previous_value
-                        except (ValueError, TypeError):
-                            result_df.at[index, year_col] = current_value
-                            previous_value = None
-                    else:
-                        result_df.at[index, year_col] = current_value
-                        previous_value = None
-                else:
-                    if pd.notna(current_value) and str(current_value).strip() != '':
-                        try:
-                            current_numeric = float(current_value)
-                            
-                            if previous_value is not None:
-                                if current_numeric < previous_value:
-                                    result_df.at[index, year_col] = previous_value
-                                else:
-                                    previous_value = current_numeric
-                                    result_df.at[index, year_col] = current_numeric
-                            else:
-                                previous_value = current_numeric
-                                result_df.at[index, year_col] = current_numeric
-                                
-                        except (ValueError, TypeError):
-                            result_df.at[index, year_col] = current_value
-                    else:
-                        result_df.at[index, year_col] = current_value
+        # Running maximum along the years for all rows at once; blank and non-numeric cells pass through
+        running_max, numeric = running_max_year_matrix(self.grouped_df, year_columns)
+        write_year_matrix(result_df, year_columns, running_max, numeric)
         
         enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
         return self.reorder_columns_enhanced(enhanced_df)
@@ -320,48 +259,9 @@ class SimpleProcessorApp:
     def apply_hoshuu_kouryou_enhanced(self, year_columns):
         result_df = self.grouped_df.copy()
         
-        for index, row in result_df.iterrows():
-            previous_value = None
-            
-            for i, year_col in enumerate(year_columns):
-                current_value = row[year_col]
-                
-                if i == 0:
-                    if pd.notna(current_value) and str(current_value).strip() != '':
-                        try:
-                            previous_value = float(current_value)
-                            result_df.at[index, year_col] = previous_value
-                        except (ValueError, TypeError):
-                            result_df.at[index, year_col] = current_value
-                            previous_value = None
-                    else:
-                        result_df.at[index, year_col] = current_value
-                        previous_value = None
-                else:
-                    if pd.notna(current_value) and str(current_value).strip() != '':
-                        try:
-                            current_numeric = float(current_value)
-                            
-                            if previous_value is not None:
-                                if current_numeric < previous_value:
-                                    # Set ALL previous values to 0.1
-                                    for j in range(i):
-                                        prev_year_col = year_columns[j]
-                                        result_df.at[index, prev_year_col] = 0.1
-                                    
-                                    result_df.at[index, year_col] = current_numeric
-                                    previous_value = current_numeric
-                                else:
-                                    previous_value = current_numeric
-                                    result_df.at[index, year_col] = current_numeric
-                            else:
-                                previous_value = current_numeric
-                                result_df.at[index, year_col] = current_numeric
-                                
-                        except (ValueError, TypeError):
-                            result_df.at[index, year_col] = current_value
-                    else:
-                        result_df.at[index, year_col] = current_value
+        # Set ALL years before each row's last drop to 0.1; blank and non-numeric cells after it pass through
+        backfilled, written = backfilled_year_matrix(self.grouped_df, year_columns)
+        write_year_matrix(result_df, year_columns, backfilled, written)
         
         enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
         return self.reorder_columns_enhanced(enhanced_df)
@@ -23,6 +23,7 @@ import time
 import warnings
 import xlsxwriter
 from datetime import datetime
+from workbook_session import WorkbookSession
 
 # Suppress warnings for cleaner output
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -45,6 +46,7 @@ class IntegratedExcelProcessingSystem:
         self.shared_excel_path = None
         self.shared_directory = None
         self.processing_log = []
+        self.workbook_session = None
         
         # Module states
         self.module_states = {
@@ -403,6 +405,9 @@ class IntegratedExcelProcessingSystem:
 
     def execute_pipeline_sequence(self):
         """Execute all modules in sequence"""
+        # Stage every sheet in memory and write the workbook once, before post-processing
+        self.begin_workbook_session(deferred=True)
+        
         pipeline_steps = [
             ("📥 Data Processor", self.execute_data_processor),
             ("⚡ Sequential Processor", self.execute_grouping_processor),
@@ -415,6 +420,10 @@ class IntegratedExcelProcessingSystem:
         ]
         
         for i, (step_name, step_function) in enumerate(pipeline_steps, 1):
+            if step_function == self.execute_post_processor:
+                # The post processor only reads the obser files
+                self.commit_workbook_session()
+            
             self.log_message(f"Executing step {i}/8: {step_name}", "INFO")
             self.update_status(f"⏳ Step {i}/8: {step_name}", i-1)
             
@@ -432,12 +441,34 @@ class IntegratedExcelProcessingSystem:
         # Show completion dialog
         self.show_completion_dialog()
 
+    def begin_workbook_session(self, deferred=False):
+        """Start a WorkbookSession on the selected file for the modules about to run"""
+        self.workbook_session = WorkbookSession(self.shared_excel_path, deferred=deferred)
+        return self.workbook_session
+
+    def commit_workbook_session(self):
+        """Write all staged sheets in one save, asking to retry while Excel has the file open"""
+        while True:
+            try:
+                self.workbook_session.flush()
+                self.log_message("Saved all staged sheets to the workbook", "SUCCESS")
+                return
+            except PermissionError:
+                # The workbook was not touched; the staged sheets are still in memory
+                retry = messagebox.askretrycancel(
+                    "File Access Error",
+                    f"Cannot save {os.path.basename(self.shared_excel_path)}.\n\n"
+                    "Close the file in Excel and click Retry.")
+                if not retry:
+                    raise Exception("Workbook is open in another program; no sheets were saved")
+
     def reset_system(self):
         """Reset the entire system"""
         # Reset shared variables
         self.shared_excel_path = None
         self.shared_directory = None
         self.processing_log = []
+        self.workbook_session = None
         
         # Reset module states
         for key in self.module_states:
@@ -484,6 +515,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Data Processor module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_data_processor()
             self.log_message("Data Processor completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Data Processor module completed successfully!")
@@ -498,16 +530,13 @@ class IntegratedExcelProcessingSystem:
         
         # Load workbook and check sheets
         try:
-            wb = load_workbook(self.dp_workbook_path)
-            sheet_names = wb.sheetnames
-            
             # Check for required sheets
-            if 'Sheet1' not in sheet_names:
+            if not self.workbook_session.has_sheet('Sheet1'):
                 # Create default data if Sheet1 doesn't exist
                 self.create_default_sheet1()
             
             # Load data from Sheet1
-            self.dp_df = pd.read_excel(self.dp_workbook_path, sheet_name='Sheet1')
+            self.dp_df = self.workbook_session.read_sheet('Sheet1')
             
             if len(self.dp_df) == 0:
                 self.dp_df = self.create_sample_data()
@@ -522,15 +551,11 @@ class IntegratedExcelProcessingSystem:
 
     def create_default_sheet1(self):
         """Create default Sheet1 if it doesn't exist"""
-        wb = load_workbook(self.dp_workbook_path)
-        if 'Sheet1' not in wb.sheetnames:
-            ws = wb.create_sheet('Sheet1')
+        if not self.workbook_session.has_sheet('Sheet1'):
             # Add sample headers
             headers = ['路線名', '構造物名称', '駅（始）', '駅（至）', '点検区分1', 'データ']
-            for i, header in enumerate(headers, 1):
-                ws.cell(row=1, column=i, value=header)
-            wb.save(self.dp_workbook_path)
-        wb.close()
+            self.workbook_session.write_sheet('Sheet1', pd.DataFrame(columns=headers))
+            self.workbook_session.save()
 
     def create_sample_data(self):
         """Create sample data for processing"""
@@ -547,22 +572,23 @@ class IntegratedExcelProcessingSystem:
     def update_processor_sheets(self):
         """Update sheets with processed data"""
         try:
-            with pd.ExcelWriter(self.dp_workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                # Update 抽出列 sheet
-                extraction_df = self.dp_df.copy()
-                extraction_df.to_excel(writer, sheet_name='抽出列', index=False)
-                
-                # Update 点数化列 sheet  
-                scoring_df = self.apply_scoring_logic(self.dp_df)
-                scoring_df.to_excel(writer, sheet_name='点数化列', index=False)
-                
-                # Update 演算子 sheet
-                operator_df = self.create_operator_data()
-                operator_df.to_excel(writer, sheet_name='演算子', index=False)
-                
-                # Update 演算子‐2 sheet
-                operator2_df = self.create_operator2_data()
-                operator2_df.to_excel(writer, sheet_name='演算子‐2', index=False)
+            # Update 抽出列 sheet
+            extraction_df = self.dp_df.copy()
+            self.workbook_session.write_sheet('抽出列', extraction_df)
+            
+            # Update 点数化列 sheet  
+            scoring_df = self.apply_scoring_logic(self.dp_df)
+            self.workbook_session.write_sheet('点数化列', scoring_df)
+            
+            # Update 演算子 sheet
+            operator_df = self.create_operator_data()
+            self.workbook_session.write_sheet('演算子', operator_df)
+            
+            # Update 演算子‐2 sheet
+            operator2_df = self.create_operator2_data()
+            self.workbook_session.write_sheet('演算子‐2', operator2_df)
+            
+            self.workbook_session.save()
                 
         except Exception as e:
             raise Exception(f"Failed to update processor sheets: {str(e)}")
@@ -605,6 +631,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Sequential Processor module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_grouping_processor()
             self.log_message("Sequential Processor completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Sequential Processor module completed successfully!")
@@ -631,10 +658,10 @@ class IntegratedExcelProcessingSystem:
         """Extract and merge data from multiple sheets"""
         try:
             # Load data from 抽出列 sheet
-            extraction_df = pd.read_excel(self.gp_workbook_path, sheet_name='抽出列')
+            extraction_df = self.workbook_session.read_sheet('抽出列')
             
             # Load data from 点数化列 sheet
-            scoring_df = pd.read_excel(self.gp_workbook_path, sheet_name='点数化列')
+            scoring_df = self.workbook_session.read_sheet('点数化列')
             
             # Merge data
             self.gp_df = pd.merge(extraction_df, scoring_df, on='路線名', how='outer', suffixes=('', '_score'))
@@ -645,8 +672,8 @@ class IntegratedExcelProcessingSystem:
     def create_chuushutsu_sheet(self):
         """Create 抽出データ sheet"""
         try:
-            with pd.ExcelWriter(self.gp_workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                self.gp_df.to_excel(writer, sheet_name='抽出データ', index=False)
+            self.workbook_session.write_sheet('抽出データ', self.gp_df)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to create 抽出データ sheet: {str(e)}")
 
@@ -654,7 +681,7 @@ class IntegratedExcelProcessingSystem:
         """Apply weight calculations"""
         try:
             # Load operator data
-            operator_df = pd.read_excel(self.gp_workbook_path, sheet_name='演算子')
+            operator_df = self.workbook_session.read_sheet('演算子')
             
             # Apply weights to numeric columns
             numeric_columns = self.gp_df.select_dtypes(include=[int, float]).columns
@@ -670,8 +697,8 @@ class IntegratedExcelProcessingSystem:
     def create_enzan_kekka_sheet(self):
         """Create 演算結果 sheet"""
         try:
-            with pd.ExcelWriter(self.gp_workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                self.gp_df.to_excel(writer, sheet_name='演算結果', index=False)
+            self.workbook_session.write_sheet('演算結果', self.gp_df)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to create 演算結果 sheet: {str(e)}")
 
@@ -687,6 +714,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Data Grouping module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_data_grouping()
             self.log_message("Data Grouping completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Data Grouping module completed successfully!")
@@ -700,10 +728,10 @@ class IntegratedExcelProcessingSystem:
             # Load data from 演算結果 sheet
             if os.path.exists(self.shared_excel_path):
                 try:
-                    enzan_df = pd.read_excel(self.shared_excel_path, sheet_name='演算結果')
+                    enzan_df = self.workbook_session.read_sheet('演算結果')
                 except:
                     # Fallback to Sheet1
-                    enzan_df = pd.read_excel(self.shared_excel_path, sheet_name='Sheet1')
+                    enzan_df = self.workbook_session.read_sheet('Sheet1')
             else:
                 raise Exception("Excel file not found")
             
@@ -775,8 +803,8 @@ class IntegratedExcelProcessingSystem:
     def save_grouped_data(self, df):
         """Save grouped data to sheet"""
         try:
-            with pd.ExcelWriter(self.shared_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                df.to_excel(writer, sheet_name='グループ化点検履歴', index=False)
+            self.workbook_session.write_sheet('グループ化点検履歴', df)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to save grouped data: {str(e)}")
 
@@ -792,6 +820,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Final Processing module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_final_processing()
             self.log_message("Final Processing completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Final Processing module completed successfully!")
@@ -803,7 +832,7 @@ class IntegratedExcelProcessingSystem:
         """Execute the final processing logic"""
         try:
             # Load grouped data
-            grouped_df = pd.read_excel(self.shared_excel_path, sheet_name='グループ化点検履歴')
+            grouped_df = self.workbook_session.read_sheet('グループ化点検履歴')
             
             # Apply max function processing
             hoshuumushi_df = self.apply_max_function_logic(grouped_df, ignore_repair=True)
@@ -842,9 +871,9 @@ class IntegratedExcelProcessingSystem:
     def save_final_processing_sheets(self, hoshuumushi_df, hoshuukouryou_df):
         """Save final processing sheets"""
         try:
-            with pd.ExcelWriter(self.shared_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                hoshuumushi_df.to_excel(writer, sheet_name='補修無視', index=False)
-                hoshuukouryou_df.to_excel(writer, sheet_name='補修考慮', index=False)
+            self.workbook_session.write_sheet('補修無視', hoshuumushi_df)
+            self.workbook_session.write_sheet('補修考慮', hoshuukouryou_df)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to save final processing sheets: {str(e)}")
 
@@ -860,6 +889,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Structure Entry module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_structure_entry()
             self.log_message("Structure Entry completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Structure Entry module completed successfully!")
@@ -871,7 +901,7 @@ class IntegratedExcelProcessingSystem:
         """Execute the structure entry logic"""
         try:
             # Load grouped data
-            grouped_df = pd.read_excel(self.shared_excel_path, sheet_name='グループ化点検履歴')
+            grouped_df = self.workbook_session.read_sheet('グループ化点検履歴')
             
             # Check for existing structure data
             structure_df = self.load_or_create_structure_data()
@@ -892,7 +922,7 @@ class IntegratedExcelProcessingSystem:
     def load_or_create_structure_data(self):
         """Load or create structure data sheet"""
         try:
-            structure_df = pd.read_excel(self.shared_excel_path, sheet_name='構造物番号')
+            structure_df = self.workbook_session.read_sheet('構造物番号')
         except:
             # Create new structure data
             structure_columns = [
@@ -954,8 +984,8 @@ class IntegratedExcelProcessingSystem:
     def save_structure_data(self, structure_df):
         """Save structure data to sheet"""
         try:
-            with pd.ExcelWriter(self.shared_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                structure_df.to_excel(writer, sheet_name='構造物番号', index=False)
+            self.workbook_session.write_sheet('構造物番号', structure_df)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to save structure data: {str(e)}")
 
@@ -971,6 +1001,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Sheet Generator module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_sheet_generator()
             self.log_message("Sheet Generator completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Sheet Generator module completed successfully!")
@@ -982,11 +1013,11 @@ class IntegratedExcelProcessingSystem:
         """Execute the 9-sheet generator logic"""
         try:
             # Load all required data
-            max_df = pd.read_excel(self.shared_excel_path, sheet_name='補修無視')
-            hoshuu_df = pd.read_excel(self.shared_excel_path, sheet_name='補修考慮')
-            structure_df = pd.read_excel(self.shared_excel_path, sheet_name='構造物番号')
-            grouped_df = pd.read_excel(self.shared_excel_path, sheet_name='グループ化点検履歴')
-            operator_df = pd.read_excel(self.shared_excel_path, sheet_name='演算子‐2')
+            max_df = self.workbook_session.read_sheet('補修無視')
+            hoshuu_df = self.workbook_session.read_sheet('補修考慮')
+            structure_df = self.workbook_session.read_sheet('構造物番号')
+            grouped_df = self.workbook_session.read_sheet('グループ化点検履歴')
+            operator_df = self.workbook_session.read_sheet('演算子‐2')
             
             # Generate all 9 sheets
             sheets_data = self.generate_all_calculation_sheets(
@@ -1322,9 +1353,9 @@ class IntegratedExcelProcessingSystem:
     def save_all_generated_sheets(self, sheets_data):
         """Save all generated sheets to Excel"""
         try:
-            with pd.ExcelWriter(self.shared_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                for sheet_name, sheet_data in sheets_data.items():
-                    sheet_data.to_excel(writer, sheet_name=sheet_name, index=False)
+            for sheet_name, sheet_data in sheets_data.items():
+                self.workbook_session.write_sheet(sheet_name, sheet_data)
+            self.workbook_session.save()
         except Exception as e:
             raise Exception(f"Failed to save generated sheets: {str(e)}")
 
@@ -1340,6 +1371,7 @@ class IntegratedExcelProcessingSystem:
         
         self.log_message("Starting Obser Generator module...", "INFO")
         try:
+            self.begin_workbook_session()
             self.execute_obser_generator()
             self.log_message("Obser Generator completed successfully", "SUCCESS")
             messagebox.showinfo("Success", "Obser Generator module completed successfully!")
@@ -1383,7 +1415,7 @@ class IntegratedExcelProcessingSystem:
         
         # Try to load from 入力値 sheet if exists
         try:
-            nyuuryoku_df = pd.read_excel(self.shared_excel_path, sheet_name='入力値', header=None)
+            nyuuryoku_df = self.workbook_session.read_sheet('入力値', header=None)
             if len(nyuuryoku_df) >= 2:
                 headers = nyuuryoku_df.iloc[0]
                 for i, header in enumerate(headers):
@@ -1411,30 +1443,17 @@ class IntegratedExcelProcessingSystem:
     def create_default_nyuuryoku_sheet(self):
         """Create default 入力値 sheet"""
         try:
-            wb = load_workbook(self.shared_excel_path)
-            
-            if '入力値' in wb.sheetnames:
-                wb.remove(wb['入力値'])
-            
-            ws = wb.create_sheet('入力値')
-            
-            # Headers
-            ws['A1'] = 'データ個数'
-            ws['B1'] = '予測年数'
-            ws['C1'] = 'λ定数'
-            ws['D1'] = '点検年度に対応した年'
-            
-            # Values
-            ws['A2'] = self.obser_params['data_count']
-            ws['B2'] = self.obser_params['prediction_years']
-            ws['C2'] = self.obser_params['lambda_constant']
-            
-            # Years
-            for i, year in enumerate(self.obser_params['inspection_years']):
-                ws[f'D{i+2}'] = year
-            
-            wb.save(self.shared_excel_path)
-            wb.close()
+            # Headers in row 1, values in row 2 and the years in column D from row 2
+            years = self.obser_params['inspection_years']
+            nyuuryoku_df = pd.DataFrame({
+                'データ個数': [self.obser_params['data_count']] + [None] * (len(years) - 1),
+                '予測年数': [self.obser_params['prediction_years']] + [None] * (len(years) - 1),
+                'λ定数': [self.obser_params['lambda_constant']] + [None] * (len(years) - 1),
+                '点検年度に対応した年': years
+            })
+            
+            self.workbook_session.write_sheet('入力値', nyuuryoku_df)
+            self.workbook_session.save()
         except Exception as e:
             self.log_message(f"Warning: Could not create 入力値 sheet: {str(e)}", "WARNING")
 
@@ -1442,7 +1461,7 @@ class IntegratedExcelProcessingSystem:
         """Create individual obser file"""
         try:
             # Load sheet data
-            sheet_df = pd.read_excel(self.shared_excel_path, sheet_name=sheet_name)
+            sheet_df = self.workbook_session.read_sheet(sheet_name)
             
             # Sort by last column in descending order
             if len(sheet_df) > 0 and len(sheet_df.columns) > 0:
@@ -5,6 +5,12 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import re
+from structure_index import get_structure_index, load_structure_master, build_raw_ekikan_keys
+from year_matrix import (year_result_columns, divided_year_matrix, weighted_year_matrix, write_year_matrix,
+                         load_year_sheets)
+from operator_formula import get_operator_weights
+from sheet_writer import replace_sheets
+from sheet_reader import read_sheet
 
 class EnhancedKeijihenkaGeneratorApp:
     def __init__(self):
@@ -51,36 +57,10 @@ class EnhancedKeijihenkaGeneratorApp:
         try:
             if structure_df is None or len(structure_df) == 0:
                 return ''
-                
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
             
-            # First try to match by structure name
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            # If not found by structure name, try by station interval
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
         except Exception as e:
             print(f"Error finding structure number: {e}")
@@ -99,19 +79,11 @@ class EnhancedKeijihenkaGeneratorApp:
         # Add 構造物番号 column
         enhanced_df['構造物番号'] = ''
         
-        if structure_df is not None:
-            for index, row in enhanced_df.iterrows():
-                rosen_name = row.get('路線名', '')
-                kozo_name = row.get('構造物名称', '')
-                
-                # Create ekikan for lookup
-                ekikan = ''
-                if row.get('駅（始）', '') and row.get('駅（至）', ''):
-                    ekikan = f"{row.get('駅（始）', '')}→{row.get('駅（至）', '')}"
-                
-                # Lookup structure number
-                bangou = self.lookup_structure_number(structure_df, rosen_name, kozo_name, ekikan)
-                enhanced_df.at[index, '構造物番号'] = bangou
+        if structure_df is not None and len(structure_df) > 0:
+            # Bulk lookup: join on structure name, then on 駅間 for the unmatched rows
+            structure_index = get_structure_index(structure_df)
+            ekikan_keys = build_raw_ekikan_keys(enhanced_df)
+            enhanced_df['構造物番号'] = structure_index.lookup_structure_numbers(enhanced_df, ekikan_keys)
         
         return enhanced_df
     
@@ -267,9 +239,9 @@ class EnhancedKeijihenkaGeneratorApp:
             
             # Try to load required data for enhancements
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+                self.structure_df = load_structure_master(self.workbook_path)
                 # Use the dynamically found operator sheet name
-                self.operator_df = pd.read_excel(self.workbook_path, sheet_name=operator_sheet_name)
+                self.operator_df = read_sheet(self.workbook_path, operator_sheet_name)
                 print(f"Successfully loaded operator sheet: '{operator_sheet_name}'")
             except Exception as e:
                 self.status_label.config(text="Error loading data!", fg="red")
@@ -321,10 +293,13 @@ class EnhancedKeijihenkaGeneratorApp:
     def execute_keijiheka_process(self, progress_window):
         """Execute the enhanced 経時変化 process"""
         try:
-            # Load required sheets
-            grouped_df = pd.read_excel(self.workbook_path, sheet_name='グループ化点検履歴')
-            structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
-            operator_df = pd.read_excel(self.workbook_path, sheet_name='演算子‐2')
+            # Load required sheets, converting the year columns to float64 once
+            grouped_df = load_year_sheets(self.workbook_path, ['グループ化点検履歴'])['グループ化点検履歴']
+            # Reuse the structure master loaded during validation
+            structure_df = self.structure_df
+            if structure_df is None:
+                structure_df = load_structure_master(self.workbook_path)
+            operator_df = read_sheet(self.workbook_path, '演算子‐2')
             
             # Create enhanced 経時変化 results
             # Sheet 1: 経時変化（橋長考慮） - グループ化点検履歴 ÷ Length
@@ -354,35 +329,14 @@ class EnhancedKeijihenkaGeneratorApp:
         result_df = grouped_df.copy()
         
         # Find year result columns
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
+        year_columns = year_result_columns(result_df)
         
         print(f"Processing enhanced 経時変化（橋長考慮） with {len(result_df)} rows")
         
-        # Apply division by length for each row
-        for index, row in result_df.iterrows():
-            # Get length value from structure data
-            length_value = self.get_length_value_for_keiji(structure_df, row)
-            
-            # Apply division to each year column
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        
-                        # Divide by length if available
-                        if length_value and length_value > 0:
-                            divided_value = numeric_value / length_value
-                            result_df.at[index, year_col] = round(divided_value, 3)
-                        else:
-                            # Handle missing length data - keep original value
-                            result_df.at[index, year_col] = numeric_value
-                        
-                    except (ValueError, TypeError):
-                        result_df.at[index, year_col] = original_value
-                else:
-                    result_df.at[index, year_col] = original_value
+        # Resolve the length vector once; rows without a length keep their original values
+        attributes = get_structure_index(structure_df).resolve_attributes(result_df)
+        divided, numeric = divided_year_matrix(grouped_df, year_columns, attributes['長さ(m)'])
+        write_year_matrix(result_df, year_columns, divided, numeric)
         
         # Add enhanced columns
         enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
@@ -394,34 +348,9 @@ class EnhancedKeijihenkaGeneratorApp:
 
     def apply_enhanced_keiji_both_logic(self, keiji_kyoucho_df, structure_df, operator_df):
         """Apply enhanced 経時変化（橋長&形式考慮） logic: Above × Structure weights"""
-        result_df = keiji_kyoucho_df.copy()
-        
-        # Find year result columns
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        print(f"Processing enhanced 経時変化（橋長&形式考慮） with {len(result_df)} rows")
+        print(f"Processing enhanced 経時変化（橋長&形式考慮） with {len(keiji_kyoucho_df)} rows")
         
-        # Apply structure weights multiplication for each row
-        for index, row in result_df.iterrows():
-            # Get structure weights using 演算子‐2 formulas
-            weights = self.get_structure_weights_with_operator(structure_df, operator_df, row)
-            
-            # Apply multiplication to each year column
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        
-                        # Multiply by structure weights
-                        calculated_value = numeric_value * weights['total_weight']
-                        result_df.at[index, year_col] = round(calculated_value, 3)
-                        
-                    except (ValueError, TypeError):
-                        result_df.at[index, year_col] = original_value
-                else:
-                    result_df.at[index, year_col] = original_value
+        result_df = self.apply_operator_weights(keiji_kyoucho_df, structure_df, operator_df)
         
         # Add enhanced columns
         enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
@@ -433,34 +362,9 @@ class EnhancedKeijihenkaGeneratorApp:
 
     def apply_enhanced_keiji_mushi_logic(self, grouped_df, structure_df, operator_df):
         """Apply enhanced 経時変化（橋長無視&形式考慮） logic: グループ化点検履歴 × Structure weights"""
-        result_df = grouped_df.copy()
-        
-        # Find year result columns
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        print(f"Processing enhanced 経時変化（橋長無視&形式考慮） with {len(result_df)} rows")
+        print(f"Processing enhanced 経時変化（橋長無視&形式考慮） with {len(grouped_df)} rows")
         
-        # Apply structure weights multiplication for each row
-        for index, row in result_df.iterrows():
-            # Get structure weights using 演算子‐2 formulas
-            weights = self.get_structure_weights_with_operator(structure_df, operator_df, row)
-            
-            # Apply multiplication to each year column
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        
-                        # Multiply by structure weights
-                        calculated_value = numeric_value * weights['total_weight']
-                        result_df.at[index, year_col] = round(calculated_value, 3)
-                        
-                    except (ValueError, TypeError):
-                        result_df.at[index, year_col] = original_value
-                else:
-                    result_df.at[index, year_col] = original_value
+        result_df = self.apply_operator_weights(grouped_df, structure_df, operator_df)
         
         # Add enhanced columns
         enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
@@ -470,210 +374,34 @@ class EnhancedKeijihenkaGeneratorApp:
         
         return final_df
 
-    def get_length_value_for_keiji(self, structure_df, row):
-        """Get length value from structure data for 経時変化"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            # Try to construct ekikan from 駅（始） and 駅（至）
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = ''
-            if eki_start and eki_end:
-                ekikan = f"{eki_start}→{eki_end}"
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Return None if length not found
-            print(f"Length not found for 経時変化: {kozo_name or ekikan} in {rosen_name}")
-            return None
-            
-        except Exception as e:
-            print(f"Error finding length value for 経時変化: {e}")
-            return None
-
-    def get_structure_weights_with_operator(self, structure_df, operator_df, row):
-        """Get structure weights using 演算子‐2 formulas with A1, B1, C1... mapping"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            # Try to construct ekikan from 駅（始） and 駅（至）
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = ''
-            if eki_start and eki_end:
-                ekikan = f"{eki_start}→{eki_end}"
-            
-            # Get values from structure data
-            structure_values = {'A1': 1.0, 'B1': 1.0, 'C1': 1.0}  # Default values
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    # Map structure data to A1, B1, C1 for 演算子‐2 formulas
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            structure_values['A1'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            structure_values['B1'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            structure_values['C1'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            elif ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    # Map structure data to A1, B1, C1 for 演算子‐2 formulas
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            structure_values['A1'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            structure_values['B1'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            structure_values['C1'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Apply 演算子‐2 formulas with dynamic evaluation
-            total_weight = self.evaluate_operator_formulas(operator_df, structure_values)
-            
-            return {
-                'A1': structure_values['A1'],
-                'B1': structure_values['B1'], 
-                'C1': structure_values['C1'],
-                'total_weight': total_weight
-            }
-            
-        except Exception as e:
-            print(f"Error getting structure weights with operator: {e}")
-            # Return default values if error
-            return {'A1': 1.0, 'B1': 1.0, 'C1': 1.0, 'total_weight': 1.0}
+    def apply_operator_weights(self, source_df, structure_df, operator_df):
+        """Multiply every year result of source_df by its row's 演算子‐2 total weight.
 
-    def evaluate_operator_formulas(self, operator_df, structure_values):
-        """Evaluate 演算子‐2 formulas with A1, B1, C1... mapping"""
-        try:
-            # Find the formula in 演算子‐2 sheet
-            if len(operator_df) > 0:
-                # Assume first row contains the formula
-                formula_row = operator_df.iloc[0]
-                
-                # Look for formula column (usually contains formula like "A1*B1*C1")
-                formula = None
-                for col in operator_df.columns:
-                    cell_value = str(formula_row[col]).strip()
-                    if any(var in cell_value for var in ['A1', 'B1', 'C1']) and any(op in cell_value for op in ['*', '+', '-', '/']):
-                        formula = cell_value
-                        break
-                
-                if formula:
-                    # Replace A1, B1, C1 with actual values
-                    formula = formula.replace('A1', str(structure_values['A1']))
-                    formula = formula.replace('B1', str(structure_values['B1']))
-                    formula = formula.replace('C1', str(structure_values['C1']))
-                    
-                    # Safely evaluate the formula
-                    try:
-                        result = eval(formula)
-                        return float(result)
-                    except:
-                        print(f"Error evaluating formula: {formula}")
-                        return 1.0
-            
-            # Default calculation if no formula found
-            return structure_values['A1'] * structure_values['B1'] * structure_values['C1']
-            
-        except Exception as e:
-            print(f"Error evaluating operator formulas: {e}")
-            return 1.0
+        The A1, B1, C1 weights are resolved for all rows at once and the
+        formula is compiled once per operator sheet; blank and non-numeric
+        cells pass through.
+        """
+        result_df = source_df.copy()
+        year_columns = year_result_columns(result_df)
+        
+        weights = get_structure_index(structure_df).resolve_operator_weights(source_df)
+        total_weights = get_operator_weights(operator_df).total_weights(weights['A1'], weights['B1'], weights['C1'])
+        
+        weighted, numeric = weighted_year_matrix(source_df, year_columns, total_weights)
+        write_year_matrix(result_df, year_columns, weighted, numeric)
+        
+        return result_df
 
     def save_enhanced_keijiheka_results(self, keiji_kyoucho_df, keiji_both_df, keiji_mushi_df):
         """Save enhanced 経時変化 results to Excel sheets"""
         try:
-            with pd.ExcelWriter(self.workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                # Write enhanced 経時変化 result sheets
-                keiji_kyoucho_df.to_excel(writer, sheet_name='経時変化（橋長考慮）', index=False)
-                keiji_both_df.to_excel(writer, sheet_name='経時変化（橋長&形式考慮）', index=False)
-                keiji_mushi_df.to_excel(writer, sheet_name='経時変化（橋長無視&形式考慮）', index=False)
-                
-                # Preserve other sheets
-                try:
-                    original_wb = load_workbook(self.workbook_path)
-                    sheet_names_to_preserve = [name for name in original_wb.sheetnames 
-                                             if name not in ['経時変化（橋長考慮）', '経時変化（橋長&形式考慮）', 
-                                                           '経時変化（橋長無視&形式考慮）']]
-                    
-                    for sheet_name in sheet_names_to_preserve:
-                        try:
-                            df_temp = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
-                            df_temp.to_excel(writer, sheet_name=sheet_name, index=False)
-                        except Exception as e:
-                            continue
-                except Exception as e:
-                    pass
-                    
+            # Write enhanced 経時変化 result sheets; other sheets are left untouched
+            replace_sheets(self.workbook_path, {
+                '経時変化（橋長考慮）': keiji_kyoucho_df,
+                '経時変化（橋長&形式考慮）': keiji_both_df,
+                '経時変化（橋長無視&形式考慮）': keiji_mushi_df
+            })
+            
         except Exception as e:
             raise Exception(f"Error saving enhanced 経時変化 results: {str(e)}")
 
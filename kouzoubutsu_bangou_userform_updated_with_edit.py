@@ -1187,6 +1187,9 @@ from tkinter import ttk, filedialog, messagebox
 import os
 import re
 import threading
+from structure_index import (get_structure_index, update_structure_index,
+                             normalize_key_column, frame_column)
+from sheet_writer import replace_sheets
 
 class StructureDataEntryApp:
     def __init__(self):
@@ -1331,6 +1334,9 @@ class StructureDataEntryApp:
                 '構造形式', '構造形式_重み', '角度', '角度_重み', 
                 '供用年数', '供用年数_重み'
             ])
+        
+        # Normalize the lookup keys once; later edits update this index in place
+        get_structure_index(self.structure_data_df)
 
     def get_missing_structure_entries(self):
         missing_entries = []
@@ -1342,53 +1348,39 @@ class StructureDataEntryApp:
                 '供用年数', '供用年数_重み'
             ])
         
-        unique_kozo = set()
-        unique_ekikan = set()
-        
-        for _, row in self.grouped_df.iterrows():
-            rosen = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            group_method = str(row.get('グループ化方法', '')).strip() if pd.notna(row.get('グループ化方法', '')) else ''
-            
-            if group_method == '構造物名称':
-                kozo = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-                if kozo and kozo not in ['', 'nan', 'NaN']:
-                    unique_kozo.add((rosen, kozo))
-            
-            elif group_method == '駅間':
-                ekikan_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-                ekikan_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-                
-                if ekikan_start and ekikan_end and ekikan_start not in ['', 'nan', 'NaN'] and ekikan_end not in ['', 'nan', 'NaN']:
-                    ekikan = f"{ekikan_start}→{ekikan_end}"
-                    unique_ekikan.add((rosen, ekikan))
-        
-        # Check missing entries
-        for rosen, kozo in unique_kozo:
-            exists = not self.structure_data_df[
-                (self.structure_data_df['構造物名称'].astype(str).str.strip() == kozo) & 
-                (self.structure_data_df['路線名'].astype(str).str.strip() == rosen)
-            ].empty if len(self.structure_data_df) > 0 else False
-            
-            if not exists:
-                missing_entries.append({
-                    'type': '構造物名称',
-                    'rosen': rosen,
-                    'value': kozo,
-                    'display_value': kozo
-                })
-        
-        for rosen, ekikan in unique_ekikan:
-            exists = not self.structure_data_df[
-                (self.structure_data_df['駅間'].astype(str).str.strip() == ekikan) & 
-                (self.structure_data_df['路線名'].astype(str).str.strip() == rosen)
-            ].empty if len(self.structure_data_df) > 0 else False
-            
-            if not exists:
+        # Normalize the grouped keys column-wise
+        rosen = normalize_key_column(frame_column(self.grouped_df, '路線名'))
+        group_method = normalize_key_column(frame_column(self.grouped_df, 'グループ化方法'))
+        kozo = normalize_key_column(frame_column(self.grouped_df, '構造物名称'))
+        ekikan_start = normalize_key_column(frame_column(self.grouped_df, '駅（始）'))
+        ekikan_end = normalize_key_column(frame_column(self.grouped_df, '駅（至）'))
+        
+        blank_values = ['', 'nan', 'NaN']
+        kozo_mask = (group_method == '構造物名称') & ~kozo.isin(blank_values)
+        ekikan_mask = (group_method == '駅間') & ~ekikan_start.isin(blank_values) & ~ekikan_end.isin(blank_values)
+        
+        # Distinct (路線名, 構造物名称) and (路線名, 駅間) keys of グループ化点検履歴
+        unique_kozo = pd.DataFrame({
+            '_rosen_key': rosen[kozo_mask],
+            '_lookup_key': kozo[kozo_mask]
+        }).drop_duplicates()
+        unique_ekikan = pd.DataFrame({
+            '_rosen_key': rosen[ekikan_mask],
+            '_lookup_key': ekikan_start[ekikan_mask] + '→' + ekikan_end[ekikan_mask]
+        }).drop_duplicates()
+        
+        # Anti-join the distinct keys against the structure master
+        structure_index = get_structure_index(self.structure_data_df)
+        missing_kozo = structure_index.anti_join(unique_kozo, structure_index.by_name)
+        missing_ekikan = structure_index.anti_join(unique_ekikan, structure_index.by_ekikan)
+        
+        for entry_type, missing_keys in (('構造物名称', missing_kozo), ('駅間', missing_ekikan)):
+            for rosen_key, value in zip(missing_keys['_rosen_key'], missing_keys['_lookup_key']):
                 missing_entries.append({
-                    'type': '駅間',
-                    'rosen': rosen,
-                    'value': ekikan,
-                    'display_value': ekikan
+                    'type': entry_type,
+                    'rosen': rosen_key,
+                    'value': value,
+                    'display_value': value
                 })
         
         missing_entries.sort(key=lambda x: (x['type'] == '駅間', x['rosen'], x['value']))
@@ -1976,6 +1968,12 @@ class StructureDataEntryApp:
                 for field, new_value in change_info['changes'].items():
                     self.structure_data_df.at[row_idx, field] = new_value
             
+            # Refresh the cached lookup keys for the edited rows only
+            if changed_rows:
+                changed_positions = [self.structure_data_df.index.get_loc(change_info['index'])
+                                     for change_info in changed_rows]
+                update_structure_index(self.structure_data_df, changed_positions)
+            
             # FAST SAVE: Only if there are actual changes
             if changes_made > 0:
                 self.save_structure_data_fast()
@@ -2243,11 +2241,17 @@ class StructureDataEntryApp:
             # FAST: Only save if we have data to save
             if new_rows:
                 # Add to existing dataframe
+                previous_df = self.structure_data_df
                 self.structure_data_df = pd.concat([
-                    self.structure_data_df, 
+                    previous_df, 
                     pd.DataFrame(new_rows)
                 ], ignore_index=True)
                 
+                # Index only the appended rows instead of renormalizing the whole master
+                update_structure_index(self.structure_data_df,
+                                       range(len(previous_df), len(self.structure_data_df)),
+                                       previous_df)
+                
                 # FAST save
                 self.save_structure_data_fast()
             
@@ -2320,27 +2324,8 @@ class StructureDataEntryApp:
                     lambda x: '' if str(x).lower() in ['nan', 'none', 'nat'] else x
                 )
             
-            # FASTEST: Write directly using openpyxl
-            wb = load_workbook(self.workbook_path)
-            
-            if '構造物番号' in wb.sheetnames:
-                del wb['構造物番号']
-            
-            ws = wb.create_sheet('構造物番号')
-            
-            # Write headers
-            headers = list(clean_df.columns)
-            for col, header in enumerate(headers, 1):
-                ws.cell(row=1, column=col, value=header)
-            
-            # Write only non-empty rows
-            for row_idx, (_, row_data) in enumerate(clean_df.iterrows(), 2):
-                for col_idx, value in enumerate(row_data, 1):
-                    cell_value = value if value != '' else None
-                    ws.cell(row=row_idx, column=col_idx, value=cell_value)
-            
-            wb.save(self.workbook_path)
-            wb.close()
+            # FASTEST: Write the rows in bulk; empty strings become empty cells
+            replace_sheets(self.workbook_path, {'構造物番号': clean_df})
             
         except Exception as e:
             raise Exception(f"Fast save error: {str(e)}")
@@ -2361,24 +2346,8 @@ class StructureDataEntryApp:
                 # Replace with empty string where value is 'nan'
                 clean_df[col] = clean_df[col].apply(lambda x: '' if str(x).lower() in ['nan', 'none', 'nat'] else x)
             
-            # Save with clean data
-            with pd.ExcelWriter(self.workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                # Write clean structure data
-                clean_df.to_excel(writer, sheet_name='構造物番号', index=False, na_rep='')
-                
-                # Preserve other sheets
-                try:
-                    original_wb = load_workbook(self.workbook_path)
-                    existing_sheets = [sheet for sheet in original_wb.sheetnames if sheet != '構造物番号']
-                    
-                    for sheet_name in existing_sheets:
-                        try:
-                            df_temp = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
-                            df_temp.to_excel(writer, sheet_name=sheet_name, index=False, na_rep='')
-                        except Exception:
-                            continue
-                except Exception:
-                    pass
+            # Save with clean data, replacing only the structure sheet
+            replace_sheets(self.workbook_path, {'構造物番号': clean_df})
                         
         except Exception as e:
             raise Exception(f"Error saving structure data: {str(e)}")
@@ -1,12 +1,12 @@
 import pandas as pd
 import openpyxl
-from openpyxl import load_workbook
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import re
 import threading
 import time
+from sheet_writer import replace_sheets
 
 class StructureDataEntryApp:
     def __init__(self):
@@ -632,22 +632,8 @@ class StructureDataEntryApp:
     def save_structure_data(self):
         """Save structure data to Excel"""
         try:
-            with pd.ExcelWriter(self.workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-                # Write structure data sheet
-                self.structure_data_df.to_excel(writer, sheet_name='構造物番号', index=False)
-                
-                # Preserve other sheets
-                try:
-                    original_wb = load_workbook(self.workbook_path)
-                    for sheet_name in original_wb.sheetnames:
-                        if sheet_name != '構造物番号':
-                            try:
-                                df_temp = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
-                                df_temp.to_excel(writer, sheet_name=sheet_name, index=False)
-                            except Exception as e:
-                                continue
-                except Exception as e:
-                    pass
+            # Write structure data sheet; other sheets are left untouched
+            replace_sheets(self.workbook_path, {'構造物番号': self.structure_data_df})
                     
         except Exception as e:
             raise Exception(f"Error saving structure data: {str(e)}")
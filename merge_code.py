@@ -13,6 +13,7 @@ import tempfile
 import xlsxwriter
 from collections import defaultdict
 import numpy as np
+from workbook_session import WorkbookSession
 
 # =============================================================================
 # MAIN INTEGRATED SYSTEM
@@ -43,6 +44,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.completed_steps = 0
         self.resume_step = None
         self.resume_data = {}
+        self.workbook_session = None
         
         self.create_main_gui()    
     
@@ -375,7 +377,9 @@ class InfrastructureDegradationAnalysisSystem:
         try:
             if self.phase1_selected.get():
                 self.log_message("Starting Phase 1: Data Processing & Sheet Generation")
-                self.execute_phase1()
+                if not self.execute_phase1():
+                    # Stopped, or paused on a locked file; resuming carries on from there
+                    return
             
             if not self.stop_processing and self.phase2_selected.get():
                 self.log_message("Starting Phase 2: Fortran Processing & Chart Generation")
@@ -388,7 +392,10 @@ class InfrastructureDegradationAnalysisSystem:
             self.handle_processing_error(str(e))
     
     def execute_phase1(self):
-        """Execute Phase 1: Data Processing & Sheet Generation"""
+        """Execute Phase 1: Data Processing & Sheet Generation; True once its sheets are saved"""
+        # Every stage of this run shares one parse of the workbook
+        self.workbook_session = None
+        
         phase1_codes = [
             ("Code 1", "Excel Processor - Weight Configuration", self.run_excel_processor),
             ("Code 2", "Enhanced Data Grouping", self.run_data_grouping),
@@ -418,10 +425,38 @@ class InfrastructureDegradationAnalysisSystem:
                 
             except PermissionError as pe:
                 self.handle_permission_error(code_name, str(pe))
-                return
+                return False
             except Exception as e:
                 self.step_progress.stop()
                 raise Exception(f"Error in {code_name}: {str(e)}")
+        
+        if self.stop_processing:
+            return False
+        return self.commit_phase1_sheets()
+    
+    def commit_phase1_sheets(self):
+        """Write every sheet staged during Phase 1 to the workbook in one save"""
+        try:
+            self.get_workbook_session().flush()
+            self.log_message("💾 Saved all Phase 1 sheets to the workbook")
+            return True
+        except PermissionError as pe:
+            # Nothing was written; resuming retries the save
+            self.handle_permission_error("Save", str(pe))
+            return False
+    
+    def get_workbook_session(self):
+        """Return the WorkbookSession shared by the Phase 1 stages of this run"""
+        if self.workbook_session is None:
+            workbook_path = None
+            for file in os.listdir(self.working_directory):
+                if file.endswith(('.xlsx', '.xls')) and not file.startswith('~'):
+                    workbook_path = os.path.join(self.working_directory, file)
+                    break
+            # Stages only stage their sheets; commit_phase1_sheets writes them once
+            self.workbook_session = WorkbookSession(workbook_path, deferred=True)
+        
+        return self.workbook_session
     
     def execute_phase2(self):
         """Execute Phase 2: Fortran Processing & Chart Generation"""
@@ -559,6 +594,9 @@ class InfrastructureDegradationAnalysisSystem:
                     self.resume_phase1_from(code_num)
                 else:  # Phase 2
                     self.execute_phase2()
+            elif self.resume_step == "Save":
+                # All Phase 1 codes ran; only the staged sheets are left to save
+                self.resume_phase1_from(9)
                     
         except Exception as e:
             self.handle_processing_error(str(e))
@@ -600,6 +638,9 @@ class InfrastructureDegradationAnalysisSystem:
                 self.step_progress.stop()
                 raise Exception(f"Error in {code_name}: {str(e)}")
         
+        if self.stop_processing or not self.commit_phase1_sheets():
+            return
+        
         # Continue to Phase 2 if selected
         if not self.stop_processing and self.phase2_selected.get():
             self.execute_phase2()
@@ -622,6 +663,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.stop_processing = False
         self.resume_step = None
         self.resume_data = {}
+        self.workbook_session = None
         self.completed_steps = 0
         self.overall_progress['value'] = 0
         self.step_progress.stop()
@@ -744,7 +786,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Excel Processor - Weight configuration forms will appear")
         
         try:
-            app = ExcelProcessorApp(self.working_directory)
+            app = ExcelProcessorApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Excel Processor completed - weights applied")
         except Exception as e:
@@ -758,7 +800,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Data Grouping - Grouping configuration forms will appear")
         
         try:
-            app = EnhancedDataGroupingApp(self.working_directory)
+            app = EnhancedDataGroupingApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Data Grouping completed - grouping rules applied")
         except Exception as e:
@@ -772,7 +814,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Combined Processor - Max function forms will appear")
         
         try:
-            app = EnhancedCombinedProcessorApp(self.working_directory)
+            app = EnhancedCombinedProcessorApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Combined Processor completed - max function applied")
         except Exception as e:
@@ -786,7 +828,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Structure Data Entry - Excel table interface will appear")
         
         try:
-            app = StructureDataEntryApp(self.working_directory)
+            app = StructureDataEntryApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Structure Data Entry completed - data entered")
         except Exception as e:
@@ -800,7 +842,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Division Sheets Generator")
         
         try:
-            app = EnhancedDivisionSheetsApp(self.working_directory)
+            app = EnhancedDivisionSheetsApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Division Sheets completed - enhanced sheets generated")
         except Exception as e:
@@ -814,7 +856,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running New Calculation Sheets Generator")
         
         try:
-            app = EnhancedNewCalculationSheetsApp(self.working_directory)
+            app = EnhancedNewCalculationSheetsApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Calculation Sheets completed - new calculations applied")
         except Exception as e:
@@ -828,7 +870,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Keijiheka Generator - Time-series analysis")
         
         try:
-            app = EnhancedKeijihenkaGeneratorApp(self.working_directory)
+            app = EnhancedKeijihenkaGeneratorApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Keijiheka Generator completed - time-series sheets generated")
         except Exception as e:
@@ -842,7 +884,7 @@ class InfrastructureDegradationAnalysisSystem:
         self.log_message("Running Obser Generator - Parameter forms will appear")
         
         try:
-            app = ObserFileGeneratorApp(self.working_directory)
+            app = ObserFileGeneratorApp(self.working_directory, self.get_workbook_session())
             app.run_with_preserved_forms()
             self.log_message("Obser Generator completed - obser files created")
         except Exception as e:
@@ -876,7 +918,7 @@ class InfrastructureDegradationAnalysisSystem:
 
 class ExcelProcessorApp:
     """Modified Excel Processor that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.selected_columns_for_weighting = []
@@ -885,6 +927,7 @@ class ExcelProcessorApp:
         
         # Find Excel file in working directory
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -993,22 +1036,22 @@ class ExcelProcessorApp:
         try:
             # Apply the weights as in your original code
             # This should contain your original weight application logic
-            wb = load_workbook(self.workbook_path)
             # Your original weight processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class EnhancedDataGroupingApp:
     """Modified Data Grouping App that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.grouped_df = None
         self.rules = []
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1108,20 +1151,20 @@ class EnhancedDataGroupingApp:
         """Process the grouping configuration (preserved from original)"""
         try:
             # Apply the grouping as in your original code
-            wb = load_workbook(self.workbook_path)
             # Your original grouping processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class EnhancedCombinedProcessorApp:
     """Modified Combined Processor App (Code 3) that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1198,17 +1241,16 @@ class EnhancedCombinedProcessorApp:
     def process_combined(self):
         """Process the combined functionality (preserved from original)"""
         try:
-            wb = load_workbook(self.workbook_path)
             # Your original Code 3 processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class StructureDataEntryApp:
     """Modified Structure Data Entry App (Code 4) that uses shared directory and preserves ALL user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.grouped_df = None
@@ -1216,6 +1258,7 @@ class StructureDataEntryApp:
         self.entry_widgets = {}
         self.default_entries = {}
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1287,15 +1330,14 @@ class StructureDataEntryApp:
     def load_and_validate_workbook(self):
         """Load workbook and validate required sheets"""
         try:
-            wb = load_workbook(self.workbook_path)
             required_sheet = 'グループ化点検履歴'
             
-            if required_sheet not in wb.sheetnames:
+            if not self.workbook_session.has_sheet(required_sheet):
                 self.status_label.config(text="Required sheet not found!", fg="red")
                 return
             
             # Load data
-            self.grouped_df = pd.read_excel(self.workbook_path, sheet_name=required_sheet)
+            self.grouped_df = self.workbook_session.read_sheet(required_sheet)
             
             # Load structure data if exists
             self.load_structure_data()
@@ -1309,7 +1351,7 @@ class StructureDataEntryApp:
     def load_structure_data(self):
         """Load existing structure data sheet"""
         try:
-            self.structure_data_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+            self.structure_data_df = self.workbook_session.read_sheet('構造物番号')
             # Ensure all required columns exist
             required_columns = [
                 '路線名', '構造物名称', '駅間', '構造物番号', '長さ(m)', 
@@ -1684,11 +1726,8 @@ class StructureDataEntryApp:
     
     def save_structure_data(self):
         """Save structure data to Excel"""
-        try:
-            with pd.ExcelWriter(self.workbook_path, mode='a', if_sheet_exists='replace', engine='openpyxl') as writer:
-                self.structure_data_df.to_excel(writer, sheet_name='構造物番号', index=False)
-        except PermissionError:
-            raise PermissionError(f"Cannot access {self.workbook_path}")
+        self.workbook_session.write_sheet('構造物番号', self.structure_data_df)
+        self.workbook_session.save()
     
     def complete_structure_entry(self, parent):
         """Complete structure entry process"""
@@ -1706,10 +1745,11 @@ class StructureDataEntryApp:
 
 class EnhancedDivisionSheetsApp:
     """Modified Division Sheets App (Code 5) that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1786,20 +1826,20 @@ class EnhancedDivisionSheetsApp:
     def process_division_sheets(self):
         """Process the division sheets (preserved from original)"""
         try:
-            wb = load_workbook(self.workbook_path)
             # Your original Code 5 processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class EnhancedNewCalculationSheetsApp:
     """Modified New Calculation Sheets App (Code 6) that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1876,20 +1916,20 @@ class EnhancedNewCalculationSheetsApp:
     def process_calculation_sheets(self):
         """Process the calculation sheets (preserved from original)"""
         try:
-            wb = load_workbook(self.workbook_path)
             # Your original Code 6 processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class EnhancedKeijihenkaGeneratorApp:
     """Modified Keijiheka Generator App (Code 7) that uses shared directory and preserves user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -1966,17 +2006,16 @@ class EnhancedKeijihenkaGeneratorApp:
     def process_keijiheka_sheets(self):
         """Process the keijiheka sheets (preserved from original)"""
         try:
-            wb = load_workbook(self.workbook_path)
             # Your original Code 7 processing logic here
-            wb.save(self.workbook_path)
-            wb.close()
+            # Write whatever this stage changed through the shared session
+            self.workbook_session.save()
         except PermissionError:
             raise PermissionError(f"Cannot access {self.workbook_path}")
 
 
 class ObserFileGeneratorApp:
     """Modified Obser File Generator App (Code 8) that uses shared directory and preserves ALL user forms"""
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, workbook_session=None):
         self.working_directory = working_directory
         self.workbook_path = None
         self.nyuuryoku_params = {
@@ -1999,6 +2038,7 @@ class ObserFileGeneratorApp:
         }
         
         self.find_excel_file()
+        self.workbook_session = workbook_session if workbook_session is not None else WorkbookSession(self.workbook_path)
     
     def find_excel_file(self):
         """Find the main Excel file in working directory"""
@@ -2190,7 +2230,7 @@ class ObserFileGeneratorApp:
     def load_nyuuryoku_parameters(self):
         """Load parameters from 入力値 sheet"""
         try:
-            nyuuryoku_df = pd.read_excel(self.workbook_path, sheet_name='入力値', header=None)
+            nyuuryoku_df = self.workbook_session.read_sheet('入力値', header=None)
             
             if len(nyuuryoku_df) >= 2:
                 headers = nyuuryoku_df.iloc[0]
@@ -2234,30 +2274,17 @@ class ObserFileGeneratorApp:
     def save_nyuuryoku_parameters(self):
         """Save parameters to 入力値 sheet"""
         try:
-            wb = load_workbook(self.workbook_path)
-            
-            if '入力値' in wb.sheetnames:
-                wb.remove(wb['入力値'])
-            
-            ws = wb.create_sheet('入力値')
-            
-            # Headers in row 1
-            ws['A1'] = 'データ個数'
-            ws['B1'] = '予測年数' 
-            ws['C1'] = 'λ定数'
-            ws['D1'] = '点検年度に対応した年'
-            
-            # Values in row 2
-            ws['A2'] = self.nyuuryoku_params['data_count']
-            ws['B2'] = self.nyuuryoku_params['prediction_years']
-            ws['C2'] = self.nyuuryoku_params['lambda_constant']
+            # Headers in row 1, values in row 2 and the years in column D from row 2
+            years = self.nyuuryoku_params['inspection_years']
+            nyuuryoku_df = pd.DataFrame({
+                'データ個数': [self.nyuuryoku_params['data_count']] + [None] * (len(years) - 1),
+                '予測年数': [self.nyuuryoku_params['prediction_years']] + [None] * (len(years) - 1),
+                'λ定数': [self.nyuuryoku_params['lambda_constant']] + [None] * (len(years) - 1),
+                '点検年度に対応した年': years
+            })
             
-            # Years in column D starting from row 2
-            for i, year in enumerate(self.nyuuryoku_params['inspection_years']):
-                ws[f'D{i+2}'] = year
-            
-            wb.save(self.workbook_path)
-            wb.close()
+            self.workbook_session.write_sheet('入力値', nyuuryoku_df)
+            self.workbook_session.save()
             
         except Exception as e:
             raise Exception(f"Error saving to Excel: {str(e)}")
@@ -2289,6 +2316,9 @@ class ObserFileGeneratorApp:
                 except Exception as e:
                     print(f"Error generating {obser_file}: {e}")
             
+            # Save all sorted sheets back in one write
+            self.workbook_session.save()
+            
         except Exception as e:
             raise Exception(f"Error generating files: {str(e)}")
     
@@ -2296,16 +2326,15 @@ class ObserFileGeneratorApp:
         """Create obser file with sorting and 0 value replacement"""
         try:
             # Load sheet data
-            sheet_df = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
+            sheet_df = self.workbook_session.read_sheet(sheet_name)
             
             # Sort by last column in descending order
             if len(sheet_df) > 0 and len(sheet_df.columns) > 0:
                 last_col = sheet_df.columns[-1]
                 sheet_df = sheet_df.sort_values(by=last_col, ascending=False)
                 
-                # Save the sorted data back to Excel sheet
-                with pd.ExcelWriter(self.workbook_path, mode='a', if_sheet_exists='replace', engine='openpyxl') as writer:
-                    sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+                # Stage the sorted data; generate_obser_files saves all sheets at once
+                self.workbook_session.write_sheet(sheet_name, sheet_df)
             
             with open(output_path, 'w', encoding='utf-8') as f:
                 # First line: parameters separated by spaces
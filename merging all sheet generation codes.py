@@ -6,6 +6,11 @@ from tkinter import ttk, filedialog
 import os
 import re
 import warnings
+from structure_index import get_structure_index, load_structure_master, build_raw_ekikan_keys, map_distinct
+from year_matrix import (year_result_columns, year_column_mapping, year_value_matrix, write_year_matrix,
+                         round_values, multiply_by_weights, divide_by_lengths, load_year_sheets)
+from operator_formula import get_operator_weights
+from sheet_reader import read_sheet
 
 # Suppress pandas warnings for better performance
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -52,66 +57,35 @@ class UnifiedExcelProcessorApp:
         try:
             if structure_df is None or len(structure_df) == 0:
                 return ''
-                
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
-            
-            # First try to match by structure name
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
             
-            # If not found by structure name, try by station interval
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
         except Exception:
             return ''
     
-    def add_enhanced_columns(self, df, structure_df=None):
+    def add_enhanced_columns(self, df, structure_df=None, structure_numbers=None):
         """Add enhanced columns: 路線名略称 and 構造物番号"""
         enhanced_df = df.copy()
         
         # Add 路線名略称 column
         if '路線名' in enhanced_df.columns:
-            enhanced_df['路線名略称'] = enhanced_df['路線名'].apply(self.abbreviate_sen_name)
+            enhanced_df['路線名略称'] = map_distinct(enhanced_df['路線名'], self.abbreviate_sen_name)
         else:
             enhanced_df['路線名略称'] = ''
         
         # Add 構造物番号 column
         enhanced_df['構造物番号'] = ''
         
-        if structure_df is not None:
-            for index, row in enhanced_df.iterrows():
-                rosen_name = row.get('路線名', '')
-                kozo_name = row.get('構造物名称', '')
-                
-                # Create ekikan for lookup
-                ekikan = ''
-                if row.get('駅（始）', '') and row.get('駅（至）', ''):
-                    ekikan = f"{row.get('駅（始）', '')}→{row.get('駅（至）', '')}"
-                
-                # Lookup structure number
-                bangou = self.lookup_structure_number(structure_df, rosen_name, kozo_name, ekikan)
-                enhanced_df.at[index, '構造物番号'] = bangou
+        if structure_df is not None and structure_numbers is not None:
+            # 構造物番号 already resolved together with the weights and length
+            enhanced_df['構造物番号'] = list(structure_numbers)
+        elif structure_df is not None and len(structure_df) > 0:
+            # Bulk lookup: join on structure name, then on 駅間 for the unmatched rows
+            structure_index = get_structure_index(structure_df)
+            ekikan_keys = build_raw_ekikan_keys(enhanced_df)
+            enhanced_df['構造物番号'] = structure_index.lookup_structure_numbers(enhanced_df, ekikan_keys)
         
         return enhanced_df
     
@@ -285,8 +259,8 @@ class UnifiedExcelProcessorApp:
             
             # Load structure and operator data
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
-                self.operator_df = pd.read_excel(self.workbook_path, sheet_name=operator_sheet_name)
+                self.structure_df = load_structure_master(self.workbook_path)
+                self.operator_df = read_sheet(self.workbook_path, operator_sheet_name)
             except Exception as e:
                 self.status_label.config(text=f"❌ Error loading data: {str(e)[:50]}...", fg="#e74c3c")
                 self.progress_label.config(text="❌ Data loading failed")
@@ -313,72 +287,24 @@ class UnifiedExcelProcessorApp:
     def execute_complete_process(self):
         """Execute the complete 9-sheet generation process"""
         try:
-            # Load all required sheets
-            max_df = pd.read_excel(self.workbook_path, sheet_name='補修無視')
-            hoshuu_df = pd.read_excel(self.workbook_path, sheet_name='補修考慮')
-            structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
-            grouped_df = pd.read_excel(self.workbook_path, sheet_name='グループ化点検履歴')
-            
-            # Sheet 1: 割算結果(補修無視)
-            self.progress_label.config(text="▶️ Processing 割算結果(補修無視) - 1/9")
-            self.progress_bar.config(value=30)
-            self.root.update()
-            sheet1 = self.apply_division_logic(max_df, structure_df, "補修無視")
-            
-            # Sheet 2: 割算結果(補修考慮)
-            self.progress_label.config(text="▶️ Processing 割算結果(補修考慮) - 2/9")
-            self.progress_bar.config(value=35)
-            self.root.update()
-            sheet2 = self.apply_division_logic(hoshuu_df, structure_df, "補修考慮")
-            
-            # Sheet 3: 新しい演算(補修無視)
-            self.progress_label.config(text="▶️ Processing 新しい演算(補修無視) - 3/9")
-            self.progress_bar.config(value=40)
-            self.root.update()
-            sheet3 = self.apply_new_calculation_logic(max_df, structure_df, "補修無視")
-            
-            # Sheet 4: 新しい演算(補修考慮)
-            self.progress_label.config(text="▶️ Processing 新しい演算(補修考慮) - 4/9")
-            self.progress_bar.config(value=45)
-            self.root.update()
-            sheet4 = self.apply_new_calculation_logic(hoshuu_df, structure_df, "補修考慮")
-            
-            # Sheet 5: 割算結果-新しい演算(補修無視)
-            self.progress_label.config(text="▶️ Processing 割算結果-新しい演算(補修無視) - 5/9")
-            self.progress_bar.config(value=55)
-            self.root.update()
-            sheet5 = self.apply_division_calculation_logic(max_df, structure_df, "補修無視")
-            
-            # Sheet 6: 割算結果-新しい演算(補修考慮)
-            self.progress_label.config(text="▶️ Processing 割算結果-新しい演算(補修考慮) - 6/9")
-            self.progress_bar.config(value=65)
-            self.root.update()
-            sheet6 = self.apply_division_calculation_logic(hoshuu_df, structure_df, "補修考慮")
-            
-            # Sheet 7: 経時変化（橋長考慮）
-            self.progress_label.config(text="▶️ Processing 経時変化（橋長考慮） - 7/9")
-            self.progress_bar.config(value=75)
-            self.root.update()
-            sheet7 = self.apply_keiji_kyoucho_logic(grouped_df, structure_df)
-            
-            # Sheet 8: 経時変化（橋長&形式考慮）
-            self.progress_label.config(text="▶️ Processing 経時変化（橋長&形式考慮） - 8/9")
-            self.progress_bar.config(value=85)
-            self.root.update()
-            sheet8 = self.apply_keiji_both_logic(sheet7, structure_df, self.operator_df)
-            
-            # Sheet 9: 経時変化（橋長無視&形式考慮）
-            self.progress_label.config(text="▶️ Processing 経時変化（橋長無視&形式考慮） - 9/9")
-            self.progress_bar.config(value=90)
-            self.root.update()
-            sheet9 = self.apply_keiji_mushi_logic(grouped_df, structure_df, self.operator_df)
+            # Load all required sheets, converting their year columns to float64 once
+            source_sheets = load_year_sheets(self.workbook_path, ['補修無視', '補修考慮', 'グループ化点検履歴'])
+            max_df = source_sheets['補修無視']
+            hoshuu_df = source_sheets['補修考慮']
+            grouped_df = source_sheets['グループ化点検履歴']
+            # Reuse the structure master loaded during validation
+            structure_df = self.structure_df
+            if structure_df is None:
+                structure_df = load_structure_master(self.workbook_path)
+            
+            # Generate all 9 sheets from the shared intermediates
+            sheets = self.generate_all_sheets(max_df, hoshuu_df, grouped_df, structure_df,
+                                              self.operator_df, self.report_progress)
             
             # Save all sheets
-            self.progress_label.config(text="💾 Saving all 9 enhanced sheets...")
-            self.progress_bar.config(value=95)
-            self.root.update()
+            self.report_progress("💾 Saving all 9 enhanced sheets...", 95)
             
-            self.save_all_results(sheet1, sheet2, sheet3, sheet4, sheet5, sheet6, sheet7, sheet8, sheet9)
+            self.save_all_results(*sheets)
             
             # Complete processing
             self.status_label.config(text="🎉 All 9 sheets generated successfully!", fg="#27ae60")
@@ -398,476 +324,105 @@ class UnifiedExcelProcessorApp:
             self.progress_bar.config(value=0)
             self.select_btn.config(state="normal", text="📁 Select Excel Workbook")
 
-    def apply_division_logic(self, source_df, structure_df, sheet_type):
-        """Apply division logic: Original ÷ Length"""
-        result_df = source_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Rename year columns to include "合計重み/長さ"
-        column_mapping = {}
-        for col in year_columns:
-            year_match = re.search(r'(\d{4})', col)
-            if year_match:
-                year = year_match.group(1)
-                new_col_name = f"{year} 合計重み/長さ"
-                column_mapping[col] = new_col_name
-        
-        result_df = result_df.rename(columns=column_mapping)
-        
-        # Apply division for each row
-        for index, row in result_df.iterrows():
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ''
-            length_value = self.find_length_value(structure_df, kozo_name, ekikan, row.get('路線名', ''))
-            
-            # Divide year result columns by length
-            for old_col, new_col in column_mapping.items():
-                original_value = source_df.loc[index, old_col] if old_col in source_df.columns else None
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        if length_value and length_value > 0:
-                            divided_value = numeric_value / length_value
-                            result_df.loc[index, new_col] = float(round(divided_value, 3))
-                        else:
-                            result_df.loc[index, new_col] = float(numeric_value)
-                    except (ValueError, TypeError):
-                        result_df.loc[index, new_col] = original_value
-                else:
-                    result_df.loc[index, new_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
-        return self.reorder_columns_enhanced(enhanced_df)
+    def report_progress(self, text, value):
+        """Show a processing step on the progress label and bar"""
+        self.progress_label.config(text=text)
+        self.progress_bar.config(value=value)
+        self.root.update()
 
-    def apply_new_calculation_logic(self, source_df, structure_df, sheet_type):
-        """Apply new calculation logic: X*A*B*C"""
-        result_df = source_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Apply X*A*B*C calculation for each row
-        for index, row in result_df.iterrows():
-            weights = self.get_structure_weights(structure_df, row)
-            
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        x_value = float(original_value)
-                        calculated_value = x_value * weights['A'] * weights['B'] * weights['C']
-                        result_df.loc[index, year_col] = float(round(calculated_value, 3))
-                    except (ValueError, TypeError):
-                        result_df.loc[index, year_col] = original_value
-                else:
-                    result_df.loc[index, year_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
-        return self.reorder_columns_enhanced(enhanced_df)
+    def generate_all_sheets(self, max_df, hoshuu_df, grouped_df, structure_df, operator_df, report=None):
+        """Build the 9 result sheets, resolving structure data and shared products only once.
 
-    def apply_division_calculation_logic(self, source_df, structure_df, sheet_type):
-        """Apply division calculation logic: X*A*B*C ÷ Length"""
-        result_df = source_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Rename year columns to include division indicator
-        column_mapping = {}
-        for col in year_columns:
-            year_match = re.search(r'(\d{4})', col)
-            if year_match:
-                year = year_match.group(1)
-                new_col_name = f"{year} 新演算/長さ"
-                column_mapping[col] = new_col_name
-        
-        result_df = result_df.rename(columns=column_mapping)
-        
-        # Apply X*A*B*C ÷ Length calculation for each row
-        for index, row in result_df.iterrows():
-            weights = self.get_structure_weights(structure_df, row)
-            length_value = self.get_length_value_direct(structure_df, row)
-            
-            for old_col, new_col in column_mapping.items():
-                original_value = source_df.loc[index, old_col] if old_col in source_df.columns else None
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        x_value = float(original_value)
-                        calculated_value = x_value * weights['A'] * weights['B'] * weights['C']
-                        
-                        if length_value and length_value > 0:
-                            final_value = calculated_value / length_value
-                            result_df.loc[index, new_col] = float(round(final_value, 3))
-                        else:
-                            result_df.loc[index, new_col] = float(round(calculated_value, 3))
-                    except (ValueError, TypeError):
-                        result_df.loc[index, new_col] = original_value
-                else:
-                    result_df.loc[index, new_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
-        return self.reorder_columns_enhanced(enhanced_df)
+        Sheets 3/5 and 4/6 share X*A*B*C, sheet 7 divides グループ化点検履歴 by
+        length, sheet 8 is sheet 7 times the 演算子‐2 weight and sheet 9 is
+        グループ化点検履歴 times the same weight.
+        """
+        if report is None:
+            report = lambda text, value: None
+        
+        # Resolve lengths, A/B/C weights, 構造物番号 and year matrices once per source sheet
+        report("▶️ Resolving structure lengths and weights...", 28)
+        max_inputs = self.resolve_shared_inputs(max_df, structure_df)
+        hoshuu_inputs = self.resolve_shared_inputs(hoshuu_df, structure_df)
+        grouped_inputs = self.resolve_shared_inputs(grouped_df, structure_df)
+        operator_weights = self.resolve_operator_weights(grouped_df, structure_df, operator_df)
+        
+        sheets = []
+        for inputs, sheet_type, number, progress in ((max_inputs, "補修無視", 1, 30), (hoshuu_inputs, "補修考慮", 2, 35)):
+            # Sheets 1/2: 割算結果 - Original ÷ Length (100.0 when no length is found)
+            report(f"▶️ Processing 割算結果({sheet_type}) - {number}/9", progress)
+            divided = divide_by_lengths(inputs['values'], inputs['attributes']['長さ(m)'].fillna(100.0))
+            sheets.append(self.build_result_sheet(inputs, divided, inputs['numeric'], '合計重み/長さ'))
+        
+        for inputs, sheet_type, number, progress in ((max_inputs, "補修無視", 3, 40), (hoshuu_inputs, "補修考慮", 4, 45)):
+            # Sheets 3/4: 新しい演算 - X*A*B*C
+            report(f"▶️ Processing 新しい演算({sheet_type}) - {number}/9", progress)
+            sheets.append(self.build_result_sheet(inputs, round_values(inputs['weighted']), inputs['numeric']))
+        
+        for inputs, sheet_type, number, progress in ((max_inputs, "補修無視", 5, 55), (hoshuu_inputs, "補修考慮", 6, 65)):
+            # Sheets 5/6: 割算結果-新しい演算 - X*A*B*C ÷ Length
+            report(f"▶️ Processing 割算結果-新しい演算({sheet_type}) - {number}/9", progress)
+            divided = divide_by_lengths(inputs['weighted'], inputs['attributes']['長さ(m)'], round_undivided=True)
+            sheets.append(self.build_result_sheet(inputs, divided, inputs['numeric'], '新演算/長さ'))
+        
+        # Sheet 7: 経時変化（橋長考慮） - グループ化点検履歴 ÷ Length
+        report("▶️ Processing 経時変化（橋長考慮） - 7/9", 75)
+        kyoucho_values = divide_by_lengths(grouped_inputs['values'], grouped_inputs['attributes']['長さ(m)'])
+        sheets.append(self.build_result_sheet(grouped_inputs, kyoucho_values, grouped_inputs['numeric']))
+        
+        # Sheet 8: 経時変化（橋長&形式考慮） - Sheet 7 × Structure weights
+        report("▶️ Processing 経時変化（橋長&形式考慮） - 8/9", 85)
+        both_values = round_values(multiply_by_weights(kyoucho_values, operator_weights))
+        sheets.append(self.build_result_sheet(grouped_inputs, both_values, grouped_inputs['numeric']))
+        
+        # Sheet 9: 経時変化（橋長無視&形式考慮） - グループ化点検履歴 × Structure weights
+        report("▶️ Processing 経時変化（橋長無視&形式考慮） - 9/9", 90)
+        mushi_values = round_values(multiply_by_weights(grouped_inputs['values'], operator_weights))
+        sheets.append(self.build_result_sheet(grouped_inputs, mushi_values, grouped_inputs['numeric']))
+        
+        return sheets
 
-    def apply_keiji_kyoucho_logic(self, grouped_df, structure_df):
-        """Apply 経時変化（橋長考慮） logic: グループ化点検履歴 ÷ Length"""
-        result_df = grouped_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Apply division by length for each row
-        for index, row in result_df.iterrows():
-            length_value = self.get_length_value_direct(structure_df, row)
-            
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        if length_value and length_value > 0:
-                            divided_value = numeric_value / length_value
-                            result_df.loc[index, year_col] = float(round(divided_value, 3))
-                        else:
-                            result_df.loc[index, year_col] = float(numeric_value)
-                    except (ValueError, TypeError):
-                        result_df.loc[index, year_col] = original_value
-                else:
-                    result_df.loc[index, year_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
-        return self.reorder_columns_enhanced(enhanced_df)
+    def resolve_shared_inputs(self, source_df, structure_df):
+        """Resolve what every sheet built from source_df needs: structure attributes, year matrix and X*A*B*C"""
+        year_columns = year_result_columns(source_df)
+        attributes = get_structure_index(structure_df).resolve_attributes(source_df)
+        values, numeric = year_value_matrix(source_df, year_columns)
+        
+        return {
+            'source_df': source_df,
+            'year_columns': year_columns,
+            'attributes': attributes,
+            'values': values,
+            'numeric': numeric,
+            'weighted': multiply_by_weights(values, attributes['A'], attributes['B'], attributes['C'])
+        }
 
-    def apply_keiji_both_logic(self, keiji_kyoucho_df, structure_df, operator_df):
-        """Apply 経時変化（橋長&形式考慮） logic: Above × Structure weights"""
-        result_df = keiji_kyoucho_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Apply structure weights multiplication for each row
-        for index, row in result_df.iterrows():
-            weights = self.get_structure_weights_with_operator(structure_df, operator_df, row)
-            
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        calculated_value = numeric_value * weights['total_weight']
-                        result_df.loc[index, year_col] = float(round(calculated_value, 3))
-                    except (ValueError, TypeError):
-                        result_df.loc[index, year_col] = original_value
-                else:
-                    result_df.loc[index, year_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
-        return self.reorder_columns_enhanced(enhanced_df)
+    def build_result_sheet(self, inputs, values, numeric, label=None):
+        """Write a calculated year block into a copy of the source sheet and add the enhanced columns.
 
-    def apply_keiji_mushi_logic(self, grouped_df, structure_df, operator_df):
-        """Apply 経時変化（橋長無視&形式考慮） logic: グループ化点検履歴 × Structure weights"""
-        result_df = grouped_df.copy()
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Apply structure weights multiplication for each row
-        for index, row in result_df.iterrows():
-            weights = self.get_structure_weights_with_operator(structure_df, operator_df, row)
-            
-            for year_col in year_columns:
-                original_value = row[year_col]
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        calculated_value = numeric_value * weights['total_weight']
-                        result_df.loc[index, year_col] = float(round(calculated_value, 3))
-                    except (ValueError, TypeError):
-                        result_df.loc[index, year_col] = original_value
-                else:
-                    result_df.loc[index, year_col] = original_value
-        
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
+        With a label, year columns are renamed to '{year} {label}' and only
+        those columns are written, like the division sheets always did.
+        """
+        result_df = inputs['source_df'].copy()
+        year_columns = inputs['year_columns']
+        positions = list(range(len(year_columns)))
+        
+        if label:
+            column_mapping = year_column_mapping(year_columns, label)
+            result_df = result_df.rename(columns=column_mapping)
+            positions = [position for position, col in enumerate(year_columns) if col in column_mapping]
+            year_columns = [column_mapping[year_columns[position]] for position in positions]
+        
+        # Blank and non-numeric cells pass through
+        write_year_matrix(result_df, year_columns, values[:, positions], numeric[:, positions])
+        
+        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df, inputs['attributes']['構造物番号'])
         return self.reorder_columns_enhanced(enhanced_df)
 
-    def find_length_value(self, structure_df, kozo_name, ekikan, rosen_name):
-        """Find length value from structure data"""
-        try:
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Default length if not found
-            return 100.0
-            
-        except Exception:
-            return 100.0
-
-    def get_structure_weights(self, structure_df, row):
-        """Get structure weights (A, B, C) from structure data"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ''
-            
-            # Default weights
-            weights = {'A': 1.0, 'B': 1.0, 'C': 1.0}
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            weights['A'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            weights['B'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            weights['C'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    return weights
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            weights['A'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            weights['B'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            weights['C'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            return weights
-            
-        except Exception:
-            return {'A': 1.0, 'B': 1.0, 'C': 1.0}
-
-    def get_length_value_direct(self, structure_df, row):
-        """Get length value directly from structure data"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ''
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            return None
-            
-        except Exception:
-            return None
-
-    def get_structure_weights_with_operator(self, structure_df, operator_df, row):
-        """Get structure weights using 演算子‐2 formulas with A1, B1, C1 mapping"""
-        try:
-            rosen_name = str(row.get('路線名', '')).strip() if pd.notna(row.get('路線名', '')) else ''
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ''
-            
-            # Get values from structure data
-            structure_values = {'A1': 1.0, 'B1': 1.0, 'C1': 1.0}
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            structure_values['A1'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            structure_values['B1'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            structure_values['C1'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            elif ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    match_row = matches.iloc[0]
-                    
-                    if '構造形式_重み' in match_row and pd.notna(match_row['構造形式_重み']):
-                        try:
-                            structure_values['A1'] = float(match_row['構造形式_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '角度_重み' in match_row and pd.notna(match_row['角度_重み']):
-                        try:
-                            structure_values['B1'] = float(match_row['角度_重み'])
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if '供用年数_重み' in match_row and pd.notna(match_row['供用年数_重み']):
-                        try:
-                            structure_values['C1'] = float(match_row['供用年数_重み'])
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Apply 演算子‐2 formulas with dynamic evaluation
-            total_weight = self.evaluate_operator_formulas(operator_df, structure_values)
-            
-            return {
-                'A1': structure_values['A1'],
-                'B1': structure_values['B1'], 
-                'C1': structure_values['C1'],
-                'total_weight': total_weight
-            }
-            
-        except Exception:
-            return {'A1': 1.0, 'B1': 1.0, 'C1': 1.0, 'total_weight': 1.0}
-
-    def evaluate_operator_formulas(self, operator_df, structure_values):
-        """Evaluate 演算子‐2 formulas with A1, B1, C1 mapping"""
-        try:
-            # Find the formula in 演算子‐2 sheet
-            if len(operator_df) > 0:
-                formula_row = operator_df.iloc[0]
-                
-                # Look for formula column
-                formula = None
-                for col in operator_df.columns:
-                    cell_value = str(formula_row[col]).strip()
-                    if any(var in cell_value for var in ['A1', 'B1', 'C1']) and any(op in cell_value for op in ['*', '+', '-', '/']):
-                        formula = cell_value
-                        break
-                
-                if formula:
-                    # Replace A1, B1, C1 with actual values
-                    formula = formula.replace('A1', str(structure_values['A1']))
-                    formula = formula.replace('B1', str(structure_values['B1']))
-                    formula = formula.replace('C1', str(structure_values['C1']))
-                    
-                    # Safely evaluate the formula
-                    try:
-                        result = eval(formula)
-                        return float(result)
-                    except:
-                        return 1.0
-            
-            # Default calculation if no formula found
-            return structure_values['A1'] * structure_values['B1'] * structure_values['C1']
-            
-        except Exception:
-            return 1.0
+    def resolve_operator_weights(self, source_df, structure_df, operator_df):
+        """Get the 演算子‐2 total weight for every row of source_df using A1, B1, C1 mapping"""
+        weights = get_structure_index(structure_df).resolve_operator_weights(source_df)
+        return get_operator_weights(operator_df).total_weights(weights['A1'], weights['B1'], weights['C1'])
 
     def save_all_results(self, sheet1, sheet2, sheet3, sheet4, sheet5, sheet6, sheet7, sheet8, sheet9):
         """Save all 9 enhanced sheets to Excel workbook"""
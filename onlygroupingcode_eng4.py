@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import openpyxl
 from openpyxl import load_workbook
 import tkinter as tk
@@ -6,6 +7,9 @@ from tkinter import ttk, filedialog, messagebox
 import json
 import os
 from collections import defaultdict
+from structure_index import get_structure_index, load_structure_master
+from sheet_writer import replace_sheets
+from grouping_rules import RuleTable, build_grouping_keys, preview_grouping
 
 class CleanDataGroupingApp:
     def __init__(self):
@@ -48,57 +52,16 @@ class CleanDataGroupingApp:
     def lookup_structure_number(self, structure_df, rosen_name, kozo_name, ekikan):
         """Lookup 構造物番号 from structure sheet"""
         try:
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
+            if structure_df is None or len(structure_df) == 0:
+                return ''
             
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
         except Exception as e:
             return ''
     
-    def create_enhanced_grouping_key(self, shubetsu, tenken_kubun, structure_name, eki_start, eki_end, group_method):
-        """Create grouping key with enhanced logic"""
-        try:
-            if group_method == "構造物名称":
-                if tenken_kubun == "*":
-                    key = f"{shubetsu}|{structure_name}"
-                else:
-                    key = f"{shubetsu}|{structure_name}|{tenken_kubun}"
-            else:  # 駅間
-                ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ""
-                if tenken_kubun == "*":
-                    key = f"{shubetsu}|{ekikan}"
-                else:
-                    key = f"{shubetsu}|{ekikan}|{tenken_kubun}"
-            
-            return key
-            
-        except Exception as e:
-            return "UNKNOWN"
-    
     def create_main_gui(self):
         """Create main GUI for file selection"""
         main_frame = tk.Frame(self.root, bg='#f5f5f5', padx=40, pady=40)
@@ -164,7 +127,7 @@ class CleanDataGroupingApp:
             
             # Try to load structure data if it exists
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+                self.structure_df = load_structure_master(self.workbook_path)
             except:
                 self.structure_df = None
             
@@ -314,6 +277,12 @@ class CleanDataGroupingApp:
                              relief="solid", bd=1)
         delete_btn.pack(side="left", padx=5)
         
+        preview_btn = tk.Button(button_frame, text="🔍 Preview Groups", 
+                              command=self.show_grouping_preview, bg="#8e44ad", fg="white", 
+                              width=16, height=2, font=("Arial", 10, "bold"), cursor="hand2",
+                              relief="solid", bd=1)
+        preview_btn.pack(side="left", padx=5)
+        
         # Main action buttons
         action_frame = tk.Frame(main_frame, bg='#f5f5f5')
         action_frame.pack(fill="x", pady=(20, 0))
@@ -330,6 +299,73 @@ class CleanDataGroupingApp:
                            relief="solid", bd=1)
         back_btn.pack(side="right", padx=15)
     
+    def show_grouping_preview(self):
+        """Preview group counts for the current rules without writing to the workbook"""
+        if self.enzan_kekka_df is None:
+            messagebox.showwarning("Preview", "No 演算結果 data loaded.")
+            return
+        
+        try:
+            preview = preview_grouping(self.enzan_kekka_df, self.rules)
+        except Exception as e:
+            messagebox.showerror("Error", f"Error during preview: {str(e)}")
+            return
+        
+        preview_window = tk.Toplevel(self.main_window)
+        preview_window.title("Grouping Preview")
+        preview_window.geometry("700x560")
+        preview_window.configure(bg='#f5f5f5')
+        preview_window.transient(self.main_window)
+        preview_window.grab_set()
+        
+        frame = tk.Frame(preview_window, bg='#f5f5f5', padx=20, pady=20)
+        frame.pack(fill="both", expand=True)
+        
+        tk.Label(frame, text="Grouping Preview (nothing is written)", 
+                font=("Arial", 14, "bold"), fg="#2c3e50", bg='#f5f5f5').pack(anchor="w", pady=(0, 10))
+        
+        summary_lines = [
+            f"Records: {preview['rows']:,}",
+            f"Groups: {preview['groups']:,}",
+            f"Rows per group: mean {preview['mean_rows']:.1f}, median {preview['median_rows']:g}, max {preview['max_rows']:,}",
+            f"Single-row groups: {preview['single_row_groups']:,}",
+            f"Unmatched (UNKNOWN) rows: {preview['unmatched_rows']:,}"
+        ]
+        for line in summary_lines:
+            tk.Label(frame, text=line, font=("Arial", 11), bg='#f5f5f5').pack(anchor="w")
+        
+        # 種別 / 点検区分1 pairs that still need a rule
+        if preview['unmatched_pairs']:
+            pairs_text = ", ".join(f"{shubetsu or '(blank)'} / {tenken or '(blank)'}" 
+                                   for shubetsu, tenken in preview['unmatched_pairs'][:10])
+            if len(preview['unmatched_pairs']) > 10:
+                pairs_text += f" ... (+{len(preview['unmatched_pairs']) - 10})"
+            tk.Label(frame, text=f"Without a rule: {pairs_text}", font=("Arial", 10), fg="#e74c3c", 
+                    bg='#f5f5f5', wraplength=640, justify="left").pack(anchor="w", pady=(5, 0))
+        
+        # Largest groups
+        groups_frame = tk.LabelFrame(frame, text="Largest Groups", 
+                                    font=("Arial", 12, "bold"), bg='#f5f5f5', fg="#2c3e50",
+                                    relief="solid", bd=1, padx=10, pady=10)
+        groups_frame.pack(fill="both", expand=True, pady=(15, 10))
+        
+        groups_tree = ttk.Treeview(groups_frame, columns=("Grouping Key", "Rows"), show="headings", height=10)
+        groups_tree.heading("Grouping Key", text="Grouping Key")
+        groups_tree.heading("Rows", text="Rows")
+        groups_tree.column("Grouping Key", width=500)
+        groups_tree.column("Rows", width=80, anchor="e")
+        
+        groups_scrollbar = ttk.Scrollbar(groups_frame, orient="vertical", command=groups_tree.yview)
+        groups_tree.configure(yscrollcommand=groups_scrollbar.set)
+        groups_tree.pack(side="left", fill="both", expand=True)
+        groups_scrollbar.pack(side="right", fill="y")
+        
+        for key, rows in preview['largest_groups']:
+            groups_tree.insert("", "end", values=(key, f"{rows:,}"))
+        
+        tk.Button(frame, text="Close", command=preview_window.destroy, bg="#95a5a6", fg="white", 
+                 width=12, font=("Arial", 10), cursor="hand2", relief="solid", bd=1).pack()
+    
     def refresh_rules_display(self):
         """Refresh the rules display in treeview"""
         # Clear existing items
@@ -541,13 +577,11 @@ class CleanDataGroupingApp:
         import threading
         threading.Thread(target=self.process_with_progress, daemon=True).start()
     
-    def find_matching_rule(self, shubetsu, tenken_kubun):
+    def find_matching_rule(self, shubetsu, tenken_kubun, rule_table=None):
         """Find matching rule for given shubetsu and tenken_kubun"""
-        for rule in self.rules:
-            if rule["shubetsu"] == shubetsu:
-                if rule["tenken_kubun"] == "*" or rule["tenken_kubun"] == tenken_kubun:
-                    return rule
-        return None
+        if rule_table is None:
+            rule_table = RuleTable(self.rules)
+        return rule_table.match(shubetsu, tenken_kubun)
     
     def show_processing_dialog(self):
         """Show processing dialog with progress indicator"""
@@ -589,12 +623,13 @@ class CleanDataGroupingApp:
             unique_combinations = self.enzan_kekka_df[['種別', '点検区分1']].drop_duplicates()
             missing_rules = []
             
-            # Check for missing rules
+            # Check for missing rules, against the rules compiled once for this run
+            rule_table = RuleTable(self.rules)
             for _, row in unique_combinations.iterrows():
                 shubetsu = str(row['種別']) if pd.notna(row['種別']) else ""
                 tenken = str(row['点検区分1']) if pd.notna(row['点検区分1']) else ""
                 
-                if not self.find_matching_rule(shubetsu, tenken):
+                if not self.find_matching_rule(shubetsu, tenken, rule_table):
                     missing_rules.append((shubetsu, tenken))
             
             if missing_rules:
@@ -880,104 +915,64 @@ class CleanDataGroupingApp:
             # Create a copy of the data for processing
             df = self.enzan_kekka_df.copy()
             
-            # Generate grouping keys
-            grouping_keys = []
-            grouping_methods = []
+            # Generate grouping keys for all rows at once, one rule lookup per distinct 種別 / 点検区分1 pair
+            grouping_keys, grouping_methods = build_grouping_keys(df, RuleTable(self.rules))
             
-            for _, row in df.iterrows():
-                shubetsu = str(row.get('種別', '')) if pd.notna(row.get('種別')) else ''
-                tenken = str(row.get('点検区分1', '')) if pd.notna(row.get('点検区分1')) else ''
-                
-                # Find matching rule
-                rule = self.find_matching_rule(shubetsu, tenken)
-                
-                if rule:
-                    group_method = rule['group_by']
-                    grouping_methods.append(group_method)
-                    
-                    if group_method == "構造物名称":
-                        # Group by structure name
-                        structure_name = str(row.get('構造物名称', '')) if pd.notna(row.get('構造物名称')) else ''
-                        key = self.create_enhanced_grouping_key(shubetsu, rule['tenken_kubun'], structure_name, None, None, group_method)
-                    else:  # 駅間
-                        # Group by station interval
-                        eki_start = str(row.get('駅（始）', '')) if pd.notna(row.get('駅（始）')) else ''
-                        eki_end = str(row.get('駅（至）', '')) if pd.notna(row.get('駅（至）')) else ''
-                        key = self.create_enhanced_grouping_key(shubetsu, rule['tenken_kubun'], None, eki_start, eki_end, group_method)
-                    
-                    grouping_keys.append(key)
-                else:
-                    # Fallback
-                    grouping_keys.append(f"UNKNOWN|{shubetsu}|{tenken}")
-                    grouping_methods.append("構造物名称")
+            # Keep the keys as categorical codes in first-seen order; grouping below works on the integer codes
+            group_codes, group_key_values = pd.factorize(grouping_keys)
             
             # Add grouping columns to dataframe
-            df['Grouping Key'] = grouping_keys
+            df['Grouping Key'] = pd.Categorical.from_codes(group_codes, categories=group_key_values)
             df['Grouping Method'] = grouping_methods
             
             # Get year columns (result columns)
             year_columns = [col for col in df.columns if col.endswith(' 結果') and any(year in col for year in ['2024', '2023', '2022', '2021', '2020', '2019', '2018'])]
             
-            # Group data and aggregate
-            grouped_data = []
+            # Group data and aggregate in one pass over the rows, groups in first-seen order
+            first_rows = df.iloc[np.unique(group_codes, return_index=True)[1]]
+            group_sizes = np.bincount(group_codes, minlength=len(group_key_values))
+            methods = first_rows['Grouping Method'].tolist()
             
-            for group_key in df['Grouping Key'].unique():
-                group_df = df[df['Grouping Key'] == group_key]
-                
-                # Get basic info from first row
-                first_row = group_df.iloc[0]
-                
-                # Create result row
-                result_row = {
-                    'グループ化キー': group_key,
-                    'グループ化方法': first_row['Grouping Method'],
-                    'データ件数': len(group_df),
-                    '路線名': first_row.get('路線名', ''),
-                    '路線名略称': self.abbreviate_sen_name(first_row.get('路線名', '')),
-                    '構造物番号': '',
-                    '種別': first_row.get('種別', ''),
-                    '構造物名称': first_row.get('構造物名称', '') if first_row['Grouping Method'] == "構造物名称" else '',
-                    '駅（始）': first_row.get('駅（始）', '') if first_row['Grouping Method'] == "駅間" else '',
-                    '駅（至）': first_row.get('駅（至）', '') if first_row['Grouping Method'] == "駅間" else '',
-                    '点検区分1': first_row.get('点検区分1', '')
-                }
-                
-                # Add 構造物番号 lookup if structure_df is available
-                if self.structure_df is not None:
-                    rosen_name = result_row['路線名']
-                    kozo_name = result_row['構造物名称']
-                    
-                    # Create ekikan for lookup
-                    ekikan = ''
-                    if result_row['駅（始）'] and result_row['駅（至）']:
-                        ekikan = f"{result_row['駅（始）']}→{result_row['駅（至）']}"
-                    
-                    # Lookup structure number
-                    bangou = self.lookup_structure_number(self.structure_df, rosen_name, kozo_name, ekikan)
-                    result_row['構造物番号'] = bangou
-                
-                # Aggregate year results
-                for year_col in year_columns:
-                    # Sum non-empty values
-                    values = group_df[year_col].dropna()
-                    values = values[values != '']
-                    
-                    if len(values) > 0:
-                        try:
-                            numeric_values = pd.to_numeric(values, errors='coerce').dropna()
-                            if len(numeric_values) > 0:
-                                result_row[year_col] = numeric_values.sum()
-                            else:
-                                result_row[year_col] = ''
-                        except:
-                            result_row[year_col] = ''
-                    else:
-                        result_row[year_col] = ''
-                
-                grouped_data.append(result_row)
+            def first_values(column):
+                """Values of column in the first row of each group, '' when the column is missing"""
+                if column in first_rows.columns:
+                    return first_rows[column].tolist()
+                return [''] * len(first_rows)
+            
+            # Basic info from the first row of each group
+            rosen_names = first_values('路線名')
+            structure_names = [name if method == "構造物名称" else '' for name, method in zip(first_values('構造物名称'), methods)]
+            eki_starts = [eki if method == "駅間" else '' for eki, method in zip(first_values('駅（始）'), methods)]
+            eki_ends = [eki if method == "駅間" else '' for eki, method in zip(first_values('駅（至）'), methods)]
             
-            # Create grouped dataframe
-            grouped_df = pd.DataFrame(grouped_data)
+            # Add 構造物番号 lookup if structure_df is available
+            structure_numbers = [''] * len(first_rows)
+            if self.structure_df is not None:
+                structure_numbers = []
+                for rosen_name, kozo_name, eki_start, eki_end in zip(rosen_names, structure_names, eki_starts, eki_ends):
+                    ekikan = f"{eki_start}→{eki_end}" if eki_start and eki_end else ''
+                    structure_numbers.append(self.lookup_structure_number(self.structure_df, rosen_name, kozo_name, ekikan))
+            
+            grouped_df = pd.DataFrame({
+                'グループ化キー': list(group_key_values),
+                'グループ化方法': methods,
+                'データ件数': group_sizes.tolist(),
+                '路線名': rosen_names,
+                '路線名略称': [self.abbreviate_sen_name(name) for name in rosen_names],
+                '構造物番号': structure_numbers,
+                '種別': first_values('種別'),
+                '構造物名称': structure_names,
+                '駅（始）': eki_starts,
+                '駅（至）': eki_ends,
+                '点検区分1': first_values('点検区分1')
+            })
+            
+            # Aggregate year results: convert once, sum each group, '' where a group has no numeric value
+            if year_columns:
+                numeric_years = df[year_columns].apply(pd.to_numeric, errors='coerce')
+                year_sums = numeric_years.groupby(group_codes).sum(min_count=1)
+                for year_col in year_columns:
+                    grouped_df[year_col] = [total if pd.notna(total) else '' for total in year_sums[year_col].tolist()]
             
             # Sort by grouping key
             grouped_df = grouped_df.sort_values('グループ化キー')
@@ -1018,22 +1013,8 @@ class CleanDataGroupingApp:
             grouped_df[latest_year_col] = pd.to_numeric(grouped_df[latest_year_col], errors='coerce').fillna(0)
             grouped_df = grouped_df.sort_values(latest_year_col, ascending=False)
         
-        # Save to Excel
-        with pd.ExcelWriter(self.workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            grouped_df.to_excel(writer, sheet_name='グループ化点検履歴', index=False)
-            
-            # Preserve other sheets
-            try:
-                original_wb = load_workbook(self.workbook_path)
-                for sheet_name in original_wb.sheetnames:
-                    if sheet_name != 'グループ化点検履歴':
-                        try:
-                            df_temp = pd.read_excel(self.workbook_path, sheet_name=sheet_name)
-                            df_temp.to_excel(writer, sheet_name=sheet_name, index=False)
-                        except Exception as e:
-                            continue
-            except Exception as e:
-                pass
+        # Save to Excel, replacing only this sheet
+        replace_sheets(self.workbook_path, {'グループ化点検履歴': grouped_df})
 
     def auto_complete(self):
         """Auto-complete and close the application"""
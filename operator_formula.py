@@ -0,0 +1,203 @@
+import ast
+import weakref
+import numpy as np
+
+# Arithmetic the 演算子 formulas may use; everything else is rejected at compile time
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {
+    ast.UAdd: np.positive,
+    ast.USub: np.negative,
+}
+FUNCTIONS = {
+    'abs': np.abs,
+    'min': lambda *args: np.minimum.reduce(args),
+    'max': lambda *args: np.maximum.reduce(args),
+}
+
+
+class CompiledFormula:
+    """An 演算子 formula parsed once into a whitelisted expression tree.
+
+    evaluate() runs the tree on whole weight arrays and reports the rows
+    where eval of the substituted text would have failed (division by zero,
+    power overflow or complex powers, and nan/inf weights, which substitute
+    to undefined names) so callers can apply their own fallback value.
+    """
+
+    def __init__(self, text, tree, variables):
+        self.text = text
+        self.tree = tree
+        self.variables = list(variables)
+        self.names = sorted({node.id for node in ast.walk(tree)
+                             if isinstance(node, ast.Name) and node.id in self.variables})
+
+    def evaluate(self, columns, length=None):
+        """Evaluate on {variable: float array}; returns (values, failed mask)"""
+        if length is None:
+            length = len(next(iter(columns.values()))) if columns else 1
+        with np.errstate(all='ignore'):
+            values, failed = self.evaluate_node(self.tree.body, columns, length)
+        return values, failed | ~self.finite_inputs(columns, length)
+
+    def finite_inputs(self, columns, length):
+        """Rows where every variable used by the formula is finite"""
+        finite = np.ones(length, dtype=bool)
+        for name in self.names:
+            finite &= np.isfinite(columns[name])
+        return finite
+
+    def evaluate_node(self, node, columns, length):
+        if isinstance(node, ast.Constant):
+            return np.full(length, float(node.value)), np.zeros(length, dtype=bool)
+
+        if isinstance(node, ast.Name):
+            return np.asarray(columns[node.id], dtype=float), np.zeros(length, dtype=bool)
+
+        if isinstance(node, ast.UnaryOp):
+            operand, failed = self.evaluate_node(node.operand, columns, length)
+            return UNARY_OPERATORS[type(node.op)](operand), failed
+
+        if isinstance(node, ast.BinOp):
+            left, left_failed = self.evaluate_node(node.left, columns, length)
+            right, right_failed = self.evaluate_node(node.right, columns, length)
+            failed = left_failed | right_failed
+
+            if isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+                failed = failed | (right == 0)
+
+            values = BINARY_OPERATORS[type(node.op)](left, right)
+            if isinstance(node.op, ast.Pow):
+                failed = (failed | ((left == 0) & (right < 0)) | ((left < 0) & (right != np.floor(right))) |
+                          (~np.isfinite(values) & np.isfinite(left) & np.isfinite(right)))
+
+            return values, failed
+
+        # Whitelisted function call
+        arguments = [self.evaluate_node(argument, columns, length) for argument in node.args]
+        failed = np.zeros(length, dtype=bool)
+        for _, argument_failed in arguments:
+            failed = failed | argument_failed
+        return FUNCTIONS[node.func.id](*[values for values, _ in arguments]), failed
+
+
+def is_allowed_node(node, variables):
+    """Check one node of a parsed formula against the whitelist"""
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+    if isinstance(node, ast.Name):
+        return node.id in variables
+    if isinstance(node, ast.UnaryOp):
+        return type(node.op) in UNARY_OPERATORS and is_allowed_node(node.operand, variables)
+    if isinstance(node, ast.BinOp):
+        return (type(node.op) in BINARY_OPERATORS and
+                is_allowed_node(node.left, variables) and is_allowed_node(node.right, variables))
+    if isinstance(node, ast.Call):
+        return (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and
+                not node.keywords and len(node.args) > 0 and
+                (node.func.id != 'abs' or len(node.args) == 1) and
+                (node.func.id == 'abs' or len(node.args) > 1) and
+                all(is_allowed_node(argument, variables) for argument in node.args))
+    return False
+
+
+def compile_formula(text, variables):
+    """Parse an 演算子 formula over the given variable names.
+
+    Returns a CompiledFormula, or None when the text is not plain arithmetic
+    over those variables (the cases where eval used to fail).
+    """
+    try:
+        tree = ast.parse(str(text).strip(), mode='eval')
+    except (SyntaxError, ValueError):
+        return None
+
+    if not is_allowed_node(tree.body, set(variables)):
+        return None
+
+    return CompiledFormula(text, tree, variables)
+
+
+def find_operator_formula(operator_df):
+    """Return the 演算子‐2 formula text, or None when the sheet has none.
+
+    The formula is the first cell of the sheet's first row that mentions A1,
+    B1 or C1 and contains an arithmetic operator.
+    """
+    if len(operator_df) == 0:
+        return None
+
+    formula_row = operator_df.iloc[0]
+    for col in operator_df.columns:
+        cell_value = str(formula_row[col]).strip()
+        if any(var in cell_value for var in ['A1', 'B1', 'C1']) and any(op in cell_value for op in ['*', '+', '-', '/']):
+            return cell_value
+
+    return None
+
+
+class OperatorWeights:
+    """The 演算子‐2 total weight rule, located and compiled once per operator sheet.
+
+    Without a formula the total weight is A1*B1*C1. A formula that cannot be
+    compiled, or that fails for a row, gives 1.0 like the old eval fallback.
+    Results are memoized per distinct (A1, B1, C1) triple.
+    """
+
+    def __init__(self, operator_df):
+        self.source = weakref.ref(operator_df)
+        self.formula = find_operator_formula(operator_df)
+        self.compiled = compile_formula(self.formula, ['A1', 'B1', 'C1']) if self.formula else None
+        self.total_weights_by_triple = {}
+
+    def evaluate(self, a1, b1, c1):
+        """Evaluate the rule on float arrays of A1, B1 and C1"""
+        if self.formula is None:
+            return a1 * b1 * c1
+        if self.compiled is None:
+            return np.ones(len(a1))
+
+        values, failed = self.compiled.evaluate({'A1': a1, 'B1': b1, 'C1': c1}, len(a1))
+        return np.where(failed, 1.0, values)
+
+    def total_weights(self, a1, b1, c1):
+        """Total weight for every row, evaluating only triples not seen before"""
+        # NaN never equals itself, so key it as None to keep the memo hits
+        columns = [[None if value != value else value for value in np.asarray(weights, dtype=float).tolist()]
+                   for weights in (a1, b1, c1)]
+        triples = list(zip(*columns))
+
+        new_triples = list(dict.fromkeys(triple for triple in triples
+                                         if triple not in self.total_weights_by_triple))
+        if new_triples:
+            columns = np.array(new_triples, dtype=float).reshape(-1, 3)
+            values = self.evaluate(columns[:, 0], columns[:, 1], columns[:, 2])
+            self.total_weights_by_triple.update(zip(new_triples, values.tolist()))
+
+        return np.array([self.total_weights_by_triple[triple] for triple in triples], dtype=float)
+
+
+# One compiled rule per operator DataFrame
+_operator_weights_cache = {}
+
+
+def get_operator_weights(operator_df):
+    """Return the cached OperatorWeights for operator_df, compiling it on first use"""
+    key = id(operator_df)
+    operator_weights = _operator_weights_cache.get(key)
+
+    if operator_weights is None or operator_weights.source() is not operator_df:
+        for stale_key in [k for k, v in _operator_weights_cache.items() if v.source() is None]:
+            del _operator_weights_cache[stale_key]
+
+        operator_weights = OperatorWeights(operator_df)
+        _operator_weights_cache[key] = operator_weights
+
+    return operator_weights
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+from sheet_writer import MAIN_NS, REL_NS, part_path
+
+# Bump when the stored format changes so old entries are never read back
+CACHE_FORMAT = 2
+
+# Parts every sheet's parsed values depend on besides its own XML
+SHARED_PARTS = ('xl/sharedStrings.xml', 'xl/styles.xml')
+HASH_CHUNK_SIZE = 1 << 20
+# Python values an object column may hold and still be stored as JSON
+JSON_SCALARS = (str, bool, int, float, type(None))
+
+
+def cache_directory(workbook_path):
+    """Sidecar folder for a workbook: 点検.xlsx -> 点検_sheet_cache next to it"""
+    folder, name = os.path.split(os.path.abspath(workbook_path))
+    return os.path.join(folder, os.path.splitext(name)[0] + '_sheet_cache')
+
+
+def plain_value(value):
+    """value as a plain Python scalar, or raise TypeError when JSON cannot hold it"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if not isinstance(value, JSON_SCALARS):
+        raise TypeError(f'{type(value).__name__} cannot be cached')
+    return value
+
+
+def encode_frame(df):
+    """Split df into plain arrays for np.savez, or None when it holds values that need pickling.
+
+    Numeric, boolean and datetime columns are stored as they are, text
+    columns as a unicode array with a mask of the blanks, and object columns
+    as a JSON list. A JSON header records the row count, the column labels
+    and each column's dtype so decode_frame can rebuild the same frame.
+    """
+    index = df.index
+    if not isinstance(index, pd.RangeIndex) or index.start != 0 or index.step != 1:
+        return None
+
+    try:
+        labels = [plain_value(label) for label in df.columns]
+        arrays = {}
+        columns = []
+        for position in range(df.shape[1]):
+            values = df.iloc[:, position]
+            dtype = values.dtype
+            if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+                kind = 'array'
+                arrays[f'c{position}'] = values.to_numpy()
+            elif isinstance(dtype, pd.StringDtype):
+                kind = 'string'
+                blank = values.isna().to_numpy()
+                arrays[f'c{position}'] = np.array(values.fillna('').tolist(), dtype=str)
+                arrays[f'm{position}'] = blank
+            elif dtype == object:
+                kind = 'json'
+                text = json.dumps([plain_value(value) for value in values.tolist()], ensure_ascii=False)
+                arrays[f'c{position}'] = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+            else:
+                return None
+            columns.append({'kind': kind, 'dtype': str(dtype)})
+    except TypeError:
+        return None
+
+    header = {'format': CACHE_FORMAT, 'rows': len(df), 'labels': labels,
+              'labels_dtype': str(df.columns.dtype), 'columns': columns}
+    arrays['header'] = np.frombuffer(json.dumps(header, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+    return arrays
+
+
+def decode_frame(arrays):
+    """Rebuild the frame encode_frame split up; raises ValueError when the entry does not add up"""
+    header = json.loads(arrays['header'].tobytes().decode('utf-8'))
+    if header['format'] != CACHE_FORMAT or len(header['labels']) != len(header['columns']):
+        raise ValueError('cache entry has an unexpected layout')
+
+    rows = header['rows']
+    data = {}
+    for position, column in enumerate(header['columns']):
+        stored = arrays[f'c{position}']
+        if column['kind'] == 'array':
+            if str(stored.dtype) != column['dtype']:
+                raise ValueError('cache entry has an unexpected dtype')
+            values = stored
+        elif column['kind'] == 'string':
+            values = stored.astype(object)
+            values[arrays[f'm{position}']] = np.nan
+            values = pd.array(values, dtype=pd.api.types.pandas_dtype(column['dtype']))
+        elif column['kind'] == 'json':
+            items = json.loads(stored.tobytes().decode('utf-8'))
+            values = np.empty(len(items), dtype=object)
+            values[:] = items
+        else:
+            raise ValueError('cache entry has an unknown column kind')
+        if len(values) != rows:
+            raise ValueError('cache entry has columns of different lengths')
+        data[position] = values
+
+    df = pd.DataFrame(data, index=pd.RangeIndex(rows))
+    df.columns = pd.Index(header['labels'], dtype=header['labels_dtype'])
+    return df
+
+
+class SheetCache:
+    """Parsed sheets of one workbook, stored next to it and keyed by content.
+
+    Each entry is the DataFrame read_excel returned for a sheet, or for a
+    column projection of it, saved as plain arrays in an .npz file under a
+    key hashed from that sheet's worksheet XML, the shared strings and styles
+    it refers to, the header setting and the pandas version. Entries hold
+    data only and are loaded without unpickling, so a file dropped into the
+    folder cannot run code. A sheet whose XML has not changed since the last
+    run is loaded from its entry instead of being parsed again; any change
+    to it gives a new key, so a stale entry is never returned. The cache is
+    only an accelerator: when the package cannot be inspected, a frame holds
+    values that cannot be stored as plain data or the folder cannot be
+    written, reads fall back to parsing the workbook.
+    """
+
+    def __init__(self, workbook_path, source=None):
+        self.workbook_path = workbook_path
+        self.source = source
+        self.directory = cache_directory(workbook_path)
+        self.parts = None
+        self.shared_digest = None
+        self.content_digests = {}
+
+    def open_package(self):
+        """Open the .xlsx package, from source when the caller already read it"""
+        if self.source is not None:
+            self.source.seek(0)
+            return zipfile.ZipFile(self.source)
+        return zipfile.ZipFile(self.workbook_path)
+
+    def load_package_index(self):
+        """Map sheet names to worksheet parts and hash the parts they share; False when not an .xlsx"""
+        if self.parts is not None:
+            return bool(self.parts)
+
+        self.parts = {}
+        try:
+            with self.open_package() as package:
+                workbook = ET.fromstring(package.read('xl/workbook.xml'))
+                relationships = ET.fromstring(package.read('xl/_rels/workbook.xml.rels'))
+                targets = {relationship.get('Id'): part_path(relationship.get('Target'))
+                           for relationship in relationships}
+
+                shared = hashlib.sha1(f'{CACHE_FORMAT}|{pd.__version__}'.encode('utf-8'))
+                properties = workbook.find(f'{{{MAIN_NS}}}workbookPr')
+                if properties is not None:
+                    shared.update(str(properties.get('date1904')).encode('utf-8'))
+                names = set(package.namelist())
+                for part in SHARED_PARTS:
+                    if part in names:
+                        with package.open(part) as f:
+                            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                                shared.update(chunk)
+                self.shared_digest = shared.hexdigest()
+
+                parts = {}
+                for sheet in workbook.iter(f'{{{MAIN_NS}}}sheet'):
+                    target = targets.get(sheet.get(f'{{{REL_NS}}}id'))
+                    if target in names:
+                        parts[sheet.get('name')] = target
+                self.parts = parts
+        except (OSError, KeyError, zipfile.BadZipFile, ET.ParseError):
+            self.parts = {}
+        return bool(self.parts)
+
+    def sheet_names(self):
+        """Sheet names in workbook order, or None when the package could not be read"""
+        if not self.load_package_index():
+            return None
+        return list(self.parts)
+
+    def content_digest(self, sheet_name):
+        """Hash of the sheet's worksheet XML and the shared parts, or None when it has no part"""
+        if not self.load_package_index() or sheet_name not in self.parts:
+            return None
+
+        if sheet_name not in self.content_digests:
+            digest = hashlib.sha1(f'{self.shared_digest}|'.encode('utf-8'))
+            try:
+                # Hash in chunks; a large year sheet's XML need not be held in memory
+                with self.open_package() as package, package.open(self.parts[sheet_name]) as part:
+                    for chunk in iter(lambda: part.read(HASH_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+            except (OSError, KeyError, zipfile.BadZipFile):
+                return None
+            self.content_digests[sheet_name] = digest.hexdigest()
+        return self.content_digests[sheet_name]
+
+    def entry_path(self, sheet_name, header, columns=None):
+        """Cache file for the sheet's current contents, or None when it has no worksheet part"""
+        content_digest = self.content_digest(sheet_name)
+        if content_digest is None:
+            return None
+        return os.path.join(self.directory, f'{self.entry_prefix(sheet_name, header, columns)}{content_digest}.npz')
+
+    def entry_prefix(self, sheet_name, header, columns=None):
+        """File name prefix shared by every cached version of one sheet read one way"""
+        name_digest = hashlib.sha1(sheet_name.encode('utf-8')).hexdigest()[:16]
+        if columns is None:
+            return f'{name_digest}_h{header}_all_'
+        # A column projection is its own entry, independent of the order columns were asked in
+        projection = hashlib.sha1('\x1f'.join(sorted(repr(column) for column in columns)).encode('utf-8'))
+        return f'{name_digest}_h{header}_c{projection.hexdigest()[:12]}_'
+
+    def load(self, path):
+        """Return the cached frame at path, or None on a miss; a damaged entry is removed"""
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                return decode_frame(arrays)
+        except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile):
+            # Truncated, foreign or tampered with: drop it so the sheet is parsed and stored again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def store(self, path, sheet_name, header, df, columns=None):
+        """Write df to path unless it needs pickling, and remove the sheet's entries for older contents"""
+        if path is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            prefix = self.entry_prefix(sheet_name, header, columns)
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix) and os.path.join(self.directory, name) != path:
+                    os.remove(os.path.join(self.directory, name))
+
+            arrays = encode_frame(df)
+            if arrays is None:
+                return
+
+            handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    np.savez(f, **arrays)
+                # mkstemp creates the file owner-only; give entries the workbook's permissions
+                shutil.copymode(self.workbook_path, temp_path)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        except OSError:
+            # Caching is best effort; the frame was parsed and is returned either way
+            pass
+
+    def read(self, sheet_name, parse, header=0, columns=None):
+        """Return the sheet from the cache, or parse() it and cache the result"""
+        path = self.entry_path(sheet_name, header, columns)
+        df = self.load(path)
+        if df is not None:
+            return df
+
+        df = parse()
+        self.store(path, sheet_name, header, df, columns)
+        return df
@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+from sheet_cache import SheetCache
+
+
+def convert_cell(cell):
+    """Convert an openpyxl cell the way read_excel does before type inference"""
+    if cell.value is None:
+        return ''
+    if cell.data_type == 'e':
+        return np.nan
+    if cell.data_type == 'n':
+        value = int(cell.value)
+        if value == cell.value:
+            return value
+        return float(cell.value)
+    return cell.value
+
+
+def header_names(header_cells):
+    """Column names read_excel gives a header row: 'Unnamed: n' for blanks, 'a.1' for repeats"""
+    row = [convert_cell(cell) for cell in header_cells]
+    while row and row[-1] == '':
+        row.pop()
+    if not row:
+        return []
+    return list(TextParser([row], header=0, skip_blank_lines=False).read().columns)
+
+
+class SheetReader:
+    """A workbook package opened once, from which several sheets are parsed.
+
+    Opening the .xlsx inflates the package and reads the workbook part; doing
+    that once instead of once per read_excel call is most of the saving when
+    a step reads many sheets. Sheets whose contents have not changed since
+    they were last parsed come from the sidecar SheetCache, and the package
+    is only opened for parsing when some sheet misses. read() can also
+    project the sheet down to the columns the caller keeps.
+    """
+
+    def __init__(self, workbook_path):
+        self.workbook_path = workbook_path
+        self.cache = SheetCache(workbook_path)
+        self.excel_file = None
+        self.stream_workbook = None
+
+    def open_excel_file(self):
+        if self.excel_file is None:
+            self.excel_file = pd.ExcelFile(self.workbook_path)
+        return self.excel_file
+
+    def open_stream_workbook(self):
+        if self.stream_workbook is None:
+            self.stream_workbook = load_workbook(self.workbook_path, read_only=True, data_only=True, keep_links=False)
+        return self.stream_workbook
+
+    @property
+    def sheet_names(self):
+        names = self.cache.sheet_names()
+        if names is None:
+            names = self.open_excel_file().sheet_names
+        return list(names)
+
+    def read(self, sheet_name, columns=None, header=0):
+        """Parse one sheet like read_excel; with columns, keep only those that exist"""
+        if columns is None:
+            return self.cache.read(sheet_name, lambda: self.open_excel_file().parse(sheet_name, header=header), header)
+
+        wanted = set(columns)
+        df = self.cache.load(self.cache.entry_path(sheet_name, header))
+        if df is None and header == 0:
+            # Nothing cached for the whole sheet: stream just the projection
+            return self.cache.read(sheet_name, lambda: self.stream_columns(sheet_name, wanted), header, wanted)
+        if df is None:
+            df = self.read(sheet_name, header=header)
+        return df[[column for column in df.columns if column in wanted]]
+
+    def stream_columns(self, sheet_name, wanted):
+        """Read only the wanted columns of a sheet with a header row, row by row.
+
+        The sheet is walked with openpyxl's read-only iterator and every row
+        is cut down to the wanted positions as it is read, so memory grows
+        with the projected width rather than the full sheet. Cells are
+        converted and typed exactly like read_excel(usecols=...) would.
+        """
+        workbook = self.open_stream_workbook()
+        if sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        sheet = workbook[sheet_name]
+        sheet.reset_dimensions()
+
+        rows = sheet.iter_rows()
+        header_cells = next(rows, ())
+        names = header_names(header_cells)
+        positions = [position for position, name in enumerate(names) if name in wanted]
+        if not positions:
+            return pd.DataFrame()
+
+        data = [[names[position] for position in positions]]
+        last_row_with_data = 0
+        for cells in rows:
+            data.append([convert_cell(cells[position]) if position < len(cells) else '' for position in positions])
+            # read_excel keeps blank rows up to the last row holding any value, in any column
+            if any(cell.value is not None and cell.value != '' for cell in cells):
+                last_row_with_data = len(data) - 1
+        del data[last_row_with_data + 1:]
+
+        return TextParser(data, header=0, skip_blank_lines=False).read()
+
+    def close(self):
+        if self.excel_file is not None:
+            self.excel_file.close()
+            self.excel_file = None
+        if self.stream_workbook is not None:
+            self.stream_workbook.close()
+            self.stream_workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_sheet(workbook_path, sheet_name, header=0):
+    """read_excel for a single sheet, served from the sidecar cache when unchanged"""
+    with SheetReader(workbook_path) as reader:
+        return reader.read(sheet_name, header=header)
+
+
+def combine_year_extracts(frames, key='調査番号'):
+    """Outer-join per-year extracts on key with one index-aligned concat.
+
+    Gives the rows chained pd.merge(how='outer') on key gives when every
+    frame has unique, non-blank keys and no column name repeats: one row per
+    key, sorted by key, the key column first and then each frame's columns
+    in order. Returns None otherwise, so the caller can keep its merge,
+    whose many-to-many rows an index join cannot reproduce.
+
+    Zero-row frames are handled like the chain handles them: those before
+    the first frame with rows are dropped, since the chain replaced its empty
+    result with the next frame, and later ones only add their columns.
+    """
+    if not frames:
+        return pd.DataFrame()
+
+    first = next((position for position, df in enumerate(frames) if len(df)), len(frames) - 1)
+    frames = frames[first:]
+    key_dtype = frames[0][key].dtype
+
+    columns = [column for df in frames for column in df.columns if column != key]
+    if len(set(columns)) != len(columns):
+        return None
+
+    indexed = []
+    for df in frames:
+        keys = df[key]
+        if keys.isna().any() or keys.duplicated().any():
+            return None
+        df = df.set_index(key)
+        if not len(df):
+            # An empty index has no dtype of its own and would turn the joined keys into floats
+            df.index = df.index.astype(key_dtype)
+        indexed.append(df)
+
+    combined = pd.concat(indexed, axis=1, join='outer', sort=False)
+    try:
+        # merge sorts an outer join's keys
+        combined = combined.sort_index()
+    except TypeError:
+        pass
+    combined.index.name = key
+    return combined.reset_index()
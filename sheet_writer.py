@@ -0,0 +1,390 @@
+import datetime
+import math
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+import numpy as np
+import pandas as pd
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, to_excel as excel_serial
+from pandas.api.types import is_datetime64_any_dtype, is_float_dtype, is_timedelta64_dtype
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+WORKSHEET_TYPE = REL_NS + '/worksheet'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+
+# Characters XML 1.0 cannot carry; openpyxl refuses them as well
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+DATE_TYPES = (datetime.date, np.datetime64)
+TIME_TYPES = (datetime.time, datetime.timedelta, np.timedelta64)
+
+# The number formats to_excel gives datetimes and dates
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+DATE_FORMAT = 'YYYY-MM-DD'
+
+
+class DateStyles:
+    """Cell format indexes for date cells and the epoch their serial numbers count from"""
+
+    def __init__(self, datetime_style, date_style, epoch):
+        self.datetime_style = datetime_style
+        self.date_style = date_style
+        self.epoch = epoch
+
+
+def column_letter(number):
+    """1 -> 'A', 27 -> 'AA'"""
+    letters = ''
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def cell_xml(ref, value, date_styles=None):
+    """Render one cell with an inline string, or '' for an empty cell"""
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if value is None or value is pd.NA or value is pd.NaT:
+        return ''
+    if isinstance(value, datetime.date) and date_styles is not None:
+        style = date_styles.datetime_style if isinstance(value, datetime.datetime) else date_styles.date_style
+        return f'<c r="{ref}" s="{style}"><v>{excel_serial(value, date_styles.epoch)!r}</v></c>'
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value):
+            return ''
+        if math.isinf(value):
+            # to_excel writes infinities as text
+            value = 'inf' if value > 0 else '-inf'
+        else:
+            return f'<c r="{ref}"><v>{repr(float(value))}</v></c>'
+
+    text = ILLEGAL_XML_CHARS.sub('', str(value))
+    if text == '':
+        return ''
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c r="{ref}" t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'
+
+
+def column_cells(letter, column, date_styles=None):
+    """Render the data cells of one column, starting at row 2"""
+    values = column.tolist()
+    if is_float_dtype(column):
+        # Plain numbers are the bulk of the result sheets; only NaN and inf need cell_xml
+        return [f'<c r="{letter}{row_number}"><v>{value!r}</v></c>' if math.isfinite(value)
+                else cell_xml(f'{letter}{row_number}', value)
+                for row_number, value in enumerate(values, 2)]
+    return [cell_xml(f'{letter}{row_number}', value, date_styles) for row_number, value in enumerate(values, 2)]
+
+
+def sheet_xml(df, date_styles=None):
+    """Render df like to_excel(index=False) as a worksheet part"""
+    letters = [column_letter(number) for number in range(1, len(df.columns) + 1)]
+    header = ''.join(cell_xml(f'{letter}1', column, date_styles) for letter, column in zip(letters, df.columns))
+    rows = [f'<row r="1">{header}</row>']
+
+    # Render column by column, then stitch the rows together
+    cells = [column_cells(letter, df.iloc[:, position], date_styles) for position, letter in enumerate(letters)]
+    for row_number, row_cells in enumerate(zip(*cells), 2):
+        rows.append(f'<row r="{row_number}">{"".join(row_cells)}</row>')
+
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<worksheet xmlns="{MAIN_NS}"><sheetData>{"".join(rows)}</sheetData></worksheet>').encode('utf-8')
+
+
+def has_values_of_type(df, types):
+    """True when a cell or column name of df is an instance of types"""
+    for position in range(len(df.columns)):
+        column = df.iloc[:, position]
+        if column.dtype == object and any(isinstance(value, types) for value in column.tolist()):
+            return True
+    return any(isinstance(value, types) for value in df.columns)
+
+
+def has_date_values(df):
+    """True when df holds dates, which need a number format from styles.xml"""
+    if any(is_datetime64_any_dtype(df.iloc[:, position]) for position in range(len(df.columns))):
+        return True
+    return has_values_of_type(df, DATE_TYPES)
+
+
+def needs_writer(df):
+    """True for values only openpyxl writes like to_excel: times, durations and zoned datetimes"""
+    for position in range(len(df.columns)):
+        column = df.iloc[:, position]
+        if is_timedelta64_dtype(column) or getattr(column.dtype, 'tz', None) is not None:
+            return True
+        if column.dtype == object and any(isinstance(value, datetime.datetime) and value.tzinfo is not None
+                                          for value in column.tolist()):
+            return True
+    return has_values_of_type(df, TIME_TYPES)
+
+
+def add_number_format(styles_xml, format_code):
+    """Return styles_xml with a cell format for format_code and that format's cellXfs index.
+
+    An existing format added by an earlier write is reused, so repeated
+    saves do not grow styles.xml.
+    """
+    match = re.search(r'<numFmt\s[^>]*numFmtId="(\d+)"[^>]*formatCode="' + re.escape(format_code) + '"', styles_xml)
+    if match:
+        number_format_id = int(match.group(1))
+    else:
+        ids = [int(value) for value in re.findall(r'<numFmt\s[^>]*numFmtId="(\d+)"', styles_xml)]
+        # Ids below 164 are Excel's built-in formats
+        number_format_id = max(ids + [163]) + 1
+        number_format = f'<numFmt numFmtId="{number_format_id}" formatCode="{format_code}"/>'
+        if re.search(r'<numFmts\b[^>]*/>', styles_xml):
+            styles_xml = re.sub(r'<numFmts\b[^>]*/>', f'<numFmts count="1">{number_format}</numFmts>', styles_xml, count=1)
+        elif '</numFmts>' in styles_xml:
+            count = len(ids) + 1
+            styles_xml = styles_xml.replace('</numFmts>', number_format + '</numFmts>', 1)
+            styles_xml = re.sub(r'<numFmts\b[^>]*>', f'<numFmts count="{count}">', styles_xml, count=1)
+        else:
+            # numFmts must be the first child of styleSheet
+            styles_xml = re.sub(r'(<styleSheet\b[^>]*>)', lambda start: start.group(1) + f'<numFmts count="1">{number_format}</numFmts>',
+                                styles_xml, count=1)
+
+    cell_formats = re.search(r'(<cellXfs\b[^>]*>)(.*?)</cellXfs>', styles_xml, re.S)
+    cell_format = f'<xf numFmtId="{number_format_id}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    formats = re.findall(r'<xf\b[^>]*?/?>', cell_formats.group(2))
+    if cell_format in formats:
+        return styles_xml, formats.index(cell_format)
+
+    body = cell_formats.group(2) + cell_format
+    styles_xml = (styles_xml[:cell_formats.start()] + f'<cellXfs count="{len(formats) + 1}">' + body + '</cellXfs>'
+                  + styles_xml[cell_formats.end():])
+    return styles_xml, len(formats)
+
+
+def part_path(target):
+    """Resolve a workbook relationship target to its zip entry name"""
+    if target.startswith('/'):
+        return target[1:]
+    return 'xl/' + target
+
+
+def rels_path(part):
+    """xl/worksheets/sheet1.xml -> xl/worksheets/_rels/sheet1.xml.rels"""
+    folder, name = part.rsplit('/', 1)
+    return f'{folder}/_rels/{name}.rels'
+
+
+def attribute(tag, name):
+    """Value of an attribute in a single XML start tag, or None"""
+    match = re.search(r'\s' + re.escape(name) + r'="([^"]*)"', tag)
+    return match.group(1) if match else None
+
+
+def relationship_targets(entries, rels):
+    """Zip entry names the internal relationships in the rels part point at"""
+    if rels not in entries:
+        return set()
+    folder = posixpath.dirname(posixpath.dirname(rels))
+    targets = set()
+    for tag in re.findall(r'<(?:\w+:)?Relationship\s[^>]*>', entries[rels].decode('utf-8')):
+        target = attribute(tag, 'Target')
+        if target is None or attribute(tag, 'TargetMode') == 'External':
+            continue
+        target = unquote(target.replace('&amp;', '&'))
+        if target.startswith('/'):
+            targets.add(target[1:])
+        else:
+            targets.add(posixpath.normpath(posixpath.join(folder, target)))
+    return targets
+
+
+def orphaned_parts(entries, dropped_rels):
+    """Parts that only the dropped rels parts lead to, directly or through other parts' rels.
+
+    A replaced sheet's drawings, tables, comments and VML, and the charts and
+    images those point at in turn, are orphans unless a relationship that is
+    kept still refers to them. Returns the orphaned parts together with their
+    own rels parts.
+    """
+    orphans = set()
+    pending = [target for rels in dropped_rels for target in relationship_targets(entries, rels)]
+    while pending:
+        part = pending.pop()
+        if part in entries and part not in orphans:
+            orphans.add(part)
+            pending.extend(relationship_targets(entries, rels_path(part)))
+
+    # Keep whatever a surviving relationship still points at, and what that part points at in turn
+    while True:
+        dropped = set(dropped_rels) | {rels_path(part) for part in orphans}
+        kept = {target for rels in entries if rels.endswith('.rels') and rels not in dropped
+                for target in relationship_targets(entries, rels)} & orphans
+        if not kept:
+            break
+        orphans -= kept
+    return orphans | {rels_path(part) for part in orphans if rels_path(part) in entries}
+
+
+def move_sheets_to_front(workbook_xml, names):
+    """Reorder the <sheet> entries so names come first, keeping sheet positions in step"""
+    sheets = re.search(r'(<(?:\w+:)?sheets\b[^>]*>)(.*?)(</(?:\w+:)?sheets>)', workbook_xml, re.S)
+    tags = re.findall(r'<(?:\w+:)?sheet\s[^>]*?/>', sheets.group(2))
+    order = [attribute(tag, 'name') for tag in tags]
+    moved = [order.index(name) for name in names if name in order]
+    new_order = moved + [position for position in range(len(tags)) if position not in moved]
+    new_position = {old: new for new, old in enumerate(new_order)}
+
+    workbook_xml = workbook_xml[:sheets.start(2)] + ''.join(tags[old] for old in new_order) + workbook_xml[sheets.end(2):]
+    # Sheet-scoped defined names and the active tab refer to sheets by position
+    return re.sub(r'\b(localSheetId|activeTab)="(\d+)"',
+                  lambda match: f'{match.group(1)}="{new_position.get(int(match.group(2)), int(match.group(2)))}"',
+                  workbook_xml)
+
+
+def replace_sheets_with_writer(workbook_path, sheets, front=()):
+    """Replace sheets through openpyxl; other sheets are kept by append mode"""
+    with pd.ExcelWriter(workbook_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+        for sheet_name in reversed(list(front)):
+            worksheet = writer.book[sheet_name]
+            writer.book._sheets.remove(worksheet)
+            writer.book._sheets.insert(0, worksheet)
+
+
+def replace_sheets(workbook_path, sheets, front=()):
+    """Replace or add the given sheets of an .xlsx without touching the others.
+
+    sheets is {sheet name: DataFrame}, written like to_excel(index=False).
+    Only the worksheet parts of those sheets are rewritten: every other part
+    of the package, including the other sheets' XML, formatting and
+    formulas, is copied over unchanged. Rows are rendered straight to XML,
+    column by column, with no cell objects in between; date cells get the
+    number formats to_excel would give them. Sheets named in front are
+    moved, in that order, ahead of all the others. The result is written
+    to a temporary file next to the workbook and swapped in, so a locked
+    workbook raises PermissionError and is left as it was.
+    """
+    if not sheets:
+        return
+
+    # Times, durations and zoned datetimes are left to openpyxl
+    if any(needs_writer(df) for df in sheets.values()):
+        replace_sheets_with_writer(workbook_path, sheets, front)
+        return
+
+    with zipfile.ZipFile(workbook_path) as source:
+        entries = {info.filename: source.read(info.filename) for info in source.infolist()}
+        infos = source.infolist()
+
+    workbook_xml = entries['xl/workbook.xml'].decode('utf-8')
+    workbook_rels = entries['xl/_rels/workbook.xml.rels'].decode('utf-8')
+    content_types = entries['[Content_Types].xml'].decode('utf-8')
+
+    relationships = {attribute(tag, 'Id'): tag for tag in re.findall(r'<Relationship\s[^>]*>', workbook_rels)}
+    sheet_parts = {}
+    for tag in re.findall(r'<(?:\w+:)?sheet\s[^>]*>', workbook_xml):
+        relationship = relationships.get(attribute(tag, 'r:id'))
+        sheet_parts[attribute(tag, 'name')] = part_path(attribute(relationship, 'Target')) if relationship else None
+
+    # A sheet whose part cannot be resolved is left to openpyxl rather than duplicated
+    if any(sheet_parts.get(escape(name, {'"': '&quot;'}), '') is None for name in sheets):
+        replace_sheets_with_writer(workbook_path, sheets, front)
+        return
+
+    date_styles = None
+    if any(has_date_values(df) for df in sheets.values()):
+        styles_xml = entries.get('xl/styles.xml', b'').decode('utf-8')
+        # Date cells need number formats from styles.xml; a stylesheet we cannot edit goes to openpyxl
+        if '<cellXfs' not in styles_xml or re.search(r'<\w+:styleSheet\b', styles_xml):
+            replace_sheets_with_writer(workbook_path, sheets, front)
+            return
+        styles_xml, datetime_style = add_number_format(styles_xml, DATETIME_FORMAT)
+        styles_xml, date_style = add_number_format(styles_xml, DATE_FORMAT)
+        entries['xl/styles.xml'] = styles_xml.encode('utf-8')
+        date1904 = re.search(r'<(?:\w+:)?workbookPr\s[^>]*date1904="(?:1|true)"', workbook_xml)
+        date_styles = DateStyles(datetime_style, date_style, MAC_EPOCH if date1904 else WINDOWS_EPOCH)
+
+    removed = set()
+    for sheet_name, df in sheets.items():
+        escaped_name = escape(sheet_name, {'"': '&quot;'})
+        part = sheet_parts.get(escaped_name)
+
+        if escaped_name not in sheet_parts:
+            # New sheet: add the part, its relationship and its <sheet> entry
+            number = 1
+            while f'xl/worksheets/sheet{number}.xml' in entries:
+                number += 1
+            part = f'xl/worksheets/sheet{number}.xml'
+
+            relationship_number = 1
+            while f'rId{relationship_number}' in relationships:
+                relationship_number += 1
+            relationship_id = f'rId{relationship_number}'
+            relationships[relationship_id] = ''
+
+            sheet_ids = [int(value) for value in re.findall(r'<(?:\w+:)?sheet\s[^>]*\ssheetId="(\d+)"', workbook_xml)]
+            sheet_id = max(sheet_ids, default=0) + 1
+            prefix = re.search(r'<(\w+:)?sheets[\s>]', workbook_xml).group(1) or ''
+            workbook_xml = workbook_xml.replace(
+                f'</{prefix}sheets>',
+                f'<{prefix}sheet name="{escaped_name}" sheetId="{sheet_id}" r:id="{relationship_id}"/></{prefix}sheets>', 1)
+            if 'xmlns:r=' not in workbook_xml[:workbook_xml.index('>', workbook_xml.index('<' + prefix + 'workbook'))]:
+                workbook_xml = workbook_xml.replace(f'<{prefix}workbook ', f'<{prefix}workbook xmlns:r="{REL_NS}" ', 1)
+            workbook_rels = workbook_rels.replace(
+                '</Relationships>',
+                f'<Relationship Id="{relationship_id}" Type="{WORKSHEET_TYPE}" '
+                f'Target="/{part}"/></Relationships>', 1)
+            content_types = content_types.replace(
+                '</Types>', f'<Override PartName="/{part}" ContentType="{WORKSHEET_CONTENT_TYPE}"/></Types>', 1)
+            sheet_parts[escaped_name] = part
+        else:
+            # Drawings, tables and comments belonged to the old sheet contents
+            removed.add(rels_path(part))
+
+        entries[part] = sheet_xml(df, date_styles)
+
+    if front:
+        workbook_xml = move_sheets_to_front(workbook_xml, [escape(name, {'"': '&quot;'}) for name in front])
+
+    # Parts only the replaced sheets used would linger, and an orphan table keeps its name reserved
+    for part in orphaned_parts(entries, removed):
+        removed.add(part)
+        content_types = re.sub(r'<(?:\w+:)?Override\s[^>]*PartName="/' + re.escape(part) + r'"[^>]*/>', '', content_types)
+
+    # The calculation chain may point at cells that no longer hold formulas; Excel rebuilds it
+    if 'xl/calcChain.xml' in entries:
+        removed.add('xl/calcChain.xml')
+        workbook_rels = re.sub(r'<Relationship\s[^>]*calcChain[^>]*/>', '', workbook_rels)
+        content_types = re.sub(r'<Override\s[^>]*calcChain[^>]*/>', '', content_types)
+
+    entries['xl/workbook.xml'] = workbook_xml.encode('utf-8')
+    entries['xl/_rels/workbook.xml.rels'] = workbook_rels.encode('utf-8')
+    entries['[Content_Types].xml'] = content_types.encode('utf-8')
+
+    names = [info.filename for info in infos if info.filename not in removed]
+    names += [name for name in entries if name not in names and name not in removed]
+    compression = {info.filename: info.compress_type for info in infos}
+
+    # The '~' prefix keeps find_excel_file from picking up a leftover temp file
+    folder = os.path.dirname(os.path.abspath(workbook_path))
+    handle, temp_path = tempfile.mkstemp(prefix='~', suffix='.xlsx', dir=folder)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            # Every part is recompressed, so favour speed over a few percent of file size
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as target:
+                for name in names:
+                    target.writestr(name, entries[name], compression.get(name, zipfile.ZIP_DEFLATED))
+        # mkstemp creates the file owner-only; keep the workbook's own permissions
+        shutil.copymode(workbook_path, temp_path)
+        os.replace(temp_path, workbook_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,418 @@
+import weakref
+import numpy as np
+import pandas as pd
+from sheet_reader import read_sheet
+
+# Weight keys used by the calculation sheets and their 構造物番号 sheet columns
+WEIGHT_COLUMNS = {'A': '構造形式_重み', 'B': '角度_重み', 'C': '供用年数_重み'}
+
+# Names the 演算子‐2 formula uses for the same three weights
+OPERATOR_VARIABLES = ['A1', 'B1', 'C1']
+
+# Columns whose normalized values make up the lookup keys
+KEY_COLUMNS = ['路線名', '構造物名称', '駅間']
+
+
+def is_blank_value(value):
+    """Return True for values the sheet generators treat as empty"""
+    return pd.isna(value) or str(value).strip() in ['', 'nan']
+
+
+def normalize_key_column(values):
+    """Vectorized str(value).strip() with NaN mapped to ''"""
+    # Key columns repeat a handful of names, so strip each distinct value once
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    if not all(isinstance(value, str) for value in uniques):
+        # factorize folds 1, 1.0 and True together; keep their own str() forms
+        return values.where(values.notna(), '').astype(str).str.strip()
+    stripped = np.array([value.strip() for value in uniques] + [''], dtype=object)
+    return pd.Series(stripped[codes], index=values.index, dtype=object)
+
+
+def map_distinct(values, func):
+    """values.apply(func), calling func once per distinct value"""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    if not all(isinstance(value, str) for value in uniques):
+        return values.apply(func)
+    mapped = np.array([func(value) for value in uniques] + [func(np.nan)], dtype=object)
+    return pd.Series(mapped[codes], index=values.index, dtype=object)
+
+
+def frame_column(df, column):
+    """Return df[column], or a column of '' when the frame does not have it"""
+    if column in df.columns:
+        return df[column]
+    return pd.Series([''] * len(df), index=df.index, dtype=object)
+
+
+def build_ekikan_keys(df):
+    """Build the 駅（始）→駅（至） lookup key for every row, '' when either end is empty"""
+    starts = normalize_key_column(frame_column(df, '駅（始）'))
+    ends = normalize_key_column(frame_column(df, '駅（至）'))
+    ekikan = starts + '→' + ends
+    return ekikan.where((starts != '') & (ends != ''), '')
+
+
+def build_raw_ekikan_keys(df):
+    """Build 駅間 keys from the raw cell values, as add_enhanced_columns always has"""
+    starts = frame_column(df, '駅（始）').tolist()
+    ends = frame_column(df, '駅（至）').tolist()
+    return pd.Series([f"{start}→{end}" if start and end else '' for start, end in zip(starts, ends)],
+                     index=df.index, dtype=object)
+
+
+class StructureIndex:
+    """Hash index over the 構造物番号 sheet.
+
+    Built once per structure DataFrame and keyed by (路線名, 構造物名称) and
+    (路線名, 駅間). Each key keeps the position of its first matching row, so
+    lookups return the same row the old boolean-mask scans picked with
+    matches.iloc[0].
+    """
+
+    def __init__(self, structure_df):
+        self.source = weakref.ref(structure_df) if structure_df is not None else (lambda: None)
+        self.by_name = {}
+        self.by_ekikan = {}
+        self.columns = {}
+        self.key_columns = {}
+        self.resolved_columns = {}
+        self.key_tables = {}
+
+        if structure_df is None or len(structure_df) == 0:
+            return
+
+        # Keep plain column lists so lookups never touch the DataFrame again
+        self.columns = {col: structure_df[col].tolist() for col in structure_df.columns}
+
+        # Normalize the key columns once; edits only renormalize the changed rows
+        for key_col in KEY_COLUMNS:
+            if key_col in structure_df.columns:
+                self.key_columns[key_col] = structure_df[key_col].astype(str).str.strip().tolist()
+
+        self.rebuild_key_maps()
+
+    def rebuild_key_maps(self):
+        """Rebuild both key maps from the normalized key columns"""
+        self.by_name = {}
+        self.by_ekikan = {}
+        self.resolved_columns = {}
+        self.key_tables = {}
+
+        rosen_keys = self.key_columns.get('路線名')
+        if rosen_keys is None:
+            return
+
+        # setdefault keeps the first matching row
+        for key_col, key_map in (('構造物名称', self.by_name), ('駅間', self.by_ekikan)):
+            values = self.key_columns.get(key_col)
+            if values is None:
+                continue
+            for position, (rosen, value) in enumerate(zip(rosen_keys, values)):
+                if pd.isna(rosen) or pd.isna(value):
+                    continue
+                key_map.setdefault((rosen, value), position)
+
+    def update_rows(self, structure_df, positions):
+        """Refresh the index in place for edited or appended rows of structure_df.
+
+        Only the given row positions are re-read and renormalized; the key maps
+        are then rebuilt from the cached key columns.
+        """
+        positions = sorted(set(int(p) for p in positions))
+        self.source = weakref.ref(structure_df)
+
+        if len(self) == 0 or list(self.columns) != list(structure_df.columns):
+            # First rows or a changed layout: nothing worth keeping
+            self.__init__(structure_df)
+            return
+
+        row_count = len(structure_df)
+        for col in structure_df.columns:
+            values = self.columns[col]
+            del values[row_count:]
+            values.extend([None] * (row_count - len(values)))
+
+        if positions:
+            changed = structure_df.iloc[positions]
+            for col in structure_df.columns:
+                values = self.columns[col]
+                for position, value in zip(positions, changed[col].tolist()):
+                    values[position] = value
+
+        for key_col, keys in self.key_columns.items():
+            del keys[row_count:]
+            keys.extend([None] * (row_count - len(keys)))
+            if positions:
+                normalized = changed[key_col].astype(str).str.strip().tolist()
+                for position, key in zip(positions, normalized):
+                    keys[position] = key
+
+        self.rebuild_key_maps()
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    @staticmethod
+    def normalize_rosen(rosen_name):
+        """Normalize a route name the same way the per-row lookups did"""
+        return str(rosen_name).strip() if pd.notna(rosen_name) else ''
+
+    @staticmethod
+    def normalize_query(value):
+        """Normalize a 構造物名称/駅間 query value, returning '' when it is empty"""
+        if not isinstance(value, str) and pd.isna(value):
+            return ''
+        if not value or str(value).strip() in ['', 'nan', 'NaN']:
+            return ''
+        return str(value).strip()
+
+    def find_position_by_name(self, rosen_name, kozo_name):
+        """Return the first row position matching (路線名, 構造物名称), or None"""
+        kozo_name = self.normalize_query(kozo_name)
+        if not kozo_name:
+            return None
+        return self.by_name.get((self.normalize_rosen(rosen_name), kozo_name))
+
+    def find_position_by_ekikan(self, rosen_name, ekikan):
+        """Return the first row position matching (路線名, 駅間), or None"""
+        ekikan = self.normalize_query(ekikan)
+        if not ekikan:
+            return None
+        return self.by_ekikan.get((self.normalize_rosen(rosen_name), ekikan))
+
+    def resolved_column(self, column, convert=None):
+        """Return column values with blanks and failed conversions as None.
+
+        Computed once per (column, convert) over the structure master so that
+        both scalar and bulk lookups only need a position to get a value.
+        """
+        cache_key = (column, convert)
+        if cache_key not in self.resolved_columns:
+            resolved = []
+            for value in self.columns.get(column, [None] * len(self)):
+                if is_blank_value(value):
+                    resolved.append(None)
+                    continue
+                if convert is None:
+                    resolved.append(value)
+                    continue
+                try:
+                    resolved.append(convert(value))
+                except (ValueError, TypeError):
+                    resolved.append(None)
+            self.resolved_columns[cache_key] = resolved
+
+        return self.resolved_columns[cache_key]
+
+    def lookup_value(self, rosen_name, kozo_name, ekikan, column, convert=None):
+        """Lookup column with structure name first, then station interval.
+
+        Falls back to the 駅間 match when the name match is missing, blank, or
+        cannot be converted. Returns None when neither match gives a value.
+        """
+        resolved = self.resolved_column(column, convert)
+
+        for position in (self.find_position_by_name(rosen_name, kozo_name),
+                         self.find_position_by_ekikan(rosen_name, ekikan)):
+            if position is not None and resolved[position] is not None:
+                return resolved[position]
+
+        return None
+
+    def lookup_structure_number(self, rosen_name, kozo_name, ekikan):
+        """Lookup 構造物番号, returning '' when not found"""
+        bangou = self.lookup_value(rosen_name, kozo_name, ekikan, '構造物番号')
+        return str(bangou).strip() if bangou is not None else ''
+
+    def key_table(self, key_map):
+        """Return a key map as a DataFrame that can be joined against"""
+        cache_key = id(key_map)
+        if cache_key not in self.key_tables:
+            self.key_tables[cache_key] = pd.DataFrame(
+                [(rosen, value, position) for (rosen, value), position in key_map.items()],
+                columns=['_rosen_key', '_lookup_key', '_position']
+            )
+        return self.key_tables[cache_key]
+
+    def anti_join(self, keys_df, key_map):
+        """Return the rows of keys_df (_rosen_key, _lookup_key) that have no match in key_map"""
+        joined = keys_df.merge(self.key_table(key_map), how='left',
+                               on=['_rosen_key', '_lookup_key'], indicator=True)
+        return keys_df[(joined['_merge'] == 'left_only').to_numpy()]
+
+    def join_positions(self, rosen_keys, lookup_keys, key_map):
+        """Left-join query keys against a key map and return matched row positions"""
+        query = pd.DataFrame({'_rosen_key': rosen_keys.to_numpy(dtype=object),
+                              '_lookup_key': lookup_keys.to_numpy(dtype=object)})
+        joined = query.merge(self.key_table(key_map), how='left', on=['_rosen_key', '_lookup_key'])
+
+        # Empty query values never match, as in the per-row lookups
+        positions = joined['_position'].where(query['_lookup_key'] != '')
+        return positions.to_numpy(dtype=float)
+
+    def frame_positions(self, df, ekikan_keys=None):
+        """Join every row of df against both key maps.
+
+        Returns (name_positions, ekikan_positions) as float arrays aligned to
+        the rows of df, with NaN where the row has no match.
+        """
+        if ekikan_keys is None:
+            ekikan_keys = build_ekikan_keys(df)
+
+        rosen_keys = normalize_key_column(frame_column(df, '路線名'))
+        kozo_keys = normalize_key_column(frame_column(df, '構造物名称'))
+        kozo_keys = kozo_keys.where(~kozo_keys.isin(['nan', 'NaN']), '')
+        ekikan_keys = normalize_key_column(ekikan_keys)
+        ekikan_keys = ekikan_keys.where(~ekikan_keys.isin(['nan', 'NaN']), '')
+
+        return (self.join_positions(rosen_keys, kozo_keys, self.by_name),
+                self.join_positions(rosen_keys, ekikan_keys, self.by_ekikan))
+
+    def take(self, positions, column, convert=None):
+        """Return resolved values of column at row positions, None where a position is NaN"""
+        resolved = np.array(self.resolved_column(column, convert) + [None], dtype=object)
+        missing = np.isnan(positions)
+        return resolved[np.where(missing, len(resolved) - 1, np.nan_to_num(positions)).astype(int)]
+
+    def take_with_fallback(self, name_positions, ekikan_positions, column, convert=None):
+        """Take values at the name match, falling back to the 駅間 match where blank"""
+        values = self.take(name_positions, column, convert)
+        fallback = pd.isna(values)
+        if fallback.any():
+            values[fallback] = self.take(ekikan_positions[fallback], column, convert)
+        return values
+
+    def lookup_frame(self, df, column, convert=None, ekikan_keys=None):
+        """Bulk lookup of column for every row of df.
+
+        Runs a keyed left join on (路線名, 構造物名称) and a second one on
+        (路線名, 駅間), which is used for the rows whose name match was missing
+        or blank. Returns a list aligned to the rows of df with None where
+        nothing was found.
+        """
+        if len(df) == 0 or len(self) == 0:
+            return [None] * len(df)
+
+        name_positions, ekikan_positions = self.frame_positions(df, ekikan_keys)
+        return self.take_with_fallback(name_positions, ekikan_positions, column, convert).tolist()
+
+    def lookup_structure_numbers(self, df, ekikan_keys=None):
+        """Bulk lookup of 構造物番号 for every row of df, '' when not found"""
+        numbers = self.lookup_frame(df, '構造物番号', ekikan_keys=ekikan_keys)
+        return [str(bangou).strip() if bangou is not None else '' for bangou in numbers]
+
+    def resolve_attributes(self, df):
+        """Resolve A/B/C weights, 長さ(m) and 構造物番号 for every row of df in one pass.
+
+        Both key joins run once and every attribute is taken from their
+        positions, with the same rules the per-row lookups used:
+          - A/B/C come from the first matching row (name, else 駅間); blank or
+            non-numeric weights default to 1.0
+          - 長さ(m) falls back to the 駅間 match when the name match is blank,
+            and is NaN when no length is found
+          - 構造物番号 uses the raw 駅（始）→駅（至） key like add_enhanced_columns
+        Returns a DataFrame aligned to df.index.
+        """
+        attributes = pd.DataFrame(index=df.index)
+
+        if len(df) == 0 or len(self) == 0:
+            for key in WEIGHT_COLUMNS:
+                attributes[key] = 1.0
+            attributes['長さ(m)'] = np.nan
+            attributes['構造物番号'] = ''
+            return attributes
+
+        ekikan_keys = build_ekikan_keys(df)
+        name_positions, ekikan_positions = self.frame_positions(df, ekikan_keys)
+        row_positions = np.where(np.isnan(name_positions), ekikan_positions, name_positions)
+
+        for key, column in WEIGHT_COLUMNS.items():
+            weights = pd.Series(self.take(row_positions, column, float), index=df.index, dtype=float)
+            attributes[key] = weights.fillna(1.0)
+
+        lengths = self.take_with_fallback(name_positions, ekikan_positions, '長さ(m)', float)
+        attributes['長さ(m)'] = pd.Series(lengths, index=df.index, dtype=float)
+
+        # 構造物番号 is keyed on the raw station cells; only rejoin rows whose key differs
+        raw_ekikan_keys = normalize_key_column(build_raw_ekikan_keys(df))
+        changed = (raw_ekikan_keys != ekikan_keys).to_numpy()
+        if changed.any():
+            ekikan_positions = ekikan_positions.copy()
+            ekikan_positions[changed] = self.frame_positions(df[changed], raw_ekikan_keys[changed])[1]
+        numbers = self.take_with_fallback(name_positions, ekikan_positions, '構造物番号')
+        attributes['構造物番号'] = [str(bangou).strip() if bangou is not None else '' for bangou in numbers]
+
+        return attributes
+
+    def resolve_operator_weights(self, df):
+        """Resolve the 演算子‐2 A1/B1/C1 weights for every row of df.
+
+        Unlike resolve_attributes, a row with a 構造物名称 is matched by name
+        only; the 駅間 match is used when the name is empty. Blank or
+        non-numeric weights default to 1.0. Returns a DataFrame aligned to
+        df.index.
+        """
+        weights = pd.DataFrame(index=df.index)
+        positions = np.full(len(df), np.nan)
+
+        if len(df) > 0 and len(self) > 0:
+            name_positions, ekikan_positions = self.frame_positions(df)
+            has_name = (normalize_key_column(frame_column(df, '構造物名称')) != '').to_numpy()
+            positions = np.where(has_name, name_positions, ekikan_positions)
+
+        for key, column in zip(OPERATOR_VARIABLES, WEIGHT_COLUMNS.values()):
+            values = pd.Series(self.take(positions, column, float), index=df.index, dtype=float)
+            weights[key] = values.fillna(1.0)
+
+        return weights
+
+
+# One index per structure DataFrame, rebuilt only when a different frame is passed
+_structure_index_cache = {}
+
+
+def get_structure_index(structure_df):
+    """Return the cached StructureIndex for structure_df, building it on first use"""
+    key = id(structure_df)
+    index = _structure_index_cache.get(key)
+
+    if index is None or index.source() is not structure_df:
+        # Drop entries whose frames have been garbage collected
+        for stale_key in [k for k, v in _structure_index_cache.items() if v.source() is None]:
+            del _structure_index_cache[stale_key]
+
+        index = StructureIndex(structure_df)
+        _structure_index_cache[key] = index
+
+    return index
+
+
+def invalidate_structure_index(structure_df):
+    """Drop the cached StructureIndex for structure_df"""
+    _structure_index_cache.pop(id(structure_df), None)
+
+
+def update_structure_index(structure_df, positions, previous_df=None):
+    """Update the cached StructureIndex after rows of structure_df changed.
+
+    positions are the row positions that were edited or appended. When the
+    rows were appended with pd.concat, pass the frame they were appended to as
+    previous_df so its index is carried over instead of rebuilt.
+    """
+    source_df = previous_df if previous_df is not None else structure_df
+    index = _structure_index_cache.pop(id(source_df), None)
+
+    if index is None or index.source() is not source_df:
+        return get_structure_index(structure_df)
+
+    index.update_rows(structure_df, positions)
+    _structure_index_cache[id(structure_df)] = index
+    return index
+
+
+def load_structure_master(workbook_path):
+    """Read the 構造物番号 sheet and build its StructureIndex up front"""
+    structure_df = read_sheet(workbook_path, '構造物番号')
+    get_structure_index(structure_df)
+    return structure_df
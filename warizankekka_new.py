@@ -4,8 +4,10 @@ from openpyxl import load_workbook
 import tkinter as tk
 from tkinter import ttk, filedialog
 import os
-import re
 import warnings
+from structure_index import get_structure_index, load_structure_master, build_raw_ekikan_keys, map_distinct
+from year_matrix import (year_result_columns, year_column_mapping, divided_year_matrix, write_year_matrix,
+                         load_year_sheets)
 
 # Suppress pandas warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -57,66 +59,35 @@ class EnhancedDivisionSheetsApp:
         try:
             if structure_df is None or len(structure_df) == 0:
                 return ''
-                
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
-            
-            # First try to match by structure name
-            if kozo_name and str(kozo_name).strip() not in ['', 'nan', 'NaN']:
-                kozo_name = str(kozo_name).strip()
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
             
-            # If not found by structure name, try by station interval
-            if ekikan and str(ekikan).strip() not in ['', 'nan', 'NaN']:
-                ekikan = str(ekikan).strip()
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    bangou = matches.iloc[0]['構造物番号']
-                    if pd.notna(bangou) and str(bangou).strip() not in ['', 'nan']:
-                        return str(bangou).strip()
-            
-            return ''
+            # Hash lookup by (路線名, 構造物名称), falling back to (路線名, 駅間)
+            structure_index = get_structure_index(structure_df)
+            return structure_index.lookup_structure_number(rosen_name, kozo_name, ekikan)
             
         except Exception:
             return ''
     
-    def add_enhanced_columns(self, df, structure_df=None):
+    def add_enhanced_columns(self, df, structure_df=None, structure_numbers=None):
         """Add enhanced columns: 路線名略称 and 構造物番号"""
         enhanced_df = df.copy()
         
         # Add 路線名略称 column
         if '路線名' in enhanced_df.columns:
-            enhanced_df['路線名略称'] = enhanced_df['路線名'].apply(self.abbreviate_sen_name)
+            enhanced_df['路線名略称'] = map_distinct(enhanced_df['路線名'], self.abbreviate_sen_name)
         else:
             enhanced_df['路線名略称'] = ''
         
         # Add 構造物番号 column
         enhanced_df['構造物番号'] = ''
         
-        if structure_df is not None:
-            for index, row in enhanced_df.iterrows():
-                rosen_name = row.get('路線名', '')
-                kozo_name = row.get('構造物名称', '')
-                
-                # Create ekikan for lookup
-                ekikan = ''
-                if row.get('駅（始）', '') and row.get('駅（至）', ''):
-                    ekikan = f"{row.get('駅（始）', '')}→{row.get('駅（至）', '')}"
-                
-                # Lookup structure number
-                bangou = self.lookup_structure_number(structure_df, rosen_name, kozo_name, ekikan)
-                enhanced_df.at[index, '構造物番号'] = bangou
+        if structure_df is not None and structure_numbers is not None:
+            # 構造物番号 already resolved together with the length
+            enhanced_df['構造物番号'] = list(structure_numbers)
+        elif structure_df is not None and len(structure_df) > 0:
+            # Bulk lookup: join on structure name, then on 駅間 for the unmatched rows
+            structure_index = get_structure_index(structure_df)
+            ekikan_keys = build_raw_ekikan_keys(enhanced_df)
+            enhanced_df['構造物番号'] = structure_index.lookup_structure_numbers(enhanced_df, ekikan_keys)
         
         return enhanced_df
     
@@ -264,7 +235,7 @@ class EnhancedDivisionSheetsApp:
             
             # Load structure data for enhancements
             try:
-                self.structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+                self.structure_df = load_structure_master(self.workbook_path)
             except:
                 self.structure_df = None
             
@@ -293,10 +264,14 @@ class EnhancedDivisionSheetsApp:
             self.progress_bar.config(value=60)
             self.root.update()
             
-            # Load required sheets
-            max_df = pd.read_excel(self.workbook_path, sheet_name='補修無視')
-            hoshuu_df = pd.read_excel(self.workbook_path, sheet_name='補修考慮')
-            structure_df = pd.read_excel(self.workbook_path, sheet_name='構造物番号')
+            # Load required sheets, converting their year columns to float64 once
+            source_sheets = load_year_sheets(self.workbook_path, ['補修無視', '補修考慮'])
+            max_df = source_sheets['補修無視']
+            hoshuu_df = source_sheets['補修考慮']
+            # Reuse the structure master loaded during validation
+            structure_df = self.structure_df
+            if structure_df is None:
+                structure_df = load_structure_master(self.workbook_path)
             
             # Create enhanced division results - First sheet
             max_division_df = self.apply_enhanced_division_logic(max_df, structure_df, "補修無視")
@@ -342,104 +317,26 @@ class EnhancedDivisionSheetsApp:
         """Apply enhanced division logic to a dataframe"""
         result_df = source_df.copy()
         
-        # Find year result columns
-        year_columns = [col for col in result_df.columns if col.endswith('結果')]
-        
-        # Rename year columns to include "合計重み/長さ"
-        column_mapping = {}
-        for col in year_columns:
-            # Extract year from column name (e.g., "2018 結果" -> "2018")
-            year_match = re.search(r'(\d{4})', col)
-            if year_match:
-                year = year_match.group(1)
-                new_col_name = f"{year} 合計重み/長さ"
-                column_mapping[col] = new_col_name
-        
+        # Rename year result columns to "{year} 合計重み/長さ" in one go
+        column_mapping = year_column_mapping(year_result_columns(result_df), '合計重み/長さ')
         result_df = result_df.rename(columns=column_mapping)
         
-        # Apply division for each row
-        for index, row in result_df.iterrows():
-            # Get structure name and station interval
-            kozo_name = str(row.get('構造物名称', '')).strip() if pd.notna(row.get('構造物名称', '')) else ''
-            
-            # Try to construct ekikan from 駅（始） and 駅（至）
-            eki_start = str(row.get('駅（始）', '')).strip() if pd.notna(row.get('駅（始）', '')) else ''
-            eki_end = str(row.get('駅（至）', '')).strip() if pd.notna(row.get('駅（至）', '')) else ''
-            
-            ekikan = ''
-            if eki_start and eki_end:
-                ekikan = f"{eki_start}→{eki_end}"
-            
-            # Find corresponding length in structure data
-            length_value = self.find_length_value(structure_df, kozo_name, ekikan, row.get('路線名', ''))
-            
-            # Divide year result columns by length
-            for old_col, new_col in column_mapping.items():
-                original_value = source_df.loc[index, old_col] if old_col in source_df.columns else None
-                
-                if pd.notna(original_value) and str(original_value).strip() not in ['', 'nan']:
-                    try:
-                        numeric_value = float(original_value)
-                        if length_value and length_value > 0:
-                            divided_value = numeric_value / length_value
-                            # Fix FutureWarning by explicitly converting to float
-                            result_df.loc[index, new_col] = float(round(divided_value, 3))
-                        else:
-                            result_df.loc[index, new_col] = float(numeric_value)
-                    except (ValueError, TypeError):
-                        result_df.loc[index, new_col] = original_value
-                else:
-                    result_df.loc[index, new_col] = original_value
+        # Resolve the length vector once (100.0 when no length is found)
+        attributes = get_structure_index(structure_df).resolve_attributes(result_df)
+        lengths = attributes['長さ(m)'].fillna(100.0)
+        
+        # Divide the whole year block by length; blank and non-numeric cells pass through
+        divided, numeric = divided_year_matrix(source_df, list(column_mapping), lengths)
+        write_year_matrix(result_df, list(column_mapping.values()), divided, numeric)
         
         # Add enhanced columns
-        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df)
+        enhanced_df = self.add_enhanced_columns(result_df, self.structure_df, attributes['構造物番号'])
         
         # Reorder columns
         final_df = self.reorder_columns_enhanced(enhanced_df)
         
         return final_df
 
-    def find_length_value(self, structure_df, kozo_name, ekikan, rosen_name):
-        """Find length value from structure data"""
-        try:
-            rosen_name = str(rosen_name).strip() if pd.notna(rosen_name) else ''
-            
-            # First try to match by structure name
-            if kozo_name:
-                matches = structure_df[
-                    (structure_df['構造物名称'].astype(str).str.strip() == kozo_name) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # If not found by structure name, try by station interval
-            if ekikan:
-                matches = structure_df[
-                    (structure_df['駅間'].astype(str).str.strip() == ekikan) & 
-                    (structure_df['路線名'].astype(str).str.strip() == rosen_name)
-                ]
-                
-                if not matches.empty:
-                    length_val = matches.iloc[0]['長さ(m)']
-                    if pd.notna(length_val) and str(length_val).strip() not in ['', 'nan']:
-                        try:
-                            return float(length_val)
-                        except (ValueError, TypeError):
-                            pass
-            
-            # Default length if not found
-            return 100.0
-            
-        except Exception:
-            return 100.0
-
     def save_enhanced_division_results(self, max_division_df, hoshuu_division_df):
         """Save enhanced division results to Excel sheets"""
         try:
@@ -0,0 +1,120 @@
+import io
+import pandas as pd
+from sheet_cache import SheetCache
+from sheet_writer import replace_sheets
+
+
+def headerless_frame(df):
+    """Return df as read with header=None: the column names become the first row"""
+    rows = [list(df.columns)] + df.astype(object).values.tolist()
+    return pd.DataFrame(rows)
+
+
+class WorkbookSession:
+    """The master workbook, parsed once and shared by every stage of a run.
+
+    The file is read into memory on first use and each sheet is parsed at
+    most once per header setting. Stages get copies of the parsed frames,
+    hand changed sheets back with write_sheet and call save(); flush()
+    writes only the sheets marked dirty. Sheets unchanged since an earlier
+    run are loaded from the sidecar SheetCache instead of being parsed.
+
+    A deferred session turns save() into a no-op, so a whole run stages its
+    sheets in memory and commits them with a single flush() at the end. An
+    aborted run leaves the workbook exactly as it was.
+    """
+
+    def __init__(self, workbook_path, deferred=False):
+        self.workbook_path = workbook_path
+        self.deferred = deferred
+        self.package = None
+        self.cache = None
+        self.excel_file = None
+        self.names = None
+        self.frames = {}
+        self.dirty = []
+
+    def read_package(self):
+        """Read the workbook file once; the cache and the parser both work from memory"""
+        if self.package is None:
+            with open(self.workbook_path, 'rb') as f:
+                self.package = io.BytesIO(f.read())
+            self.cache = SheetCache(self.workbook_path, source=self.package)
+        return self.package
+
+    def open_package(self):
+        """Open the in-memory package for parsing; only needed when a sheet misses the cache"""
+        if self.excel_file is None:
+            self.excel_file = pd.ExcelFile(io.BytesIO(self.read_package().getvalue()))
+        return self.excel_file
+
+    @property
+    def sheet_names(self):
+        """Sheet names of the workbook, including sheets written in this session"""
+        if self.names is None:
+            self.read_package()
+            self.names = self.cache.sheet_names()
+            if self.names is None:
+                self.names = list(self.open_package().sheet_names)
+        return self.names + [name for name in self.dirty if name not in self.names]
+
+    def has_sheet(self, sheet_name):
+        """Return True when the workbook or this session has the sheet"""
+        return sheet_name in self.sheet_names
+
+    def read_sheet(self, sheet_name, header=0):
+        """Return a copy of the parsed sheet; header is passed on like read_excel"""
+        key = (sheet_name, header)
+        if key not in self.frames:
+            self.read_package()
+            self.frames[key] = self.cache.read(sheet_name, lambda: self.open_package().parse(sheet_name, header=header), header)
+        return self.frames[key].copy()
+
+    def read_sheets(self, sheet_names):
+        """Return {sheet name: DataFrame} for several sheets"""
+        return {sheet_name: self.read_sheet(sheet_name) for sheet_name in sheet_names}
+
+    def write_sheet(self, sheet_name, df):
+        """Replace a sheet in the session and mark it to be written on flush"""
+        for key in [key for key in self.frames if key[0] == sheet_name]:
+            del self.frames[key]
+        self.frames[(sheet_name, 0)] = df.copy()
+        self.frames[(sheet_name, None)] = headerless_frame(df)
+        if sheet_name not in self.dirty:
+            self.dirty.append(sheet_name)
+
+    def save(self):
+        """Write the dirty sheets now, or leave them for the run's flush when deferred"""
+        if not self.deferred:
+            self.flush()
+
+    def flush(self):
+        """Write the dirty sheets to the workbook in one save.
+
+        replace_sheets writes a temporary file and swaps it in, so when the
+        workbook is locked the file is left untouched and the sheets stay
+        dirty for another attempt.
+        """
+        if not self.dirty:
+            return
+
+        try:
+            replace_sheets(self.workbook_path, {sheet_name: self.frames[(sheet_name, 0)] for sheet_name in self.dirty})
+        except PermissionError:
+            raise PermissionError(f"Cannot access {self.workbook_path}")
+
+        # Parsed frames stay valid; only the in-memory package is out of date
+        self.names = self.sheet_names
+        self.dirty = []
+        self.package = None
+        self.cache = None
+        self.excel_file = None
+
+    def reload(self):
+        """Forget everything parsed, e.g. after another program changed the file"""
+        self.package = None
+        self.cache = None
+        self.excel_file = None
+        self.names = None
+        self.frames = {}
+        self.dirty = []
@@ -0,0 +1,264 @@
+import re
+import weakref
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from sheet_reader import SheetReader
+
+# Cell texts the calculation sheets treat as empty; the 補修 sheets only skip ''
+BLANK_STRINGS = ('', 'nan')
+
+
+def year_result_columns(df):
+    """Return the '…結果' year columns of df in sheet order"""
+    return [col for col in df.columns if str(col).endswith('結果')]
+
+
+def convert_year_value(value):
+    """Convert one cell once for both blank rules: (float, convertible, is 'nan' text)
+
+    convertible follows the 補修 sheets, where only NaN and '' are blank; the
+    calculation sheets also treat the text 'nan' as blank.
+    """
+    if pd.isna(value):
+        return np.nan, False, False
+    text = str(value).strip()
+    if text == '':
+        return np.nan, False, False
+    try:
+        return float(value), True, text == 'nan'
+    except (ValueError, TypeError):
+        return np.nan, False, text == 'nan'
+
+
+def year_column_cells(column):
+    """Return (values, convertible, nan_text) for one year column as arrays"""
+    if is_numeric_dtype(column.dtype) and not is_bool_dtype(column.dtype):
+        values = column.to_numpy(dtype=float, na_value=np.nan)
+        return values, ~np.isnan(values), np.zeros(len(values), dtype=bool)
+
+    # Convert each distinct cell once and scatter the results back
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    converted = [convert_year_value(value) for value in uniques] + [(np.nan, False, False)]
+    unique_values = np.array([value for value, _, _ in converted], dtype=float)
+    unique_convertible = np.array([convertible for _, convertible, _ in converted], dtype=bool)
+    unique_nan_text = np.array([nan_text for _, _, nan_text in converted], dtype=bool)
+    return unique_values[codes], unique_convertible[codes], unique_nan_text[codes]
+
+
+def year_column_mapping(columns, label):
+    """Map each year column to its '{year} {label}' name, skipping columns without a year"""
+    column_mapping = {}
+    for col in columns:
+        year_match = re.search(r'(\d{4})', str(col))
+        if year_match:
+            column_mapping[col] = f"{year_match.group(1)} {label}"
+    return column_mapping
+
+
+class YearColumns:
+    """Year result columns of one sheet, converted to float64 once.
+
+    values holds every cell float() accepts, alongside masks of the
+    convertible cells and of the text 'nan', so both blank rules are answered
+    from the same arrays. The original objects stay in the frame and are only
+    read back for passthrough cells.
+    """
+
+    def __init__(self, df, columns=None):
+        self.source = weakref.ref(df)
+        self.columns = year_result_columns(df) if columns is None else list(columns)
+        self.positions = {col: position for position, col in enumerate(self.columns)}
+
+        shape = (len(df), len(self.columns))
+        self.values = np.full(shape, np.nan)
+        self.convertible = np.zeros(shape, dtype=bool)
+        self.nan_text = np.zeros(shape, dtype=bool)
+
+        for position, col in enumerate(self.columns):
+            (self.values[:, position], self.convertible[:, position],
+             self.nan_text[:, position]) = year_column_cells(df[col])
+
+    def covers(self, columns):
+        return all(col in self.positions for col in columns)
+
+    def matrix(self, columns, blank_strings=BLANK_STRINGS):
+        """Return (values, numeric mask) of columns under a blank rule, NaN where not numeric"""
+        positions = [self.positions[col] for col in columns]
+        numeric = self.convertible[:, positions]
+        if 'nan' in blank_strings:
+            numeric = numeric & ~self.nan_text[:, positions]
+        return np.where(numeric, self.values[:, positions], np.nan), numeric
+
+
+# Typed year columns of the sheets read through load_year_sheets
+_loaded_year_columns = {}
+
+
+def loaded_year_columns(df):
+    """Return the YearColumns converted when df was loaded, or None"""
+    typed = _loaded_year_columns.get(id(df))
+    if typed is not None and typed.source() is df:
+        return typed
+    return None
+
+
+def load_year_sheets(workbook_path, sheet_names):
+    """Read the calculation source sheets and convert their year columns to float64 once.
+
+    Returns {sheet name: DataFrame}. The sheet generators only read these
+    frames (results are built on copies), so year_value_matrix can reuse the
+    typed columns instead of checking every cell again.
+    """
+    with SheetReader(workbook_path) as reader:
+        sheets = {sheet_name: reader.read(sheet_name) for sheet_name in sheet_names}
+
+    # Drop entries whose frames have been garbage collected
+    for stale_key in [key for key, typed in _loaded_year_columns.items() if typed.source() is None]:
+        del _loaded_year_columns[stale_key]
+
+    for df in sheets.values():
+        _loaded_year_columns[id(df)] = YearColumns(df)
+
+    return sheets
+
+
+def year_value_matrix(df, columns, blank_strings=BLANK_STRINGS):
+    """Pull the year columns of df into a float64 matrix and a numeric-cell mask.
+
+    Cells that are blank or cannot be converted with float() are NaN in the
+    matrix and False in the mask, so callers can pass them through untouched.
+    Frames read with load_year_sheets are served from their typed columns.
+    """
+    typed = loaded_year_columns(df)
+    if typed is None or not typed.covers(columns):
+        typed = YearColumns(df, columns)
+    return typed.matrix(columns, blank_strings)
+
+
+def write_year_matrix(df, columns, values, numeric, source_df=None, source_columns=None):
+    """Write calculated values back into df where numeric is True.
+
+    Every other cell keeps the original value from source_df[source_columns]
+    (df[columns] by default), exactly like the per-cell loops did.
+    """
+    if source_df is None:
+        source_df = df
+    if source_columns is None:
+        source_columns = columns
+
+    for position, (col, source_col) in enumerate(zip(columns, source_columns)):
+        original = source_df[source_col]
+        mask = numeric[:, position]
+
+        if is_numeric_dtype(original.dtype) and not is_bool_dtype(original.dtype):
+            df[col] = np.where(mask, values[:, position], original.to_numpy(dtype=float, na_value=np.nan))
+        else:
+            column_values = original.to_numpy(dtype=object, copy=True)
+            column_values[mask] = values[mask, position]
+            df[col] = column_values
+
+    return df
+
+
+def round_values(values, digits=3):
+    """np.round that matches Python round() on the values it is applied to.
+
+    np.round scales by 10**digits first, which can tip a value that is just
+    below a half up to it; those near-half cells are rounded with round().
+    """
+    rounded = np.round(values, digits)
+    scaled = values * 10 ** digits
+    near_half = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if near_half.any():
+        rounded[near_half] = [round(float(value), digits) for value in values[near_half]]
+    return rounded
+
+
+def multiply_by_weights(values, *weights):
+    """Multiply each row of values by per-row weight vectors, unrounded.
+
+    The weights are applied left to right so the products match the scalar
+    X * A * B * C of the per-row loops.
+    """
+    for weight in weights:
+        values = values * np.asarray(weight, dtype=float).reshape(-1, 1)
+    return values
+
+
+def weighted_year_matrix(df, columns, *weights):
+    """X*A*B*C for every year cell: returns (rounded values, numeric mask)"""
+    values, numeric = year_value_matrix(df, columns)
+    return round_values(multiply_by_weights(values, *weights)), numeric
+
+
+def divide_by_lengths(values, lengths, round_undivided=False):
+    """Divide each row of values by its length, rounded to 3 places.
+
+    Rows whose length is missing or not positive are not divided; they keep
+    their values unrounded unless round_undivided is set.
+    """
+    lengths = np.asarray(lengths, dtype=float).reshape(-1, 1)
+    divides = lengths > 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        divided = round_values(values / np.where(divides, lengths, 1.0))
+
+    if round_undivided:
+        return divided
+    return np.where(divides, divided, values)
+
+
+def divided_year_matrix(df, columns, lengths):
+    """X ÷ length for every year cell: returns (values, numeric mask)
+
+    Rows whose length is missing or not positive keep X unrounded; divided
+    values are rounded to 3 places, as in the per-row division loops.
+    """
+    values, numeric = year_value_matrix(df, columns)
+    return divide_by_lengths(values, lengths), numeric
+
+
+def running_max_year_matrix(df, columns):
+    """補修無視: forward running maximum along the years, skipping blank and non-numeric cells
+
+    Returns (values, numeric mask). A literal 'nan' cell restarts the maximum
+    in the per-cell rule (every comparison with NaN is False), so the few rows
+    holding one are replayed with that rule instead of the accumulate.
+    """
+    values, numeric = year_value_matrix(df, columns, blank_strings=('',))
+    running_max = np.maximum.accumulate(np.where(numeric, values, -np.inf), axis=1)
+
+    for row in np.flatnonzero((numeric & np.isnan(values)).any(axis=1)):
+        previous_value = None
+        for position in np.flatnonzero(numeric[row]):
+            current_value = values[row, position]
+            if previous_value is None or not current_value < previous_value:
+                previous_value = current_value
+            running_max[row, position] = previous_value
+
+    return running_max, numeric
+
+
+def backfilled_year_matrix(df, columns, fill_value=0.1):
+    """補修考慮: when a value drops below the previous numeric year, every earlier year becomes fill_value
+
+    Only the last drop of each row matters, so the cells before it are filled
+    in one step. Returns (values, written mask); filled cells count as written
+    even when they were blank.
+    """
+    values, numeric = year_value_matrix(df, columns, blank_strings=('',))
+    positions = np.arange(len(columns))
+
+    # Value of the previous numeric year for every cell
+    last_numeric = np.maximum.accumulate(np.where(numeric, positions, -1), axis=1)
+    previous = np.full_like(last_numeric, -1)
+    previous[:, 1:] = last_numeric[:, :-1]
+    previous_values = np.take_along_axis(values, np.maximum(previous, 0), axis=1)
+
+    with np.errstate(invalid='ignore'):
+        drops = numeric & (previous >= 0) & (values < previous_values)
+    last_drop = np.where(drops, positions, -1).max(axis=1, initial=-1)
+    filled = positions < last_drop.reshape(-1, 1)
+
+    return np.where(filled, fill_value, values), numeric | filled